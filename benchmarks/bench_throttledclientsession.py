@@ -0,0 +1,299 @@
+"""
+Benchmark ThrottledClientSession rate-limiter overhead and accuracy
+against a local aiohttp server.
+
+Reports for each scenario (rate limit, concurrency, number of filters):
+
+- achieved rate vs. the rate limit
+- jitter of intervals between requests
+- CPU time per request (client process only)
+- event loop lag
+
+Usage:
+
+    python benchmarks/bench_throttledclientsession.py --rate 50 --rate 200 \\
+        --concurrency 1 --concurrency 20 --filters 0 --filters 10 --json results.json
+
+Use --json-size to fetch JSON of given size with get_url_JSON() and
+--offload-threshold to set the size above which JSON is decoded in an
+--offload-executor ('process' or 'thread' pool). Compare the event loop lag
+with and without offloading:
+
+    python benchmarks/bench_throttledclientsession.py --rate 5 --concurrency 1 \\
+        --filters 0 --json-size 5000000 --stdlib-json --offload-threshold 0
+
+JSON decoders hold the GIL, so a thread pool does not reduce the lag. A
+process pool does, at the cost of throughput. The lag left comes from
+unpickling the decoded object in the event loop's process.
+"""
+
+from asyncio import CancelledError, Task, create_task, gather, get_running_loop, sleep
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import pairwise, product
+from multiprocessing import Process
+from pathlib import Path
+from statistics import mean, pstdev
+from typing import Annotated, Any, Optional
+import json
+import logging
+import time
+
+from aiohttp import web
+from typer import Option
+
+from pyutils import AsyncTyper, ThrottledClientSession
+from pyutils.utils import JSON_LOADS, JSONLoads, get_url_JSON
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+HOST: str = "localhost"
+PORT: int = 8890
+LAG_INTERVAL: float = 0.01
+
+app = AsyncTyper()
+
+
+async def _handle_text(request: web.Request) -> web.Response:
+    return web.Response(text="OK")
+
+
+async def _handle_json(request: web.Request) -> web.Response:
+    """Return JSON list of roughly 'size' bytes"""
+    size: int = int(request.query.get("size", 1000))
+    item: dict[str, Any] = {"id": 1234567890, "name": "abcdefghij", "value": 0.5}
+    n: int = max(size // len(json.dumps(item)), 1)
+    return web.json_response([item] * n)
+
+
+class _Server(Process):
+    def __init__(self, host: str = HOST, port: int = PORT):
+        super().__init__(daemon=True)
+        self._host: str = host
+        self._port: int = port
+
+    def run(self) -> None:
+        server = web.Application()
+        server.add_routes([web.get("/", _handle_text), web.get("/json", _handle_json)])
+        web.run_app(server, host=self._host, port=self._port, print=None)
+
+
+class LoopLagMonitor:
+    """Measure event loop lag, i.e. how late a sleep() wakes up"""
+
+    def __init__(self, interval: float = LAG_INTERVAL) -> None:
+        self._interval: float = interval
+        self._lags: list[float] = list()
+        self._task: Optional[Task] = None
+
+    async def _monitor(self) -> None:
+        loop = get_running_loop()
+        try:
+            while True:
+                start: float = loop.time()
+                await sleep(self._interval)
+                self._lags.append(max(loop.time() - start - self._interval, 0))
+        except CancelledError:
+            pass
+
+    def start(self) -> None:
+        self._task = create_task(self._monitor())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await gather(self._task)
+
+    @property
+    def mean(self) -> float:
+        return mean(self._lags) if len(self._lags) > 0 else 0
+
+    @property
+    def max(self) -> float:
+        return max(self._lags, default=0)
+
+
+async def _worker(
+    session: ThrottledClientSession, url: str, n: int, timings: list[float]
+) -> None:
+    for _ in range(n):
+        async with session.get(url) as resp:
+            timings.append(time.monotonic())
+            await resp.read()
+
+
+async def _worker_json(
+    session: ThrottledClientSession,
+    url: str,
+    n: int,
+    timings: list[float],
+    loads: JSONLoads,
+    executor: Executor | None,
+    offload_threshold: int | None,
+) -> None:
+    for _ in range(n):
+        if (
+            await get_url_JSON(
+                session,
+                url,
+                loads=loads,
+                executor=executor,
+                executor_threshold=offload_threshold,
+            )
+            is None
+        ):
+            error(f"could not fetch JSON: {url}")
+        timings.append(time.monotonic())
+
+
+async def run_scenario(
+    url: str,
+    rate_limit: float,
+    concurrency: int,
+    filters: int,
+    N: int,
+    json_size: int = 0,
+    loads: JSONLoads = JSON_LOADS,
+    executor: Executor | None = None,
+    offload_threshold: int | None = None,
+) -> dict[str, float | int]:
+    """Run N requests with 'concurrency' workers and return results"""
+    timings: list[float] = list()
+    lag = LoopLagMonitor()
+    async with ThrottledClientSession(
+        rate_limit=rate_limit,
+        filters=[f"http://not-matching-{i}/" for i in range(filters)],
+    ) as session:
+        lag.start()
+        cpu_start: float = time.process_time()
+        start: float = time.monotonic()
+        if json_size > 0:
+            await gather(
+                *[
+                    _worker_json(
+                        session,
+                        f"{url}json?size={json_size}",
+                        N // concurrency,
+                        timings,
+                        loads,
+                        executor,
+                        offload_threshold,
+                    )
+                    for _ in range(concurrency)
+                ]
+            )
+        else:
+            await gather(
+                *[
+                    _worker(session, url, N // concurrency, timings)
+                    for _ in range(concurrency)
+                ]
+            )
+        elapsed: float = time.monotonic() - start
+        cpu: float = time.process_time() - cpu_start
+        await lag.stop()
+    n: int = len(timings)
+    timings.sort()
+    intervals: list[float] = [t1 - t0 for t0, t1 in pairwise(timings)]
+    rate: float = (n - 1) / (timings[-1] - timings[0]) if n > 1 else 0
+    return {
+        "rate_limit": rate_limit,
+        "concurrency": concurrency,
+        "filters": filters,
+        "json_size": json_size,
+        "offload_threshold": -1 if offload_threshold is None else offload_threshold,
+        "requests": n,
+        "elapsed": elapsed,
+        "rate": rate,
+        "rate_error_pct": (rate / rate_limit - 1) * 100 if rate_limit > 0 else 0,
+        "jitter_ms": pstdev(intervals) * 1000 if len(intervals) > 1 else 0,
+        "cpu_per_request_us": cpu / n * 1e6 if n > 0 else 0,
+        "loop_lag_mean_ms": lag.mean * 1000,
+        "loop_lag_max_ms": lag.max * 1000,
+    }
+
+
+def _print_result(res: dict[str, float | int]) -> None:
+    print(
+        f"rate limit {res['rate_limit']:7.1f} | concurrency {res['concurrency']:4d} | "
+        + f"filters {res['filters']:3d} | rate {res['rate']:7.1f} ({res['rate_error_pct']:+5.1f}%) | "
+        + f"jitter {res['jitter_ms']:6.2f} ms | CPU/request {res['cpu_per_request_us']:7.1f} us | "
+        + f"loop lag {res['loop_lag_mean_ms']:5.2f} / {res['loop_lag_max_ms']:5.2f} ms"
+    )
+
+
+@app.async_command()
+async def main(
+    rate: Annotated[
+        list[float], Option(help="rate limit(s) to benchmark, requests/sec")
+    ] = [20, 100, 500],
+    concurrency: Annotated[
+        list[int], Option(help="number(s) of concurrent workers")
+    ] = [1, 10, 50],
+    filters: Annotated[list[int], Option(help="number(s) of URL filters")] = [0, 10],
+    json_size: Annotated[
+        int, Option(help="fetch JSON of given size (bytes) with get_url_JSON()")
+    ] = 0,
+    offload_threshold: Annotated[
+        Optional[int],
+        Option(help="decode JSON larger than this (bytes) in an executor"),
+    ] = None,
+    stdlib_json: Annotated[
+        bool,
+        Option(help="decode JSON with json.loads() instead of orjson (if installed)"),
+    ] = False,
+    offload_executor: Annotated[
+        str, Option(help="executor to decode JSON in: 'process' or 'thread' pool")
+    ] = "process",
+    duration: Annotated[float, Option(help="duration of a scenario, secs")] = 5,
+    port: Annotated[int, Option(help="port of the local test server")] = PORT,
+    json_file: Annotated[
+        Optional[Path], Option("--json", help="write results to a JSON file")
+    ] = None,
+) -> None:
+    """Benchmark ThrottledClientSession"""
+    server = _Server(port=port)
+    server.start()
+    await sleep(1)  # wait the server to start
+    url: str = f"http://{HOST}:{port}/"
+    results: list[dict[str, float | int]] = list()
+    executor: Executor | None = None
+    if offload_threshold is not None:
+        assert offload_executor in ("process", "thread"), (
+            "--offload-executor has to be 'process' or 'thread'"
+        )
+        executor = (
+            ProcessPoolExecutor()
+            if offload_executor == "process"
+            else ThreadPoolExecutor()
+        )
+    try:
+        for rate_limit, workers, n_filters in product(rate, concurrency, filters):
+            N: int = max(int(rate_limit * duration), workers)
+            res = await run_scenario(
+                url,
+                rate_limit,
+                workers,
+                n_filters,
+                N,
+                json_size=json_size,
+                loads=json.loads if stdlib_json else JSON_LOADS,
+                executor=executor,
+                offload_threshold=offload_threshold,
+            )
+            _print_result(res)
+            results.append(res)
+    finally:
+        server.terminate()
+        if executor is not None:
+            executor.shutdown()
+    if json_file is not None:
+        with open(json_file, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    app()
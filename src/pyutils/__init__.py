@@ -1,12 +1,33 @@
 from .asyncqueue import AsyncQueue as AsyncQueue
 from .asynctyper import AsyncTyper as AsyncTyper
 from .awrap import awrap as awrap
+from .batchloader import BatchLoader as BatchLoader
 from .bucketmapper import BucketMapper as BucketMapper
+from .bytelimiter import ByteLimiter as ByteLimiter
+from .circuitbreaker import (
+    CircuitBreaker as CircuitBreaker,
+    CircuitOpenError as CircuitOpenError,
+)
+from .clock import (
+    Clock as Clock,
+    LoopClock as LoopClock,
+    SystemClock as SystemClock,
+    VirtualTimeEventLoop as VirtualTimeEventLoop,
+)
+from .concurrencycontroller import ConcurrencyController as ConcurrencyController
 from .counterqueue import CounterQueue as CounterQueue, QCounter as QCounter
 from .eventcounter import EventCounter as EventCounter
+from .fetchengine import FetchEngine as FetchEngine
 from .filequeue import FileQueue as FileQueue
+from .histogram import Histogram as Histogram
+from .httparchive import HTTPArchive as HTTPArchive, HTTPArchiveMiss as HTTPArchiveMiss
+from .httpcache import HTTPCache as HTTPCache
 from .iterablequeue import IterableQueue as IterableQueue, QueueDone as QueueDone
 from .multilevelformatter import MultilevelFormatter as MultilevelFormatter
+from .ratecounter import RateCounter as RateCounter
+from .ratelimiter import RateLimiter as RateLimiter
+from .retrypolicy import RetryPolicy as RetryPolicy
+from .sessionpool import SessionPool as SessionPool
 from .throttledclientsession import (
     ThrottledClientSession as ThrottledClientSession,
     UrlFilter as UrlFilter,
@@ -23,12 +44,26 @@ __all__ = [
     "asyncqueue",
     "asynctyper",
     "awrap",
+    "batchloader",
     "bucketmapper",
+    "bytelimiter",
+    "circuitbreaker",
+    "clock",
+    "compression",
+    "concurrencycontroller",
     "counterqueue",
     "eventcounter",
+    "fetchengine",
     "filequeue",
+    "histogram",
+    "httparchive",
+    "httpcache",
     "iterablequeue",
     "multilevelformatter",
+    "ratecounter",
+    "ratelimiter",
+    "retrypolicy",
+    "sessionpool",
     "throttledclientsession",
     "urlqueue",
     "utils",
@@ -0,0 +1,204 @@
+## -----------------------------------------------------------
+#  Class BatchLoader()
+#
+#  Batch individual key loads into bulk requests
+#  (DataLoader pattern)
+## -----------------------------------------------------------
+
+from asyncio import (
+    CancelledError,
+    Future,
+    Task,
+    TimerHandle,
+    create_task,
+    gather,
+    get_running_loop,
+    shield,
+)
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Generic,
+    Hashable,
+    Iterable,
+    Mapping,
+    Optional,
+    TypeVar,
+)
+import logging
+
+from .utils import MAX_RETRIES, HTTPSession, get_url_JSON
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+BatchFunction = Callable[[list[K]], Awaitable[Optional[Mapping[K, V]]]]
+
+
+class BatchLoader(Generic[K, V]):
+    """
+    Batch individual loads into bulk requests (DataLoader pattern).
+
+    Callers 'await loader.load(key)'. Keys are collected for 'linger' seconds
+    or until 'max_batch' keys are pending, then 'batch_fn' is called once
+    with the list of keys. It returns a mapping of keys to values that is
+    fanned out to the callers. Keys missing from the result (or a None
+    result) load as None, and an exception fails all loads of the batch.
+
+    Concurrent loads of the same key share a single fetch.
+    """
+
+    def __init__(
+        self,
+        batch_fn: BatchFunction[K, V],
+        max_batch: int = 100,
+        linger: float = 0.01,
+    ) -> None:
+        assert max_batch > 0, "max_batch has to be positive"
+        assert linger >= 0, "linger cannot be negative"
+        self._batch_fn: BatchFunction[K, V] = batch_fn
+        self._max_batch: int = max_batch
+        self._linger: float = linger
+        self._pending: dict[K, Future[Optional[V]]] = dict()
+        self._inflight: dict[K, Future[Optional[V]]] = dict()
+        self._timer: Optional[TimerHandle] = None
+        self._tasks: set[Task[None]] = set()
+        self._loads: int = 0
+        self._batches: int = 0
+        self._keys: int = 0
+
+    @classmethod
+    def from_url(
+        cls,
+        session: HTTPSession,
+        url: str,
+        param: str,
+        split: Callable[[Any], Mapping[K, V]],
+        sep: str = ",",
+        max_batch: int = 100,
+        linger: float = 0.01,
+        retries: int = MAX_RETRIES,
+    ) -> "BatchLoader[K, V]":
+        """Create a loader for an API that accepts a list of IDs as a query
+        parameter ('url?param=1,2,3'). 'split' maps the JSON response to
+        a dict of key: value"""
+
+        async def batch_fn(keys: list[K]) -> Optional[Mapping[K, V]]:
+            query: str = sep.join(str(key) for key in keys)
+            res: Any = await get_url_JSON(
+                session,
+                f"{url}{'&' if '?' in url else '?'}{param}={query}",
+                retries=retries,
+            )
+            if res is None:
+                return None
+            return split(res)
+
+        return cls(batch_fn, max_batch=max_batch, linger=linger)
+
+    @property
+    def loads(self) -> int:
+        """Number of load() calls"""
+        return self._loads
+
+    @property
+    def batches(self) -> int:
+        """Number of batches fetched"""
+        return self._batches
+
+    @property
+    def keys(self) -> int:
+        """Number of keys fetched"""
+        return self._keys
+
+    @property
+    def stats_dict(self) -> dict[str, float | int]:
+        return {
+            "loads": self._loads,
+            "batches": self._batches,
+            "keys": self._keys,
+            "batch_size": self._keys / self._batches if self._batches > 0 else 0,
+        }
+
+    async def load(self, key: K) -> Optional[V]:
+        """Load a value. Returns None if the key was not found"""
+        self._loads += 1
+        if (fut := self._pending.get(key)) is None and (
+            fut := self._inflight.get(key)
+        ) is None:
+            fut = get_running_loop().create_future()
+            self._pending[key] = fut
+            if len(self._pending) >= self._max_batch:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = get_running_loop().call_later(
+                    self._linger, self._dispatch
+                )
+        return await shield(fut)
+
+    async def load_many(self, keys: Iterable[K]) -> list[Optional[V]]:
+        """Load values of keys"""
+        return list(await gather(*[self.load(key) for key in keys]))
+
+    def _dispatch(self) -> None:
+        """Fetch pending keys as a batch"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if len(self._pending) == 0:
+            return None
+        batch: dict[K, Future[Optional[V]]] = self._pending
+        self._pending = dict()
+        self._inflight.update(batch)
+        task: Task[None] = create_task(self._fetch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: dict[K, Future[Optional[V]]]) -> None:
+        self._batches += 1
+        self._keys += len(batch)
+        try:
+            res: Optional[Mapping[K, V]] = await self._batch_fn(list(batch))
+            for key, fut in batch.items():
+                if not fut.done():
+                    fut.set_result(None if res is None else res.get(key))
+        except CancelledError:
+            for fut in batch.values():
+                fut.cancel()
+            raise
+        except Exception as err:
+            debug(f"batch of {len(batch)} keys failed: {err}")
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(err)
+                    fut.exception()  # mark retrieved when nobody was waiting
+        finally:
+            for key, fut in batch.items():
+                if self._inflight.get(key) is fut:
+                    del self._inflight[key]
+
+    async def flush(self) -> None:
+        """Fetch pending keys now and wait for all batches to complete"""
+        self._dispatch()
+        if self._tasks:
+            await gather(*self._tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        """Cancel pending and running batches"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for fut in self._pending.values():
+            fut.cancel()
+        self._pending = dict()
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,157 @@
+## -----------------------------------------------------------
+#  Class ByteLimiter()
+#
+#  Bandwidth (bytes/sec) limiting with a token bucket over bytes
+## -----------------------------------------------------------
+
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Optional
+import logging
+
+from aiohttp import StreamReader
+from aiohttp.streams import AsyncStreamIterator, ChunkTupleAsyncStreamIterator
+
+from .clock import Clock, SYSTEM_CLOCK
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+UPLOAD_CHUNK_SIZE: int = 64 * 1024  # bytes
+
+
+class ByteLimiter:
+    """
+    Token bucket over bytes.
+
+    The bucket holds up to 'burst' bytes (default: 1 sec worth of 'rate').
+    acquire(n) takes n bytes from the bucket and sleeps while the bucket is
+    in debt, so chunks larger than 'burst' and concurrent streams are
+    limited to 'rate' bytes/sec in total.
+    """
+
+    def __init__(
+        self, rate: float, burst: Optional[float] = None, clock: Clock = SYSTEM_CLOCK
+    ) -> None:
+        assert rate > 0, "rate has to be positive"
+        if burst is None:
+            burst = rate
+        assert burst > 0, "burst has to be positive"
+        self._rate: float = rate
+        self._burst: float = burst
+        self._clock: Clock = clock
+        self._tokens: float = burst
+        self._updated: float = clock.monotonic()
+        self._bytes: int = 0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def bytes(self) -> int:
+        """Number of bytes passed through the limiter"""
+        return self._bytes
+
+    async def acquire(self, n: int) -> None:
+        """Wait until n bytes can be passed"""
+        now: float = self._clock.monotonic()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+        self._tokens -= n
+        self._bytes += n
+        if self._tokens < 0:
+            await self._clock.sleep(-self._tokens / self._rate)
+
+
+class ThrottledStreamReader:
+    """
+    Proxy for aiohttp.StreamReader (ClientResponse.content) that passes the
+    data read through ByteLimiters. Reading slower than the data arrives
+    fills the StreamReader's buffer, which pauses reading from the socket.
+    """
+
+    def __init__(
+        self,
+        stream: StreamReader,
+        limiters: list[ByteLimiter],
+        on_read: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        self._stream: StreamReader = stream
+        self._limiters: list[ByteLimiter] = limiters
+        self._on_read: Optional[Callable[[int], None]] = on_read
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+    async def _throttle(self, data: bytes) -> bytes:
+        if (n := len(data)) > 0:
+            if self._on_read is not None:
+                self._on_read(n)
+            for limiter in self._limiters:
+                await limiter.acquire(n)
+        return data
+
+    async def read(self, n: int = -1) -> bytes:
+        if n < 0:
+            # read all in chunks to throttle reading from the socket
+            chunks: list[bytes] = list()
+            while chunk := await self.readany():
+                chunks.append(chunk)
+            return b"".join(chunks)
+        return await self._throttle(await self._stream.read(n))
+
+    async def readany(self) -> bytes:
+        return await self._throttle(await self._stream.readany())
+
+    async def readline(self, **kwargs: Any) -> bytes:
+        return await self._throttle(await self._stream.readline(**kwargs))
+
+    async def readuntil(self, separator: bytes = b"\n", **kwargs: Any) -> bytes:
+        return await self._throttle(await self._stream.readuntil(separator, **kwargs))
+
+    async def readexactly(self, n: int) -> bytes:
+        return await self._throttle(await self._stream.readexactly(n))
+
+    async def readchunk(self) -> tuple[bytes, bool]:
+        data, end_of_chunk = await self._stream.readchunk()
+        return await self._throttle(data), end_of_chunk
+
+    def __aiter__(self) -> AsyncStreamIterator[bytes]:
+        return AsyncStreamIterator(self.readline)
+
+    def iter_chunked(self, n: int) -> AsyncStreamIterator[bytes]:
+        return AsyncStreamIterator(lambda: self.read(n))
+
+    def iter_any(self) -> AsyncStreamIterator[bytes]:
+        return AsyncStreamIterator(self.readany)
+
+    def iter_chunks(self) -> ChunkTupleAsyncStreamIterator:
+        return ChunkTupleAsyncStreamIterator(self)  # type: ignore[arg-type]
+
+
+async def throttled_upload(
+    data: bytes | AsyncIterable[bytes],
+    limiters: list[ByteLimiter],
+    on_write: Optional[Callable[[int], None]] = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> AsyncIterator[bytes]:
+    """Async generator to upload a request body through ByteLimiters"""
+
+    async def chunks() -> AsyncIterator[bytes]:
+        if isinstance(data, (bytes, bytearray)):
+            for start in range(0, len(data), chunk_size):
+                yield bytes(data[start : start + chunk_size])
+        else:
+            async for chunk in data:
+                yield chunk
+
+    async for chunk in chunks():
+        if on_write is not None:
+            on_write(len(chunk))
+        for limiter in limiters:
+            await limiter.acquire(len(chunk))
+        yield chunk
@@ -0,0 +1,186 @@
+## -----------------------------------------------------------
+#  Class CircuitBreaker()
+#
+#  Per-host circuit breaker for ThrottledClientSession
+## -----------------------------------------------------------
+
+from asyncio import TimeoutError
+from typing import Iterable, Literal
+import logging
+
+from aiohttp import ClientConnectionError
+
+from .clock import Clock, SYSTEM_CLOCK
+from .ratecounter import RateCounter
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+CircuitState = Literal["closed", "half-open", "open"]
+
+# numeric states for stats_dict()
+CIRCUIT_STATES: dict[CircuitState, int] = {"closed": 0, "half-open": 1, "open": 2}
+
+FAILURE_STATUSES: frozenset[int] = frozenset([500, 502, 503, 504])
+FAILURE_EXCEPTIONS: tuple[type[BaseException], ...] = (
+    ClientConnectionError,
+    TimeoutError,
+)
+
+
+class CircuitOpenError(ClientConnectionError):
+    """Request was rejected since the host's circuit breaker is open"""
+
+    pass
+
+
+class _Circuit:
+    """Circuit breaker state of a host"""
+
+    def __init__(self, window: int, clock: Clock) -> None:
+        self.state: CircuitState = "closed"
+        self.requests: RateCounter = RateCounter(window=window, clock=clock)
+        self.errors: RateCounter = RateCounter(window=window, clock=clock)
+        self.consecutive: int = 0
+        self.opened: float = 0
+        self.probes: int = 0
+
+    def reset(self) -> None:
+        self.requests.reset()
+        self.errors.reset()
+        self.consecutive = 0
+        self.probes = 0
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker for ThrottledClientSession.
+
+    - closed: requests pass. The circuit opens after 'failures' consecutive
+      failures or when the error rate during the last 'window' seconds is
+      >= 'error_rate' (with at least 'min_requests' requests).
+    - open: requests fail fast with CircuitOpenError for 'open_time' seconds
+    - half-open: up to 'probes' concurrent probe requests pass. A successful
+      probe closes the circuit, a failed one opens it again.
+
+    Failures are responses with a status in 'statuses' and exceptions
+    in 'exceptions'.
+    """
+
+    def __init__(
+        self,
+        failures: int = 5,
+        error_rate: float = 0.5,
+        min_requests: int = 20,
+        window: int = 60,
+        open_time: float = 30,
+        probes: int = 1,
+        statuses: Iterable[int] = FAILURE_STATUSES,
+        exceptions: tuple[type[BaseException], ...] = FAILURE_EXCEPTIONS,
+        clock: Clock = SYSTEM_CLOCK,
+    ) -> None:
+        assert failures > 0, "failures has to be positive"
+        assert 0 < error_rate <= 1, "error_rate has to be 0 < error_rate <= 1"
+        assert min_requests > 0, "min_requests has to be positive"
+        assert open_time >= 0, "open_time cannot be negative"
+        assert probes > 0, "probes has to be positive"
+        self.failures: int = failures
+        self.error_rate: float = error_rate
+        self.min_requests: int = min_requests
+        self.window: int = window
+        self.open_time: float = open_time
+        self.probes: int = probes
+        self.statuses: frozenset[int] = frozenset(statuses)
+        self.exceptions: tuple[type[BaseException], ...] = exceptions
+        self._clock: Clock = clock
+        self._circuits: dict[str, _Circuit] = dict()
+        self._rejected: int = 0
+
+    @property
+    def rejected(self) -> int:
+        """Number of requests rejected by open circuits"""
+        return self._rejected
+
+    def _circuit(self, host: str) -> _Circuit:
+        if (circuit := self._circuits.get(host)) is None:
+            circuit = _Circuit(window=self.window, clock=self._clock)
+            self._circuits[host] = circuit
+        return circuit
+
+    def state(self, host: str) -> CircuitState:
+        """Circuit state of a host"""
+        if (circuit := self._circuits.get(host)) is None:
+            return "closed"
+        if (
+            circuit.state == "open"
+            and self._clock.monotonic() - circuit.opened >= self.open_time
+        ):
+            return "half-open"
+        return circuit.state
+
+    def states(self) -> dict[str, CircuitState]:
+        """Circuit states of all hosts seen"""
+        return {host: self.state(host) for host in self._circuits}
+
+    def allow(self, host: str) -> bool:
+        """Whether a request to host may be sent. A request allowed in
+        half-open state is a probe and its outcome has to be reported with
+        success(), failure() or cancel()"""
+        circuit: _Circuit = self._circuit(host)
+        if circuit.state == "open":
+            if self._clock.monotonic() - circuit.opened < self.open_time:
+                self._rejected += 1
+                return False
+            debug(f"circuit half-open: {host}")
+            circuit.state = "half-open"
+            circuit.probes = 0
+        if circuit.state == "half-open":
+            if circuit.probes >= self.probes:
+                self._rejected += 1
+                return False
+            circuit.probes += 1
+        return True
+
+    def success(self, host: str) -> None:
+        """Report a successful request"""
+        circuit: _Circuit = self._circuit(host)
+        if circuit.state == "half-open":
+            verbose(f"circuit closed: {host}")
+            circuit.state = "closed"
+            circuit.reset()
+        elif circuit.state == "closed":
+            circuit.requests.add()
+            circuit.consecutive = 0
+
+    def failure(self, host: str) -> None:
+        """Report a failed request"""
+        circuit: _Circuit = self._circuit(host)
+        if circuit.state == "half-open":
+            self._open(host, circuit)
+        elif circuit.state == "closed":
+            circuit.requests.add()
+            circuit.errors.add()
+            circuit.consecutive += 1
+            if circuit.consecutive >= self.failures:
+                self._open(host, circuit)
+            elif (requests := circuit.requests.count(self.window)) >= self.min_requests:
+                if circuit.errors.count(self.window) >= self.error_rate * requests:
+                    self._open(host, circuit)
+
+    def cancel(self, host: str) -> None:
+        """Report a request that was cancelled before completing"""
+        circuit: _Circuit = self._circuit(host)
+        if circuit.state == "half-open" and circuit.probes > 0:
+            circuit.probes -= 1
+
+    def is_failure(self, status: int) -> bool:
+        return status in self.statuses
+
+    def _open(self, host: str, circuit: _Circuit) -> None:
+        message(f"circuit open: {host}")
+        circuit.state = "open"
+        circuit.opened = self._clock.monotonic()
+        circuit.reset()
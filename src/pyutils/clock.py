@@ -0,0 +1,155 @@
+## -----------------------------------------------------------
+#  Class Clock()
+#
+#  Injectable clocks and a virtual-time event loop for
+#  deterministic simulations and tests
+## -----------------------------------------------------------
+
+from abc import ABC, abstractmethod
+from asyncio import Runner, SelectorEventLoop, get_running_loop, sleep
+from selectors import DefaultSelector, SelectorKey
+from typing import Any, Callable, Coroutine, Optional, TypeVar
+import logging
+import time
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+T = TypeVar("T")
+
+
+class Clock(ABC):
+    """Source of time for rate limiters and statistics"""
+
+    @abstractmethod
+    def monotonic(self) -> float:
+        """Monotonic time in seconds, e.g. for measuring durations"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def time(self) -> float:
+        """Wall-clock time in seconds since the epoch"""
+        raise NotImplementedError
+
+    async def sleep(self, delay: float) -> None:
+        await sleep(delay)
+
+    def start_io(self) -> Callable[[], None]:
+        """Mark network I/O (e.g. an HTTP request) in progress until the
+        returned function is called. Virtual clocks wait for the I/O"""
+        return _no_io
+
+
+def _no_io() -> None:
+    return None
+
+
+class SystemClock(Clock):
+    """System clock: time.monotonic() and time.time()"""
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        return time.time()
+
+
+class LoopClock(Clock):
+    """Clock of the running event loop (loop.time()). Follows virtual time
+    when run with VirtualTimeEventLoop. Has to be called in a running loop"""
+
+    def __init__(self) -> None:
+        self._offset: Optional[float] = None
+
+    def monotonic(self) -> float:
+        return get_running_loop().time()
+
+    def time(self) -> float:
+        if self._offset is None:
+            self._offset = time.time() - self.monotonic()
+        return self._offset + self.monotonic()
+
+    def start_io(self) -> Callable[[], None]:
+        if isinstance(loop := get_running_loop(), VirtualTimeEventLoop):
+            return loop.start_io()
+        return _no_io
+
+
+SYSTEM_CLOCK: Clock = SystemClock()
+
+
+class _VirtualTimeSelector(DefaultSelector):
+    """Selector that advances the loop's virtual time instead of waiting.
+    While I/O is in progress (see VirtualTimeEventLoop.start_io()), it waits
+    for the I/O and advances the time by the wall-clock time waited"""
+
+    def __init__(self, loop: "VirtualTimeEventLoop") -> None:
+        super().__init__()
+        self._loop: "VirtualTimeEventLoop" = loop
+
+    def select(self, timeout: Optional[float] = None) -> list[tuple[SelectorKey, int]]:
+        events: list[tuple[SelectorKey, int]] = super().select(0)
+        if len(events) > 0 or (timeout is not None and timeout <= 0):
+            return events
+        if timeout is None:  # nothing scheduled, wait for I/O
+            return super().select(None)
+        if self._loop.io_pending:
+            start: float = time.monotonic()
+            events = super().select(timeout)
+            self._loop.advance(min(time.monotonic() - start, timeout))
+            return events
+        self._loop.advance(timeout)
+        return events
+
+
+class VirtualTimeEventLoop(SelectorEventLoop):
+    """
+    Event loop with virtual time. When there are no ready callbacks, time
+    jumps to the next scheduled callback instead of waiting, so sleeps,
+    timeouts and rate limits take no wall-clock time.
+
+    I/O is real. While I/O is marked in progress with start_io() (e.g.
+    ThrottledClientSession requests in flight), the loop waits for the I/O
+    and the time runs at wall-clock speed, so that timeouts do not fire
+    before the peer could answer. Idle connections do not slow the time
+    down. Use with LoopClock(), which also marks the I/O.
+    """
+
+    def __init__(self, start: float = 0) -> None:
+        self._virtual_time: float = start
+        self._io: int = 0
+        super().__init__(selector=_VirtualTimeSelector(self))
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    @property
+    def io_pending(self) -> bool:
+        return self._io > 0
+
+    def start_io(self) -> Callable[[], None]:
+        """Mark I/O in progress until the returned function is called"""
+        self._io += 1
+        done: bool = False
+
+        def release() -> None:
+            nonlocal done
+            if not done:
+                done = True
+                self._io -= 1
+
+        return release
+
+    def advance(self, seconds: float) -> None:
+        """Advance virtual time"""
+        assert seconds >= 0, "time cannot go backwards"
+        self._virtual_time += seconds
+
+
+def run_virtual(main: Coroutine[Any, Any, T], debug: Optional[bool] = None) -> T:
+    """Run a coroutine in VirtualTimeEventLoop like asyncio.run()"""
+    with Runner(debug=debug, loop_factory=VirtualTimeEventLoop) as runner:
+        return runner.run(main)
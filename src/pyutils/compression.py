@@ -0,0 +1,72 @@
+## -----------------------------------------------------------
+#  Request body compression (brotli / gzip)
+## -----------------------------------------------------------
+
+from asyncio import get_running_loop
+from concurrent.futures import Executor
+from typing import Literal, get_args
+import gzip
+import logging
+
+import brotli  # type: ignore
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+ContentEncoding = Literal["br", "gzip"]
+
+ACCEPT_ENCODING: str = "gzip, deflate, br"
+COMPRESS_THRESHOLD: int = 1024  # bytes
+COMPRESS_EXECUTOR_THRESHOLD: int = 256 * 1024  # bytes
+BROTLI_QUALITY: int = 5  # 11 (max) is too slow for request bodies
+GZIP_LEVEL: int = 6
+
+
+def is_content_encoding(encoding: object) -> bool:
+    return isinstance(encoding, str) and encoding in get_args(ContentEncoding)
+
+
+def compress(data: bytes, encoding: ContentEncoding) -> bytes:
+    """Compress data with brotli or gzip"""
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    elif encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    raise ValueError(f"unsupported content encoding: {encoding}")
+
+
+async def compress_async(
+    data: bytes,
+    encoding: ContentEncoding,
+    executor: Executor | None = None,
+    executor_threshold: int = COMPRESS_EXECUTOR_THRESHOLD,
+) -> bytes:
+    """Compress data. Data larger than 'executor_threshold' bytes is compressed
+    in 'executor' (default: loop's default thread pool)"""
+    if len(data) > executor_threshold:
+        return await get_running_loop().run_in_executor(
+            executor, compress, data, encoding
+        )
+    return compress(data, encoding)
+
+
+async def compress_body(
+    data: bytes | str,
+    encoding: ContentEncoding,
+    threshold: int = COMPRESS_THRESHOLD,
+    executor: Executor | None = None,
+) -> bytes | None:
+    """Compress a request body. Returns None if the body is smaller than
+    'threshold' bytes or does not compress"""
+    if isinstance(data, str):
+        data = data.encode()
+    if len(data) < threshold:
+        return None
+    body: bytes = await compress_async(data, encoding, executor=executor)
+    if len(body) >= len(data):
+        debug(f"{encoding} compression did not reduce body size: {len(data)} bytes")
+        return None
+    return body
@@ -0,0 +1,313 @@
+## -----------------------------------------------------------
+#  Class ConcurrencyController()
+#
+#  Adaptive number of consumer tasks (gradient / Vegas-style
+#  concurrency limit)
+## -----------------------------------------------------------
+
+from asyncio import CancelledError, Queue, Task, create_task, gather
+from collections import deque
+from math import ceil, sqrt
+from typing import (
+    AsyncGenerator,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Generic,
+    Iterable,
+    NamedTuple,
+    Optional,
+    TypeVar,
+)
+import logging
+
+from .clock import Clock, SYSTEM_CLOCK
+from .iterablequeue import IterableQueue, QueueDone
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BASE_LATENCY_INTERVALS: int = 300  # intervals to track the no-load latency
+HOLD_INTERVALS: int = 5  # intervals at a steady state before probing higher
+
+
+class ConcurrencySample(NamedTuple):
+    """Measurements of an adjustment interval"""
+
+    time: float  # clock.monotonic() at the end of the interval
+    concurrency: int  # concurrency limit set for the next interval
+    throughput: float  # completed items/sec
+    latency: float  # mean latency, secs
+    errors: int
+
+
+class ConcurrencyController(Generic[T, R]):
+    """
+    Adjust the number of consumer tasks at runtime.
+
+    run() consumes items with 'func(item)' in worker tasks. Every 'interval'
+    seconds the concurrency limit is adjusted from the measured throughput
+    and latency:
+
+    - latency above 'tolerance' x the no-load latency (the minimum over the
+      recent intervals) or an error rate above 'max_error_rate' shrinks the
+      limit by the latency gradient (at most by half)
+    - rising throughput at flat latency grows the limit by sqrt(limit)
+    - flat throughput holds the limit (e.g. the rate limit is the bottleneck)
+      and probes +1 after a while
+
+    Workers above the limit exit after their current item. The current
+    limit and the history of adjustments are exported via 'concurrency',
+    'history' and 'stats_dict'.
+
+    Usage:
+        controller = ConcurrencyController(max_concurrency=50)
+        async for item, res in controller.run(queue, process):
+            ...
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,  # initial concurrency limit
+        min_concurrency: int = 1,
+        max_concurrency: int = 100,
+        interval: float = 1,  # secs between adjustments
+        tolerance: float = 1.5,  # max latency / no-load latency
+        max_error_rate: float = 0.1,
+        growth: float = 0.05,  # min relative throughput gain to keep growing
+        min_samples: int = 5,  # min completions per adjustment
+        history: int = 1000,  # adjustments kept in history
+        clock: Clock = SYSTEM_CLOCK,
+    ) -> None:
+        assert 0 < min_concurrency <= max_concurrency, (
+            "0 < min_concurrency <= max_concurrency is required"
+        )
+        assert min_concurrency <= concurrency <= max_concurrency, (
+            "concurrency has to be between min_concurrency and max_concurrency"
+        )
+        assert interval > 0, "interval has to be positive"
+        assert tolerance > 1, "tolerance has to be > 1"
+        assert 0 < max_error_rate <= 1, "max_error_rate has to be 0 < rate <= 1"
+        assert growth >= 0, "growth cannot be negative"
+        assert min_samples > 0, "min_samples has to be positive"
+        self._limit: int = concurrency
+        self._min: int = min_concurrency
+        self._max: int = max_concurrency
+        self._interval: float = interval
+        self._tolerance: float = tolerance
+        self._max_error_rate: float = max_error_rate
+        self._growth: float = growth
+        self._min_samples: int = min_samples
+        self._clock: Clock = clock
+        self._history: deque[ConcurrencySample] = deque(maxlen=history)
+        self._latencies: deque[float] = deque(maxlen=BASE_LATENCY_INTERVALS)
+        self._throughput: Optional[float] = None
+        self._latency: Optional[float] = None
+        self._holds: int = 0
+        self._active: int = 0
+        # measurements of the current interval
+        self._started: float = 0  # set by run()
+        self._completed: int = 0
+        self._errors: int = 0
+        self._latency_sum: float = 0
+        # totals
+        self._count: int = 0
+        self._error_count: int = 0
+
+    @property
+    def concurrency(self) -> int:
+        """Current concurrency limit"""
+        return self._limit
+
+    @property
+    def active(self) -> int:
+        """Number of worker tasks running"""
+        return self._active
+
+    @property
+    def history(self) -> list[ConcurrencySample]:
+        return list(self._history)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def stats_dict(self) -> dict[str, float | int]:
+        res: dict[str, float | int] = {
+            "concurrency": self._limit,
+            "active": self._active,
+            "count": self._count,
+            "errors": self._error_count,
+            "adjustments": len(self._history),
+        }
+        if len(self._history) > 0:
+            res["throughput"] = self._history[-1].throughput
+            res["latency"] = self._history[-1].latency
+        return res
+
+    @property
+    def stats(self) -> str:
+        stats: dict[str, float | int] = self.stats_dict
+        res: str = f"concurrency: {stats['concurrency']:.0f}, active: {stats['active']:.0f}, items: {stats['count']:.0f}, errors: {stats['errors']:.0f}"
+        if "throughput" in stats:
+            res += f", throughput: {stats['throughput']:.1f}/sec, latency: {stats['latency'] * 1000:.0f} ms"
+        return res
+
+    def add_sample(self, latency: float, error: bool = False) -> None:
+        """Record a completed item. Called by run()"""
+        self._count += 1
+        self._completed += 1
+        self._latency_sum += latency
+        if error:
+            self._error_count += 1
+            self._errors += 1
+
+    def adjust(self) -> int:
+        """Adjust the concurrency limit from the measurements since the last
+        adjustment. Returns the new limit"""
+        if self._completed < self._min_samples:
+            return self._limit
+        now: float = self._clock.monotonic()
+        elapsed: float = now - self._started
+        throughput: float = self._completed / elapsed if elapsed > 0 else 0
+        latency: float = self._latency_sum / self._completed
+        error_rate: float = self._errors / self._completed
+        self._latencies.append(latency)
+        base: float = min(self._latencies)
+
+        limit: int = self._limit
+        if error_rate > self._max_error_rate:
+            limit = int(limit * 0.5)
+            self._holds = 0
+        elif latency > self._tolerance * base:
+            gradient: float = max(0.5, self._tolerance * base / latency)
+            limit = int(limit * gradient)
+            self._holds = 0
+        elif (
+            self._throughput is None
+            or self._latency is None
+            or (
+                throughput > self._throughput * (1 + self._growth)
+                and latency <= self._latency * (1 + self._growth)
+            )
+        ):
+            limit += ceil(sqrt(limit))
+            self._holds = 0
+        else:
+            self._holds += 1
+            if self._holds >= HOLD_INTERVALS:
+                limit += 1  # probe
+                self._holds = 0
+        limit = max(self._min, min(self._max, limit))
+        if limit != self._limit:
+            debug(
+                f"concurrency {self._limit} -> {limit}: throughput {throughput:.1f}/sec, latency {latency * 1000:.0f} ms"
+            )
+        self._limit = limit
+        self._throughput = throughput
+        self._latency = latency
+        self._history.append(
+            ConcurrencySample(now, limit, throughput, latency, self._errors)
+        )
+        self._started = now
+        self._completed = 0
+        self._errors = 0
+        self._latency_sum = 0
+        return limit
+
+    async def run(
+        self,
+        items: IterableQueue[T] | Iterable[T] | AsyncIterable[T],
+        func: Callable[[T], Awaitable[R]],
+    ) -> AsyncGenerator[tuple[T, R | Exception], None]:
+        """Process items with 'func(item)' and yield (item, result | error)
+        tuples in completion order. An IterableQueue is consumed directly
+        (get() / task_done()). Closing the generator cancels the workers"""
+        queue: IterableQueue[T]
+        tasks: set[Task] = set()
+        if isinstance(items, IterableQueue):
+            queue = items
+        else:
+            queue = IterableQueue(maxsize=self._max)
+            await queue.add_producer()
+            tasks.add(create_task(self._feeder(items, queue)))
+        results: Queue[tuple[T, R | Exception] | None] = Queue()
+        workers: set[Task] = set()
+
+        def spawn() -> None:
+            while self._active < self._limit:
+                self._active += 1
+                task: Task = create_task(self._worker(queue, func, results))
+                workers.add(task)
+                task.add_done_callback(workers.discard)
+
+        async def controller() -> None:
+            while True:
+                await self._clock.sleep(self._interval)
+                self.adjust()
+                if not queue.is_done:
+                    spawn()
+
+        self._started = self._clock.monotonic()
+        spawn()
+        tasks.add(create_task(controller()))
+        try:
+            while self._active > 0 or not results.empty():
+                if (result := await results.get()) is None:
+                    continue  # a worker exited
+                yield result
+        finally:
+            for task in tasks | workers:
+                task.cancel()
+            await gather(*tasks, *workers, return_exceptions=True)
+            self._active = 0
+
+    async def _feeder(
+        self, items: Iterable[T] | AsyncIterable[T], queue: IterableQueue[T]
+    ) -> None:
+        try:
+            if isinstance(items, AsyncIterable):
+                async for item in items:
+                    await queue.put(item)
+            else:
+                for item in items:
+                    await queue.put(item)
+        finally:
+            await queue.finish()
+
+    async def _worker(
+        self,
+        queue: IterableQueue[T],
+        func: Callable[[T], Awaitable[R]],
+        results: Queue[tuple[T, R | Exception] | None],
+    ) -> None:
+        try:
+            while self._active <= self._limit:
+                try:
+                    item: T = await queue.get()
+                except QueueDone:
+                    break
+                start: float = self._clock.monotonic()
+                res: R | Exception
+                try:
+                    res = await func(item)
+                except CancelledError:
+                    raise
+                except Exception as err:
+                    res = err
+                finally:
+                    queue.task_done()
+                self.add_sample(
+                    self._clock.monotonic() - start, isinstance(res, Exception)
+                )
+                await results.put((item, res))
+        finally:
+            self._active -= 1
+            results.put_nowait(None)
@@ -0,0 +1,408 @@
+## -----------------------------------------------------------
+#  Class FetchEngine()
+#
+#  Multi-process fetch engine with a global rate limit
+## -----------------------------------------------------------
+
+from asyncio import (
+    CancelledError,
+    Task,
+    create_task,
+    get_running_loop,
+    run,
+    sleep,
+)
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.context import BaseContext
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue as MPQueue
+from multiprocessing.sharedctypes import Synchronized
+from queue import Empty
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Iterable,
+    Optional,
+)
+import logging
+import os
+import pickle
+import time
+
+from .ratelimiter import RateLimiter
+from .throttledclientsession import ThrottledClientSession
+from .utils import HTTPSession, fetch_many, get_url_JSON
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+FetchFunction = Callable[[HTTPSession, str], Awaitable[Any]]
+
+_POLL: float = 0.1  # secs, IPC queue poll interval
+
+
+class GlobalRateLimiter(RateLimiter):
+    """
+    Rate limiter shared between processes (GCRA).
+
+    The theoretical arrival time (TAT) of the next request is kept in shared
+    memory. acquire() reserves the next slot(s) under a lock and sleeps until
+    it. Up to 'burst' requests may be sent without waiting. Uses the
+    monotonic clock that is system-wide on Linux.
+
+    Can be passed to ThrottledClientSession(rate_limiter=...) to limit every
+    HTTP request (incl. retries). There is no filler task and priorities
+    are ignored. Reserved slots are not returned if acquire() is cancelled.
+    """
+
+    def __init__(self, tat: "Synchronized[float]", rate_limit: float, burst: int = 1):
+        assert burst > 0, "burst has to be positive"
+        super().__init__(rate_limit, burst=burst)
+        self._tat: "Synchronized[float]" = tat
+        self._interval: float = 1 / rate_limit
+        self._tolerance: float = (burst - 1) * self._interval
+
+    def start(self) -> None:
+        return None
+
+    async def acquire(self, n: int = 1, priority: Optional[int] = None) -> None:
+        """Wait for the next 'n' request slots"""
+        assert n > 0, "n has to be positive"
+        with self._tat.get_lock():
+            now: float = time.monotonic()
+            tat: float = max(self._tat.value, now)
+            self._tat.value = tat + n * self._interval
+        self._acquired += n
+        if (wait := tat + (n - 1) * self._interval - now - self._tolerance) > 0:
+            await sleep(wait)
+
+
+class FetchEngine:
+    """
+    Fetch URLs with 'workers' processes sharing a global rate limit.
+
+    Each worker process runs its own event loop and ThrottledClientSession
+    ('session_kwargs') and fetches 'concurrency' URLs concurrently with
+    'fetch(session, url)' (default get_url_JSON()). URLs are sent to the
+    workers and results back in batches of up to 'batch_size' items.
+
+    The global rate limit applies to every HTTP request of the workers'
+    sessions, retries included. 'fetch' has to be picklable (a module-level
+    function) and so have the results. Errors are returned as results like
+    in fetch_many().
+
+    One fetch() can run at a time. If it is closed early, the URLs not sent
+    yet are discarded and results still arriving from the workers are
+    dropped.
+
+    Usage:
+        async with FetchEngine(rate_limit=20, workers=4) as engine:
+            async for url, res in engine.fetch(urls):
+                ...
+    """
+
+    def __init__(
+        self,
+        rate_limit: float = 0,
+        workers: int = 0,  # 0 = number of CPUs
+        concurrency: int = 10,  # concurrent requests per worker
+        fetch: FetchFunction = get_url_JSON,
+        batch_size: int = 100,
+        linger: float = 0.05,  # secs, max wait before sending a partial batch
+        burst: int = 1,
+        session_kwargs: dict[str, Any] = dict(),
+        mp_context: str | None = None,  # multiprocessing start method
+    ) -> None:
+        assert rate_limit >= 0, "rate_limit cannot be negative"
+        assert workers >= 0, "workers cannot be negative"
+        assert concurrency > 0, "concurrency has to be positive"
+        assert batch_size > 0, "batch_size has to be positive"
+        assert linger > 0, "linger has to be positive"
+        self._rate_limit: float = rate_limit
+        self._workers: int = workers if workers > 0 else (os.cpu_count() or 1)
+        self._concurrency: int = concurrency
+        self._fetch: FetchFunction = fetch
+        self._batch_size: int = batch_size
+        self._linger: float = linger
+        self._burst: int = burst
+        self._session_kwargs: dict[str, Any] = dict(session_kwargs)
+        self._ctx: BaseContext = get_context(mp_context)
+        self._tasks: Optional[MPQueue] = None
+        self._results: Optional[MPQueue] = None
+        self._processes: list[BaseProcess] = list()
+        self._call: int = 0  # id of the current fetch() call
+        self._fetching: bool = False
+        self._count: int = 0
+        self._errors: int = 0
+        self._start_time: float = time.monotonic()
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def stats_dict(self) -> dict[str, float | int]:
+        elapsed: float = time.monotonic() - self._start_time
+        return {
+            "rate": self._count / elapsed if elapsed > 0 else 0,
+            "rate_limit": self._rate_limit,
+            "count": self._count,
+            "errors": self._errors,
+            "workers": self._workers,
+        }
+
+    @property
+    def stats(self) -> str:
+        stats: dict[str, float | int] = self.stats_dict
+        return (
+            ThrottledClientSession.print_stats(stats)
+            + f", workers: {stats['workers']:.0f}"
+        )
+
+    def start(self) -> None:
+        """Start worker processes"""
+        if len(self._processes) > 0:
+            return None
+        self._tasks = self._ctx.Queue(maxsize=2 * self._workers)
+        self._results = self._ctx.Queue()
+        tat = self._ctx.Value("d", 0.0)
+        for _ in range(self._workers):
+            process: BaseProcess = self._ctx.Process(  # type: ignore
+                target=_worker_main,
+                args=(
+                    self._tasks,
+                    self._results,
+                    tat,
+                    self._rate_limit,
+                    self._burst,
+                    self._fetch,
+                    self._concurrency,
+                    self._batch_size,
+                    self._linger,
+                    self._session_kwargs,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        self._start_time = time.monotonic()
+
+    async def close(self) -> None:
+        """Stop worker processes"""
+        if self._tasks is None:
+            return None
+        loop = get_running_loop()
+        for _ in self._processes:
+            await loop.run_in_executor(None, self._tasks.put, None)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = list()
+        self._tasks = None
+        self._results = None
+
+    async def __aenter__(self) -> "FetchEngine":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def fetch(
+        self, urls: Iterable[str] | AsyncIterable[str]
+    ) -> AsyncGenerator[tuple[str, Any | Exception], None]:
+        """Fetch URLs and yield (url, result | error) tuples in completion order"""
+        if self._fetching:
+            raise RuntimeError("fetch() is already running")
+        self.start()
+        assert self._tasks is not None and self._results is not None
+        tasks: MPQueue = self._tasks
+        results: MPQueue = self._results
+        loop = get_running_loop()
+        self._call += 1
+        call: int = self._call
+        sent: int = 0
+        received: int = 0
+        feeding: bool = True
+
+        async def put(batch: list[str]) -> None:
+            nonlocal sent
+            await loop.run_in_executor(None, tasks.put, (call, batch))
+            sent += len(batch)
+
+        async def feeder() -> None:
+            nonlocal feeding
+            batch: list[str] = list()
+            try:
+                if isinstance(urls, AsyncIterable):
+                    async for url in urls:
+                        batch.append(url)
+                        if len(batch) >= self._batch_size:
+                            await put(batch)
+                            batch = list()
+                else:
+                    for url in urls:
+                        batch.append(url)
+                        if len(batch) >= self._batch_size:
+                            await put(batch)
+                            batch = list()
+                if len(batch) > 0:
+                    await put(batch)
+            finally:
+                feeding = False
+
+        self._fetching = True
+        feed: Task = create_task(feeder())
+        try:
+            while feeding or received < sent:
+                try:
+                    res_batch: list[tuple[int, str, Any]] = await loop.run_in_executor(
+                        None, results.get, True, _POLL
+                    )
+                except Empty:
+                    if feed.done() and (err := feed.exception()) is not None:
+                        raise err
+                    if not all(process.is_alive() for process in self._processes):
+                        raise RuntimeError("worker process died")
+                    continue
+                for res_call, url, res in res_batch:
+                    if res_call != call:
+                        continue  # left over from an earlier fetch()
+                    received += 1
+                    self._count += 1
+                    if isinstance(res, Exception) or res is None:
+                        self._errors += 1
+                    yield url, res
+            await feed
+        finally:
+            feed.cancel()
+            self._fetching = False
+            _drain(tasks)
+
+
+def _drain(queue: MPQueue) -> None:
+    """Discard items waiting in the queue"""
+    try:
+        while True:
+            queue.get_nowait()
+    except Empty:
+        pass
+
+
+def _worker_main(
+    tasks: MPQueue,
+    results: MPQueue,
+    tat: "Synchronized[float]",
+    rate_limit: float,
+    burst: int,
+    fetch: FetchFunction,
+    concurrency: int,
+    batch_size: int,
+    linger: float,
+    session_kwargs: dict[str, Any],
+) -> None:
+    """Worker process entry point"""
+    try:
+        run(
+            _worker(
+                tasks,
+                results,
+                tat,
+                rate_limit,
+                burst,
+                fetch,
+                concurrency,
+                batch_size,
+                linger,
+                session_kwargs,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker(
+    tasks: MPQueue,
+    results: MPQueue,
+    tat: "Synchronized[float]",
+    rate_limit: float,
+    burst: int,
+    fetch: FetchFunction,
+    concurrency: int,
+    batch_size: int,
+    linger: float,
+    session_kwargs: dict[str, Any],
+) -> None:
+    loop = get_running_loop()
+    if rate_limit > 0:
+        session_kwargs = dict(
+            session_kwargs,
+            rate_limiter=GlobalRateLimiter(tat, rate_limit=rate_limit, burst=burst),
+        )
+    buffer: list[tuple[int, str, Any]] = list()
+    # fetch() call ids of the URLs being fetched. Duplicate URLs share a
+    # result slot and get the call ids in order
+    calls: dict[str, deque[int]] = dict()
+
+    async def read_urls() -> AsyncGenerator[str, None]:
+        while (task := await loop.run_in_executor(None, tasks.get)) is not None:
+            call, batch = task
+            for url in batch:
+                calls.setdefault(url, deque()).append(call)
+                yield url
+
+    def call_of(url: str) -> int:
+        pending: deque[int] = calls[url]
+        call: int = pending.popleft()
+        if len(pending) == 0:
+            del calls[url]
+        return call
+
+    def flush() -> None:
+        nonlocal buffer
+        if len(buffer) > 0:
+            results.put(buffer)
+            buffer = list()
+
+    async def flusher() -> None:
+        while True:
+            await sleep(linger)
+            flush()
+
+    flushing: Task = create_task(flusher())
+    try:
+        async with ThrottledClientSession(**session_kwargs) as session:
+            async for url, res in fetch_many(
+                session, read_urls(), concurrency=concurrency, fetch=fetch
+            ):
+                if isinstance(res, Exception):
+                    res = _picklable_error(res)
+                buffer.append((call_of(url), url, res))
+                if len(buffer) >= batch_size:
+                    flush()
+    except CancelledError:
+        pass
+    finally:
+        flushing.cancel()
+        flush()
+
+
+def _picklable_error(err: Exception) -> Exception:
+    """Return error as is if it can be sent to the parent process"""
+    try:
+        pickle.loads(pickle.dumps(err))
+        return err
+    except Exception:
+        return Exception(f"{type(err).__name__}: {err}")
@@ -0,0 +1,122 @@
+## -----------------------------------------------------------
+#  Class Histogram()
+#
+#  Fixed-bucket, log-scaled histogram for latency statistics
+## -----------------------------------------------------------
+
+from math import log10
+from typing import Iterable, Tuple
+import logging
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+LATENCY_QUANTILES: list[Tuple[str, float]] = [
+    ("p50", 0.5),
+    ("p95", 0.95),
+    ("p99", 0.99),
+]
+
+
+class Histogram:
+    """Fixed-bucket histogram with log-scaled buckets.
+
+    Buckets are allocated at creation so adding values does not allocate
+    memory. Values below 'min_value' and above 'max_value' are counted in
+    underflow/overflow buckets. Quantiles are accurate to the bucket width,
+    i.e. 10^(1/buckets_per_decade) relative error (~12% by default)."""
+
+    def __init__(
+        self,
+        min_value: float = 1e-4,
+        max_value: float = 100,
+        buckets_per_decade: int = 20,
+    ) -> None:
+        assert 0 < min_value < max_value, "0 < min_value < max_value is required"
+        assert buckets_per_decade > 0, "buckets_per_decade has to be positive"
+        self._min: float = min_value
+        self._max: float = max_value
+        self._log_min: float = log10(min_value)
+        self._bpd: int = buckets_per_decade
+        self._n: int = int((log10(max_value) - self._log_min) * buckets_per_decade)
+        # bucket 0 = underflow, bucket n + 1 = overflow
+        self._buckets: list[int] = [0] * (self._n + 2)
+        self._count: int = 0
+        self._sum: float = 0
+        self._max_seen: float = 0
+
+    def add(self, value: float) -> None:
+        """Add a value to the histogram"""
+        self._count += 1
+        self._sum += value
+        if value > self._max_seen:
+            self._max_seen = value
+        if value < self._min:
+            self._buckets[0] += 1
+        elif value >= self._max:
+            self._buckets[-1] += 1
+        else:
+            self._buckets[int((log10(value) - self._log_min) * self._bpd) + 1] += 1
+
+    def _upper(self, idx: int) -> float:
+        """Upper bound of a bucket"""
+        if idx == 0:
+            return self._min
+        elif idx > self._n:
+            return self._max_seen
+        return 10 ** (self._log_min + idx / self._bpd)
+
+    def quantile(self, q: float) -> float:
+        """Return (estimated) value of the quantile q, 0 <= q <= 1"""
+        assert 0 <= q <= 1, "quantile has to be between 0 and 1"
+        if self._count == 0:
+            return 0
+        rank: float = q * self._count
+        cum: int = 0
+        for idx, n in enumerate(self._buckets):
+            cum += n
+            if n > 0 and cum >= rank:
+                return min(self._upper(idx), self._max_seen)
+        return self._max_seen
+
+    def quantiles(self, qs: Iterable[float]) -> list[float]:
+        return [self.quantile(q) for q in qs]
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    @property
+    def mean(self) -> float:
+        if self._count == 0:
+            return 0
+        return self._sum / self._count
+
+    @property
+    def max(self) -> float:
+        return self._max_seen
+
+    def merge(self, other: "Histogram") -> None:
+        """Merge counts of another histogram with the same bucket layout"""
+        if (self._min, self._max, self._bpd) != (other._min, other._max, other._bpd):
+            raise ValueError("histograms have different bucket layouts")
+        for idx, n in enumerate(other._buckets):
+            self._buckets[idx] += n
+        self._count += other._count
+        self._sum += other._sum
+        self._max_seen = max(self._max_seen, other._max_seen)
+
+    def reset(self) -> None:
+        """Reset counts"""
+        for idx in range(len(self._buckets)):
+            self._buckets[idx] = 0
+        self._count = 0
+        self._sum = 0
+        self._max_seen = 0
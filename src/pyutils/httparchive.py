@@ -0,0 +1,222 @@
+## -----------------------------------------------------------
+#  Class HTTPArchive()
+#
+#  On-disk archive of HTTP request/response pairs to record
+#  and replay traffic of ThrottledClientSession
+## -----------------------------------------------------------
+
+from asyncio import Lock
+from hashlib import sha256
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from typing import Any, Iterable, Literal, Mapping, Optional, Tuple
+import json
+import logging
+import os
+
+import aiofiles
+import brotli  # type: ignore
+from aiohttp import ClientConnectionError, ClientSession, ClientResponse
+from multidict import CIMultiDict
+from yarl import URL
+
+from .compression import COMPRESS_THRESHOLD, compress_body
+from .httpcache import body_headers, mk_response
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+ArchiveMode = Literal["record", "replay"]
+
+
+class HTTPArchiveMiss(ClientConnectionError):
+    """Request was not found from the archive in replay mode"""
+
+    pass
+
+
+class HTTPArchive:
+    """
+    Record and replay HTTP traffic of ThrottledClientSession.
+
+    In 'record' mode requests are made normally and request/response pairs
+    (method, URL, headers, status, body) are appended to the archive file.
+    Bodies larger than COMPRESS_THRESHOLD are stored brotli compressed.
+
+    In 'replay' mode responses are served from the archive without network
+    access and without rate limiting. Requests missing from the archive raise
+    HTTPArchiveMiss. If a request was recorded several times, the responses
+    are replayed in the recorded order and the last one is repeated.
+
+    The archive is a single file of records: a JSON metadata line followed
+    by the body. The index ('<path>.idx') is written on close() and rebuilt
+    from the archive if it is missing or out of date.
+    """
+
+    def __init__(self, path: Path | str, mode: ArchiveMode = "replay") -> None:
+        assert mode in ("record", "replay"), "mode has to be 'record' or 'replay'"
+        if isinstance(path, str):
+            path = Path(path)
+        self._path: Path = path
+        self._mode: ArchiveMode = mode
+        self._index: dict[str, list[int]] = dict()
+        self._replayed: dict[str, int] = dict()
+        self._lock: Lock = Lock()
+        self._mmap: Optional[mmap] = None
+        if mode == "replay":
+            self._open_replay()
+        else:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            if self._path.exists():
+                self._load_index()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def mode(self) -> ArchiveMode:
+        return self._mode
+
+    @property
+    def index_path(self) -> Path:
+        return self._path.with_name(self._path.name + ".idx")
+
+    def __len__(self) -> int:
+        return sum(len(offsets) for offsets in self._index.values())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    @classmethod
+    def key(cls, method: str, url: str | URL, body: bytes | None = None) -> str:
+        """Archive key of a request. Request body is part of the key"""
+        if body:
+            return f"{method} {url} {sha256(body).hexdigest()}"
+        return f"{method} {url}"
+
+    def _open_replay(self) -> None:
+        with open(self._path, mode="rb") as file:
+            if os.fstat(file.fileno()).st_size > 0:
+                self._mmap = mmap(file.fileno(), 0, access=ACCESS_READ)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        """Load index or rebuild it if it does not match the archive"""
+        size: int = self._path.stat().st_size
+        try:
+            with open(self.index_path, mode="rb") as file:
+                index: dict[str, Any] = json.loads(file.read())
+            if index["size"] == size:
+                self._index = index["index"]
+                return
+            debug(f"archive index is out of date: {self.index_path}")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as err:
+            error(f"corrupted archive index {self.index_path}: {err}")
+        self._rebuild_index()
+
+    def _rebuild_index(self) -> None:
+        self._index = dict()
+        with open(self._path, mode="rb") as file:
+            while meta_line := file.readline():
+                offset: int = file.tell() - len(meta_line)
+                try:
+                    meta: dict[str, Any] = json.loads(meta_line)
+                except ValueError:
+                    error(f"corrupted archive {self._path} at offset {offset}")
+                    break
+                self._index.setdefault(meta["key"], list()).append(offset)
+                file.seek(meta["size"], os.SEEK_CUR)
+
+    def _read(self, offset: int) -> Tuple[dict[str, Any], bytes]:
+        assert self._mmap is not None, "archive is empty"
+        meta_end: int = self._mmap.find(b"\n", offset) + 1
+        meta: dict[str, Any] = json.loads(self._mmap[offset:meta_end])
+        body: bytes = self._mmap[meta_end : meta_end + meta["size"]]
+        if meta.get("encoding") == "br":
+            body = brotli.decompress(body)
+        return meta, body
+
+    def replay(
+        self,
+        session: ClientSession,
+        method: str,
+        url: str | URL,
+        body: bytes | None = None,
+    ) -> ClientResponse:
+        """Build response to a request from the archive"""
+        assert self._mode == "replay", "archive is not in replay mode"
+        key: str = self.key(method, url, body)
+        if (offsets := self._index.get(key)) is None:
+            raise HTTPArchiveMiss(f"request not found from archive: {key}")
+        n: int = self._replayed.get(key, 0)
+        self._replayed[key] = n + 1
+        meta, content = self._read(offsets[min(n, len(offsets) - 1)])
+        return mk_response(
+            session,
+            method=method,
+            url=meta["url"],
+            status=meta["status"],
+            reason=meta["reason"],
+            headers=meta["headers"],
+            body=content,
+        )
+
+    async def record(
+        self,
+        method: str,
+        url: str | URL,
+        request_headers: Mapping[str, str] | Iterable[Tuple[str, str]] | None,
+        request_body: bytes | None,
+        status: int,
+        reason: str,
+        headers: Iterable[Tuple[str, str]],
+        body: bytes,
+    ) -> None:
+        """Append a request/response pair to the archive"""
+        assert self._mode == "record", "archive is not in record mode"
+        key: str = self.key(method, url, request_body)
+        meta: dict[str, Any] = {
+            "key": key,
+            "method": method,
+            "url": str(url),
+            "request_headers": list(CIMultiDict(request_headers or {}).items()),
+            "status": status,
+            "reason": reason,
+            "headers": body_headers(headers),
+        }
+        if (stored := await compress_body(body, "br", COMPRESS_THRESHOLD)) is not None:
+            meta["encoding"] = "br"
+            body = stored
+        meta["size"] = len(body)
+        record: bytes = json.dumps(meta).encode() + b"\n" + body
+        async with self._lock:
+            async with aiofiles.open(self._path, mode="ab") as file:
+                offset: int = await file.tell()
+                await file.write(record)
+            self._index.setdefault(key, list()).append(offset)
+
+    async def close(self) -> None:
+        """Write index and close the archive"""
+        if self._mode == "record" and self._path.exists():
+            async with self._lock:
+                index: dict[str, Any] = {
+                    "size": self._path.stat().st_size,
+                    "index": self._index,
+                }
+                async with aiofiles.open(self.index_path, mode="wb") as file:
+                    await file.write(json.dumps(index).encode())
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    async def __aenter__(self) -> "HTTPArchive":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
@@ -0,0 +1,335 @@
+## -----------------------------------------------------------
+#  Class HTTPCache()
+#
+#  On-disk HTTP response cache with Cache-Control support and
+#  ETag / Last-Modified revalidation
+## -----------------------------------------------------------
+
+from dataclasses import dataclass, field, asdict
+from email.utils import parsedate_to_datetime
+from hashlib import sha256
+from inspect import signature
+from pathlib import Path
+from typing import Any, Iterable, Mapping, Optional, Tuple
+from uuid import uuid4
+import asyncio
+import json
+import logging
+import time
+
+import aiofiles
+import aiofiles.os
+from aiohttp import ClientSession, ClientResponse, RequestInfo
+from aiohttp.base_protocol import BaseProtocol
+from aiohttp.helpers import TimerNoop
+from aiohttp.streams import StreamReader
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+HeaderList = list[Tuple[str, str]]
+
+_CACHEABLE_STATUS: set[int] = {200, 203, 300, 301, 410}
+
+# headers describing the transfer, not the (decoded) body that is stored
+_SKIP_HEADERS: frozenset[str] = frozenset(
+    ["content-encoding", "content-length", "transfer-encoding"]
+)
+
+
+def body_headers(headers: Iterable[Tuple[str, str]] | Mapping[str, str]) -> HeaderList:
+    """Response headers to store with the decoded body. Drops headers
+    describing the transfer, e.g. 'Content-Encoding'"""
+    if isinstance(headers, Mapping):
+        headers = headers.items()
+    return [(k, v) for k, v in headers if k.lower() not in _SKIP_HEADERS]
+
+
+class _NoWriter:
+    """Dummy stream writer for responses built without a connection"""
+
+    output_size: int = 0
+    buffer_size: int = 0
+
+
+_RESPONSE_STREAM_WRITER: bool = (
+    "stream_writer" in signature(ClientResponse.__init__).parameters
+)
+
+
+def mk_response(
+    session: ClientSession,
+    method: str,
+    url: str | URL,
+    status: int,
+    reason: str,
+    headers: Iterable[Tuple[str, str]] | Mapping[str, str],
+    body: bytes,
+) -> ClientResponse:
+    """Build a complete, already read ClientResponse from stored data.
+
+    The response is not bound to a connection and can be read with
+    read()/text()/json() or streamed from resp.content"""
+    loop = asyncio.get_running_loop()
+    if not isinstance(url, URL):
+        url = URL(url)
+    hdrs: CIMultiDictProxy[str] = CIMultiDictProxy(CIMultiDict(headers))
+    kwargs: dict[str, Any] = dict(
+        writer=None,
+        continue100=None,
+        timer=TimerNoop(),
+        request_info=RequestInfo(url, method, hdrs, url),
+        traces=[],
+        loop=loop,
+        session=session,
+    )
+    if _RESPONSE_STREAM_WRITER:
+        kwargs["stream_writer"] = _NoWriter()
+    resp = ClientResponse(method, url, **kwargs)
+    resp.status = status
+    resp.reason = reason
+    resp._headers = hdrs
+    resp._raw_headers = tuple((k.encode(), v.encode()) for k, v in hdrs.items())
+    resp._body = body
+    content = StreamReader(BaseProtocol(loop), max(len(body), 2**16), loop=loop)
+    content.feed_data(body)
+    content.feed_eof()
+    resp.content = content
+    return resp
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    """Parse Cache-Control header into a dict of directives"""
+    res: dict[str, str | None] = dict()
+    if value is None:
+        return res
+    for directive in value.split(","):
+        if (directive := directive.strip()) == "":
+            continue
+        key, _, arg = directive.partition("=")
+        res[key.strip().lower()] = arg.strip().strip('"') if arg else None
+    return res
+
+
+def _http_date(value: str | None) -> float | None:
+    """Parse HTTP date to epoch"""
+    if value is None:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class CacheEntry:
+    """Cached HTTP response"""
+
+    url: str
+    status: int
+    reason: str
+    headers: HeaderList = field(default_factory=list)
+    body: bytes = b""
+    stored: float = 0
+    expires: float = 0
+
+    def header(self, name: str) -> str | None:
+        """Get (first) header value"""
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    @property
+    def etag(self) -> str | None:
+        return self.header("ETag")
+
+    @property
+    def last_modified(self) -> str | None:
+        return self.header("Last-Modified")
+
+    def is_fresh(self, now: float | None = None) -> bool:
+        """Whether the entry can be served without revalidation"""
+        if now is None:
+            now = time.time()
+        return now < self.expires
+
+    def can_revalidate(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+    def conditional_headers(self) -> dict[str, str]:
+        """Return If-None-Match / If-Modified-Since headers for revalidation"""
+        res: dict[str, str] = dict()
+        if (etag := self.etag) is not None:
+            res["If-None-Match"] = etag
+        if (last_modified := self.last_modified) is not None:
+            res["If-Modified-Since"] = last_modified
+        return res
+
+    def response(self, session: ClientSession, method: str = "GET") -> ClientResponse:
+        """Build ClientResponse from the cache entry"""
+        return mk_response(
+            session,
+            method=method,
+            url=self.url,
+            status=self.status,
+            reason=self.reason,
+            headers=self.headers,
+            body=self.body,
+        )
+
+
+class HTTPCache:
+    """
+    On-disk HTTP response cache for ThrottledClientSession.
+
+    Honors Cache-Control (no-store, no-cache, max-age, s-maxage) and Expires
+    headers. Stale entries with ETag or Last-Modified headers are revalidated
+    with conditional requests. Responses without freshness information are
+    cached for 'default_ttl' seconds (default 0, i.e. always revalidate).
+    """
+
+    def __init__(self, path: Path | str, default_ttl: float = 0) -> None:
+        assert default_ttl >= 0, "default_ttl cannot be negative"
+        if isinstance(path, str):
+            path = Path(path)
+        self._path: Path = path
+        self._default_ttl: float = default_ttl
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _filename(self, key: str) -> Path:
+        return self._path / sha256(key.encode()).hexdigest()
+
+    def freshness(self, headers: Mapping[str, str], now: float | None = None) -> float:
+        """Return expiry time (epoch) of a response based on its headers"""
+        if now is None:
+            now = time.time()
+        cc: dict[str, str | None] = parse_cache_control(headers.get("Cache-Control"))
+        if "no-cache" in cc:
+            return now
+        age: float = 0
+        try:
+            age = float(headers.get("Age", 0))
+        except ValueError:
+            pass
+        for directive in ["s-maxage", "max-age"]:
+            if (max_age := cc.get(directive)) is not None:
+                try:
+                    return now + int(max_age) - age
+                except ValueError:
+                    return now
+        if (expires := headers.get("Expires")) is not None:
+            if (expires_at := _http_date(expires)) is None:
+                return now  # invalid Expires means "already expired"
+            date: float = _http_date(headers.get("Date")) or now
+            return now + expires_at - date
+        return now + self._default_ttl
+
+    def is_cacheable(self, status: int, headers: Mapping[str, str]) -> bool:
+        """Whether response can be stored"""
+        if status not in _CACHEABLE_STATUS:
+            return False
+        return "no-store" not in parse_cache_control(headers.get("Cache-Control"))
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        """Read cache entry"""
+        filename: Path = self._filename(key)
+        try:
+            async with aiofiles.open(filename, mode="rb") as file:
+                meta: bytes = await file.readline()
+                body: bytes = await file.read()
+            fields: dict[str, Any] = json.loads(meta)
+            if (size := fields.pop("size", None)) is not None and size != len(body):
+                error(f"truncated cache entry {filename}: {len(body)} != {size} bytes")
+                return None
+            entry = CacheEntry(body=body, **fields)
+            if entry.url == key:
+                return entry
+            debug(f"cache key collision: {key}")
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError) as err:
+            error(f"corrupted cache entry {filename}: {err}")
+        return None
+
+    async def put(
+        self,
+        key: str,
+        status: int,
+        reason: str,
+        headers: Mapping[str, str],
+        body: bytes,
+    ) -> Optional[CacheEntry]:
+        """Store response if it is cacheable"""
+        if not self.is_cacheable(status, headers):
+            return None
+        now: float = time.time()
+        entry = CacheEntry(
+            url=key,
+            status=status,
+            reason=reason,
+            headers=body_headers(headers),
+            body=body,
+            stored=now,
+            expires=self.freshness(headers, now=now),
+        )
+        await self._write(entry)
+        return entry
+
+    async def refresh(
+        self, entry: CacheEntry, headers: Mapping[str, str]
+    ) -> CacheEntry:
+        """Update entry after a '304 Not Modified' response"""
+        now: float = time.time()
+        updated: CIMultiDict[str] = CIMultiDict(entry.headers)
+        for name in ["Cache-Control", "Date", "ETag", "Expires", "Last-Modified"]:
+            if (value := headers.get(name)) is not None:
+                updated[name] = value
+        entry.headers = list(updated.items())
+        entry.stored = now
+        entry.expires = self.freshness(updated, now=now)
+        await self._write(entry)
+        return entry
+
+    async def _write(self, entry: CacheEntry) -> None:
+        filename: Path = self._filename(entry.url)
+        # unique temp file: concurrent writers of a key must not share it
+        tmp: Path = filename.with_name(f"{filename.name}.{uuid4().hex}.tmp")
+        meta: dict[str, Any] = asdict(entry)
+        del meta["body"]
+        meta["size"] = len(entry.body)
+        try:
+            async with aiofiles.open(tmp, mode="wb") as file:
+                await file.write(json.dumps(meta).encode() + b"\n")
+                await file.write(entry.body)
+            await aiofiles.os.replace(tmp, filename)
+        except OSError as err:
+            error(f"could not write cache entry {filename}: {err}")
+            try:
+                await aiofiles.os.remove(tmp)
+            except OSError:
+                pass
+
+    async def invalidate(self, key: str) -> bool:
+        """Remove entry from the cache"""
+        try:
+            await aiofiles.os.remove(self._filename(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def clear(self) -> None:
+        """Remove all entries from the cache"""
+        for filename in self._path.iterdir():
+            if filename.is_file():
+                await aiofiles.os.remove(filename)
@@ -0,0 +1,80 @@
+## -----------------------------------------------------------
+#  Class RateCounter()
+#
+#  Sliding-window event rate from a ring of per-second buckets
+## -----------------------------------------------------------
+
+from math import ceil
+import logging
+
+from .clock import Clock, SYSTEM_CLOCK
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+
+class RateCounter:
+    """Count events and report their rate over a sliding window.
+
+    Events are counted into a fixed-size ring of per-second buckets, so
+    memory use is constant and windows up to 'window' seconds can be
+    queried. Uses the monotonic time of 'clock'."""
+
+    def __init__(self, window: int = 60, clock: Clock = SYSTEM_CLOCK) -> None:
+        assert window > 0, "window has to be positive"
+        self._window: int = window
+        self._clock: Clock = clock
+        self._buckets: list[int] = [0] * window
+        self._start: float = clock.monotonic()
+        self._sec: int = int(self._start)
+
+    @property
+    def window(self) -> int:
+        return self._window
+
+    def _advance(self, now: float) -> int:
+        """Clear buckets of the seconds passed since the last update"""
+        sec: int = int(now)
+        if sec > self._sec:
+            for s in range(self._sec + 1, min(sec, self._sec + self._window) + 1):
+                self._buckets[s % self._window] = 0
+            self._sec = sec
+        return sec
+
+    def add(self, n: int = 1, now: float | None = None) -> None:
+        """Add n events"""
+        if now is None:
+            now = self._clock.monotonic()
+        self._buckets[self._advance(now) % self._window] += n
+
+    def count(self, seconds: float, now: float | None = None) -> int:
+        """Number of events during the last 'seconds' (rounded up to full seconds)"""
+        assert 0 < seconds <= self._window, (
+            f"seconds has to be 0 < seconds <= {self._window}"
+        )
+        if now is None:
+            now = self._clock.monotonic()
+        sec: int = self._advance(now)
+        return sum(
+            self._buckets[(sec - i) % self._window] for i in range(ceil(seconds))
+        )
+
+    def rate(self, seconds: float, now: float | None = None) -> float:
+        """Rate of events per second during the last 'seconds'"""
+        if now is None:
+            now = self._clock.monotonic()
+        count: int = self.count(seconds, now=now)
+        # the window covers ceil(seconds) - 1 full seconds and the current one
+        span: float = min(ceil(seconds) - 1 + now - int(now), now - self._start)
+        if span <= 0:
+            return 0
+        return count / span
+
+    def reset(self) -> None:
+        for idx in range(self._window):
+            self._buckets[idx] = 0
+        self._start = self._clock.monotonic()
+        self._sec = int(self._start)
@@ -0,0 +1,278 @@
+## -----------------------------------------------------------
+#  Class RateLimiter()
+#
+#  Async token-bucket rate limiter with priority lanes
+## -----------------------------------------------------------
+
+from asyncio import (
+    CancelledError,
+    Future,
+    Task,
+    TimeoutError,
+    create_task,
+    get_running_loop,
+    wait_for,
+)
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from math import ceil, log
+from typing import Any, Awaitable, Callable, Optional, ParamSpec, TypeVar
+import logging
+
+from .clock import Clock, SYSTEM_CLOCK
+from .histogram import Histogram, LATENCY_QUANTILES
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# Priority of requests in the current context. Higher priority requests get
+# rate-limit tokens first. Can be overridden per acquire() / request
+request_priority: ContextVar[int] = ContextVar("request_priority", default=0)
+
+
+class RateLimiter:
+    """
+    Async rate limiter (token bucket) with priority lanes.
+
+    A filler task adds 'rate_limit' tokens per second. Up to 'burst' tokens
+    are stored for later use (default: 1, or log(rate_limit) at high rates).
+    Waiters with higher priority get tokens first unless a lane in
+    'lane_reserve' (priority: share) has accumulated credit for a token.
+
+    Usage:
+        limiter = RateLimiter(rate_limit=10)
+
+        async with limiter:  # one token
+            ...
+
+        @limiter  # one token per call
+        async def write(doc: dict) -> None:
+            ...
+
+        await limiter.acquire(len(batch))  # N tokens at once
+
+    'priority' sets the priority for the context manager and the decorator.
+    Without it the priority comes from 'request_priority' context variable.
+    """
+
+    _LOG_FILLER: int = 20
+
+    def __init__(
+        self,
+        rate_limit: float,
+        burst: int = 0,  # max stored tokens, 0 = default
+        lane_reserve: dict[int, float] = dict(),  # priority: reserved share
+        priority: Optional[int] = None,
+        clock: Clock = SYSTEM_CLOCK,
+    ) -> None:
+        assert rate_limit > 0, "rate_limit has to be positive"
+        assert burst >= 0, "burst cannot be negative"
+        assert all(0 < share < 1 for share in lane_reserve.values()), (
+            "lane_reserve shares have to be 0 < share < 1"
+        )
+        assert sum(lane_reserve.values()) < 1, "lane_reserve shares sum up to >= 1"
+        self._rate_limit: float = rate_limit
+        self._qlen: int = 1  # tokens added at once
+        if rate_limit > self._LOG_FILLER:
+            self._qlen = ceil(log(rate_limit))
+        self._burst: int = burst if burst > 0 else self._qlen
+        self._priority: Optional[int] = priority
+        self._clock: Clock = clock
+        self._fillerTask: Optional[Task] = None
+        self._tokens: int = 0
+        self._lanes: dict[int, deque[Future[None]]] = dict()
+        self._lane_order: list[int] = list()  # priorities, highest first
+        self._lane_reserve: dict[int, float] = dict(lane_reserve)
+        self._lane_credit: dict[int, float] = {lane: 0 for lane in lane_reserve}
+        self._lane_wait: dict[int, Histogram] = dict()
+        self._acquired: int = 0
+
+    @property
+    def rate_limit(self) -> float:
+        return self._rate_limit
+
+    @property
+    def burst(self) -> int:
+        return self._burst
+
+    @property
+    def tokens(self) -> int:
+        """Number of tokens available"""
+        return self._tokens
+
+    @property
+    def waiters(self) -> int:
+        """Number of waiters for a token"""
+        return sum(len(lane) for lane in self._lanes.values())
+
+    @property
+    def acquired(self) -> int:
+        """Number of tokens acquired"""
+        return self._acquired
+
+    @property
+    def lane_stats(self) -> dict[str, float | int]:
+        """Token wait quantiles per priority lane. Reported if there are
+        several lanes or reserved capacity"""
+        res: dict[str, float | int] = dict()
+        if len(self._lane_wait) > 1 or len(self._lane_reserve) > 0:
+            for lane, hist in self._lane_wait.items():
+                res[f"lane.{lane}.count"] = hist.count
+                for label, q in LATENCY_QUANTILES:
+                    res[f"lane.{lane}.wait.{label}"] = hist.quantile(q)
+        return res
+
+    @property
+    def stats_dict(self) -> dict[str, float | int]:
+        res: dict[str, float | int] = {
+            "rate_limit": self._rate_limit,
+            "acquired": self._acquired,
+            "tokens": self._tokens,
+            "waiters": self.waiters,
+        }
+        res.update(self.lane_stats)
+        return res
+
+    @property
+    def stats(self) -> str:
+        stats: dict[str, float | int] = self.stats_dict
+        return (
+            f"rate limit: {stats['rate_limit']:.1f}/sec, acquired: {stats['acquired']:.0f}, "
+            + f"tokens: {stats['tokens']:.0f}, waiters: {stats['waiters']:.0f}"
+        )
+
+    def start(self) -> None:
+        """Start the filler task. Called by acquire() if needed"""
+        if self._fillerTask is None:
+            self._fillerTask = create_task(self._filler())
+
+    async def close(self) -> None:
+        """Stop the filler task"""
+        if self._fillerTask is None:
+            return None
+        try:
+            self._fillerTask.cancel()
+            await wait_for(self._fillerTask, timeout=0.5)
+        except TimeoutError as err:
+            debug(f"Timeout while cancelling bucket filler: {err}")
+        except CancelledError:
+            debug("Cancelled")
+        self._fillerTask = None
+
+    async def _filler(self) -> None:
+        """Filler task to fill the token bucket. Adds 'qlen' tokens at once
+        at high rates for performance"""
+        try:
+            wait: float = self._qlen / self._rate_limit
+            while True:
+                for _ in range(self._qlen):
+                    self._add_token()
+                await self._clock.sleep(wait)
+        except CancelledError:
+            debug("Cancelled")
+        except Exception as err:
+            error(f"{err}")
+        return None
+
+    def _add_token(self) -> None:
+        """Hand a token to a waiter or store it. At most 'burst' tokens
+        are stored"""
+        if (lane := self._next_lane()) is not None:
+            self._lanes[lane].popleft().set_result(None)
+        elif self._tokens < self._burst:
+            self._tokens += 1
+
+    def _next_lane(self) -> int | None:
+        """Choose the priority lane to get the next token.
+
+        Waiters with higher priority go first unless a lane with reserved
+        capacity has accumulated credit for a token"""
+        top: int | None = None
+        for lane in self._lane_order:
+            waiters: deque[Future[None]] = self._lanes[lane]
+            while len(waiters) > 0 and waiters[0].done():
+                waiters.popleft()  # cancelled
+            if top is None and len(waiters) > 0:
+                top = lane
+        if top is None or len(self._lane_reserve) == 0:
+            return top
+
+        reserved: int | None = None
+        for lane, share in self._lane_reserve.items():
+            if len(self._lanes.get(lane, ())) > 0:
+                self._lane_credit[lane] += share
+                if self._lane_credit[lane] >= 1 and (
+                    reserved is None
+                    or self._lane_credit[lane] > self._lane_credit[reserved]
+                ):
+                    reserved = lane
+        if reserved is not None:
+            top = reserved
+        if top in self._lane_credit:
+            self._lane_credit[top] = max(self._lane_credit[top] - 1, 0)
+        return top
+
+    async def _get_token(self, priority: int) -> None:
+        """Wait for a token"""
+        if self._tokens > 0 and self.waiters == 0:
+            self._tokens -= 1
+            return None
+        if (waiters := self._lanes.get(priority)) is None:
+            waiters = deque()
+            self._lanes[priority] = waiters
+            self._lane_order = sorted(self._lanes.keys(), reverse=True)
+        token: Future[None] = get_running_loop().create_future()
+        waiters.append(token)
+        try:
+            await token
+        except CancelledError:
+            if token.done() and not token.cancelled():
+                self._add_token()  # pass the token on
+            raise
+
+    async def acquire(self, n: int = 1, priority: Optional[int] = None) -> None:
+        """Wait for 'n' tokens. If cancelled, the tokens acquired so far
+        are passed on"""
+        assert n > 0, "n has to be positive"
+        if priority is None:
+            priority = request_priority.get()
+        self.start()
+        start: float = self._clock.monotonic()
+        acquired: int = 0
+        try:
+            while acquired < n:
+                await self._get_token(priority)
+                acquired += 1
+        except CancelledError:
+            for _ in range(acquired):
+                self._add_token()
+            raise
+        self._acquired += n
+        if (lane_wait := self._lane_wait.get(priority)) is None:
+            lane_wait = Histogram()
+            self._lane_wait[priority] = lane_wait
+        lane_wait.add(self._clock.monotonic() - start)
+
+    async def __aenter__(self) -> "RateLimiter":
+        await self.acquire(priority=self._priority)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
+
+    def __call__(self, func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+        """Decorator to rate-limit calls of a coroutine function"""
+
+        @wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            await self.acquire(priority=self._priority)
+            return await func(*args, **kwargs)
+
+        return wrapper
@@ -0,0 +1,126 @@
+## -----------------------------------------------------------
+#  Class RetryPolicy()
+#
+#  Retry policy with exponential backoff, full jitter and
+#  a retry budget for ThrottledClientSession
+## -----------------------------------------------------------
+
+from asyncio import TimeoutError
+from email.utils import parsedate_to_datetime
+from random import uniform
+from typing import Iterable
+import logging
+import time
+
+from aiohttp import ClientConnectionError
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+IDEMPOTENT_METHODS: frozenset[str] = frozenset(
+    ["GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"]
+)
+RETRY_STATUSES: frozenset[int] = frozenset([408, 429, 500, 502, 503, 504])
+RETRY_EXCEPTIONS: tuple[type[BaseException], ...] = (
+    ClientConnectionError,
+    TimeoutError,
+)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse Retry-After header (seconds or HTTP date) to seconds"""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Retry policy for ThrottledClientSession.
+
+    - Retries idempotent requests that failed with a retryable status code
+      or a connection error / timeout
+    - Exponential backoff with full jitter: sleep random(0, min(max_backoff, backoff * 2^attempt))
+    - Honors 'Retry-After' header (capped by 'max_retry_after')
+    - Retry budget: retries are allowed while retries < budget * requests + budget_floor.
+      'budget_floor' is the number of retries allowed on top of the 'budget'
+      share, not a per-request minimum. The budget stops retry storms when
+      everything fails.
+
+    The budget counters are kept in the policy, so use a policy per session.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        budget: float = 0.2,
+        budget_floor: int = 10,  # retries allowed on top of 'budget'
+        statuses: Iterable[int] = RETRY_STATUSES,
+        exceptions: tuple[type[BaseException], ...] = RETRY_EXCEPTIONS,
+        methods: Iterable[str] = IDEMPOTENT_METHODS,
+        max_retry_after: float = 60,
+    ) -> None:
+        assert max_retries >= 0, "max_retries cannot be negative"
+        assert backoff >= 0, "backoff cannot be negative"
+        assert max_backoff >= backoff, "max_backoff has to be >= backoff"
+        assert budget >= 0, "budget cannot be negative"
+        assert budget_floor >= 0, "budget_floor cannot be negative"
+        self.max_retries: int = max_retries
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.budget: float = budget
+        self.budget_floor: int = budget_floor
+        self.statuses: frozenset[int] = frozenset(statuses)
+        self.exceptions: tuple[type[BaseException], ...] = exceptions
+        self.methods: frozenset[str] = frozenset(methods)
+        self.max_retry_after: float = max_retry_after
+        self._requests: int = 0
+        self._retries: int = 0
+
+    @property
+    def retries(self) -> int:
+        return self._retries
+
+    def add_request(self) -> None:
+        """Count a request (not a retry) for the retry budget"""
+        self._requests += 1
+
+    def _has_budget(self) -> bool:
+        return self._retries < self.budget * self._requests + self.budget_floor
+
+    def retry_status(self, method: str, status: int, attempt: int) -> bool:
+        """Whether to retry a request that returned 'status'"""
+        return (
+            status in self.statuses
+            and method in self.methods
+            and attempt < self.max_retries
+            and self._has_budget()
+        )
+
+    def retry_exception(self, method: str, err: BaseException, attempt: int) -> bool:
+        """Whether to retry a request that raised 'err'"""
+        return (
+            isinstance(err, self.exceptions)
+            and method in self.methods
+            and attempt < self.max_retries
+            and self._has_budget()
+        )
+
+    def delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """Return delay before the retry number 'attempt + 1' and count the retry"""
+        self._retries += 1
+        if (wait := parse_retry_after(retry_after)) is not None:
+            return min(wait, self.max_retry_after)
+        return uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
@@ -0,0 +1,213 @@
+## -----------------------------------------------------------
+#  Class SessionPool()
+#
+#  Pool of ThrottledClientSessions with own credentials and
+#  rate limits. Requests are routed to the least busy member.
+## -----------------------------------------------------------
+
+from asyncio import gather, sleep
+from copy import copy
+from typing import Any, Iterable, Mapping, Optional
+import logging
+import time
+
+from aiohttp import ClientResponse
+from aiohttp.client import _RequestContextManager
+from multidict import MultiDict
+
+from .throttledclientsession import ThrottledClientSession
+from .retrypolicy import parse_retry_after
+
+logger = logging.getLogger()
+error = logger.error
+message = logger.warning
+verbose = logger.info
+debug = logger.debug
+
+EJECT_STATUSES: frozenset[int] = frozenset([429])
+
+
+class _Member:
+    """Pool member: a session and its request params (e.g. an application ID)"""
+
+    def __init__(
+        self, session: ThrottledClientSession, params: Mapping[str, str]
+    ) -> None:
+        self.session: ThrottledClientSession = session
+        self.params: dict[str, str] = dict(params)
+        self.ejected_until: float = 0
+        self.ejections: int = 0
+
+    def expected_wait(self) -> float:
+        """Expected wait for a rate-limit token in seconds"""
+        if (rate_limit := self.session.rate_limit) == 0:
+            return 0
+        return (self.session.token_waiters + 1 - self.session.tokens) / rate_limit
+
+
+class SessionPool:
+    """
+    Pool of ThrottledClientSessions, e.g. one per application ID / API key.
+
+    Each member has its own rate limit and credentials: session headers or
+    'params' added to every request routed to the member. Requests are
+    routed to the member with the shortest expected wait for a rate-limit
+    token (tokens available, requests waiting and rate limit).
+
+    A member that responds with a status in 'eject_statuses' (429 by default)
+    is ejected for Retry-After or 'eject_time' seconds and the request is
+    retried with another member. Members get a copy of their RetryPolicy
+    without the eject statuses, so a member does not wait for Retry-After
+    itself before the pool can fail over.
+
+    The pool implements the request methods of aiohttp.ClientSession, so it
+    can be used with get_url() and friends.
+    """
+
+    def __init__(
+        self,
+        sessions: Iterable[ThrottledClientSession] = list(),
+        eject_statuses: Iterable[int] = EJECT_STATUSES,
+        eject_time: float = 60,
+    ) -> None:
+        assert eject_time >= 0, "eject_time cannot be negative"
+        self._members: list[_Member] = list()
+        self._eject_statuses: frozenset[int] = frozenset(eject_statuses)
+        self._eject_time: float = eject_time
+        self._next: int = 0  # round-robin start for ties
+        for session in sessions:
+            self.add(session)
+
+    def add(
+        self, session: ThrottledClientSession, params: Mapping[str, str] = dict()
+    ) -> None:
+        """Add a session to the pool. 'params' are added to each request"""
+        assert isinstance(session, ThrottledClientSession), (
+            "session has to be ThrottledClientSession"
+        )
+        if (policy := session.retry_policy) is not None:
+            # a copy: the policy may be shared with sessions outside the pool
+            policy = copy(policy)
+            policy.statuses = policy.statuses - self._eject_statuses
+            session.retry_policy = policy
+        self._members.append(_Member(session, params))
+
+    @property
+    def sessions(self) -> list[ThrottledClientSession]:
+        return [member.session for member in self._members]
+
+    @property
+    def available(self) -> int:
+        """Number of members not ejected"""
+        now: float = time.monotonic()
+        return sum(1 for member in self._members if member.ejected_until <= now)
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    @property
+    def stats_dict(self) -> dict[str, float | int]:
+        """Aggregate statistics of the members"""
+        res: dict[str, float | int] = {
+            "rate": 0,
+            "rate_limit": 0,
+            "count": 0,
+            "errors": 0,
+        }
+        for member in self._members:
+            stats: dict[str, float | int] = member.session.stats_dict
+            for key in res:
+                res[key] += stats[key]
+        res["members"] = len(self._members)
+        res["available"] = self.available
+        res["ejections"] = sum(member.ejections for member in self._members)
+        return res
+
+    @property
+    def stats(self) -> str:
+        stats: dict[str, float | int] = self.stats_dict
+        return (
+            ThrottledClientSession.print_stats(stats)
+            + f", members: {stats['members']:.0f}, available: {stats['available']:.0f}, ejections: {stats['ejections']:.0f}"
+        )
+
+    def _choose(self, exclude: set[int]) -> Optional[int]:
+        """Choose the member with the shortest expected wait"""
+        now: float = time.monotonic()
+        n: int = len(self._members)
+        candidates: list[int] = [
+            idx
+            for idx in ((self._next + i) % n for i in range(n))
+            if idx not in exclude and self._members[idx].ejected_until <= now
+        ]
+        self._next = (self._next + 1) % n
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda idx: self._members[idx].expected_wait())
+
+    async def _wait_available(self) -> int:
+        """Wait until an ejected member returns"""
+        member: _Member = min(self._members, key=lambda m: m.ejected_until)
+        if (wait := member.ejected_until - time.monotonic()) > 0:
+            debug(f"all members ejected, waiting {wait:.1f}s")
+            await sleep(wait)
+        return self._members.index(member)
+
+    def _eject(self, member: _Member, retry_after: str | None) -> None:
+        eject_time: float = self._eject_time
+        if (wait := parse_retry_after(retry_after)) is not None:
+            eject_time = wait
+        member.ejected_until = time.monotonic() + eject_time
+        member.ejections += 1
+        message(f"pool member ejected for {eject_time:.0f}s")
+
+    async def _request(self, method: str, url: Any, **kwargs) -> ClientResponse:
+        assert len(self._members) > 0, "pool is empty"
+        tried: set[int] = set()
+        params: Any = kwargs.pop("params", None)
+        while True:
+            if (idx := self._choose(tried)) is None:
+                idx = await self._wait_available()
+            member: _Member = self._members[idx]
+            tried.add(idx)
+            req_params: Any = params
+            if member.params:
+                req_params = MultiDict(params or {})
+                req_params.update(member.params)
+            resp: ClientResponse = await member.session.request(
+                method, url, params=req_params, **kwargs
+            )
+            if resp.status not in self._eject_statuses:
+                return resp
+            self._eject(member, resp.headers.get("Retry-After"))
+            if len(tried) == len(self._members):
+                return resp  # every member is throttled
+            resp.release()
+
+    def request(self, method: str, url: Any, **kwargs: Any) -> _RequestContextManager:
+        return _RequestContextManager(self._request(method, url, **kwargs))
+
+    def get(self, url: Any, **kwargs: Any) -> _RequestContextManager:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: Any, **kwargs: Any) -> _RequestContextManager:
+        return self.request("HEAD", url, allow_redirects=False, **kwargs)
+
+    def post(self, url: Any, **kwargs: Any) -> _RequestContextManager:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: Any, **kwargs: Any) -> _RequestContextManager:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: Any, **kwargs: Any) -> _RequestContextManager:
+        return self.request("DELETE", url, **kwargs)
+
+    async def close(self) -> None:
+        """Close member sessions"""
+        await gather(*[member.session.close() for member in self._members])
+
+    async def __aenter__(self) -> "SessionPool":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
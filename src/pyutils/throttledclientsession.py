@@ -6,25 +6,65 @@
 #  Inherits aiohttp.ClientSession
 ## -----------------------------------------------------------
 
-from typing import Any, Literal, Optional, Tuple, TypeGuard, Union, get_args
-from aiohttp import ClientSession, ClientResponse
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Iterable,
+    Literal,
+    Optional,
+    Tuple,
+    TypeGuard,
+    Union,
+    get_args,
+)
+from aiohttp import (
+    AsyncResolver,
+    ClientSession,
+    ClientResponse,
+    TCPConnector,
+    ThreadedResolver,
+    TraceConfig,
+)
+from aiohttp.abc import AbstractResolver
+from multidict import CIMultiDict
+from yarl import URL
 from asyncio import (
-    Queue,
+    Future,
+    gather,
+    Semaphore,
     Task,
     CancelledError,
-    TimeoutError,
-    sleep,
+    FIRST_COMPLETED,
+    wait,
     create_task,
-    wait_for,
+    current_task,
+    get_running_loop,
+    shield,
 )
 
-import time
+from types import SimpleNamespace
 import logging
 from warnings import warn
 import re
-from math import ceil, log
 from deprecated import deprecated
 
+from .httpcache import HTTPCache, CacheEntry, body_headers
+from .clock import Clock, SYSTEM_CLOCK
+from .histogram import Histogram, LATENCY_QUANTILES
+from .ratelimiter import RateLimiter, request_priority
+from .ratecounter import RateCounter
+from .retrypolicy import RetryPolicy
+from .httparchive import HTTPArchive
+from .circuitbreaker import CircuitBreaker, CircuitOpenError, CIRCUIT_STATES
+from .bytelimiter import ByteLimiter, ThrottledStreamReader, throttled_upload
+from .compression import (
+    ContentEncoding,
+    COMPRESS_THRESHOLD,
+    compress_body,
+    is_content_encoding,
+)
+
 
 logger = logging.getLogger()
 error = logger.error
@@ -44,15 +84,98 @@ def is_HTTP_method(method: Any) -> TypeGuard[HTTPmethod]:
 
 UrlFilter = Union[str, re.Pattern]
 
+RATE_WINDOWS: list[int] = [10, 60]  # secs
+HEDGE_MIN_SAMPLES: int = 20  # latency samples before adaptive hedge delay
+
+
+class _LatencyStats:
+    """Request latency histograms for a host"""
+
+    KINDS: list[str] = ["wait", "headers", "total"]
+
+    def __init__(self) -> None:
+        self.wait: Histogram = Histogram()  # waiting for a rate-limit token
+        self.headers: Histogram = Histogram()  # time to headers
+        self.total: Histogram = Histogram()  # time to last byte
+
+    def stats_dict(self, host: str) -> dict[str, float | int]:
+        res: dict[str, float | int] = dict()
+        for kind in self.KINDS:
+            hist: Histogram = getattr(self, kind)
+            for label, q in LATENCY_QUANTILES:
+                res[f"latency.{host}.{kind}.{label}"] = hist.quantile(q)
+        return res
+
+
+class _ConnectionStats:
+    """Connection pool and DNS metrics collected with aiohttp.TraceConfig"""
+
+    def __init__(self) -> None:
+        self.new: dict[str, int] = dict()  # new connections per host
+        self.reused: dict[str, int] = dict()  # reused connections per host
+        self.dns_lookups: int = 0
+        self.dns_cache_hits: int = 0
+
+    def trace_config(self) -> TraceConfig:
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_dns_resolvehost_end.append(self._on_dns_resolvehost_end)
+        trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        return trace_config
+
+    async def _on_request_start(
+        self, session: ClientSession, ctx: SimpleNamespace, params: Any
+    ) -> None:
+        ctx.host = params.url.host or ""
+
+    async def _on_connection_create_end(
+        self, session: ClientSession, ctx: SimpleNamespace, params: Any
+    ) -> None:
+        host: str = getattr(ctx, "host", "")
+        self.new[host] = self.new.get(host, 0) + 1
+
+    async def _on_connection_reuseconn(
+        self, session: ClientSession, ctx: SimpleNamespace, params: Any
+    ) -> None:
+        host: str = getattr(ctx, "host", "")
+        self.reused[host] = self.reused.get(host, 0) + 1
+
+    async def _on_dns_resolvehost_end(
+        self, session: ClientSession, ctx: SimpleNamespace, params: Any
+    ) -> None:
+        self.dns_lookups += 1
+
+    async def _on_dns_cache_hit(
+        self, session: ClientSession, ctx: SimpleNamespace, params: Any
+    ) -> None:
+        self.dns_cache_hits += 1
+
+    def stats_dict(self) -> dict[str, float | int]:
+        res: dict[str, float | int] = {
+            "connections_new": sum(self.new.values()),
+            "connections_reused": sum(self.reused.values()),
+            "dns_lookups": self.dns_lookups,
+            "dns_cache_hits": self.dns_cache_hits,
+        }
+        for host in sorted(self.new.keys() | self.reused.keys()):
+            res[f"connections.{host}.new"] = self.new.get(host, 0)
+            res[f"connections.{host}.reused"] = self.reused.get(host, 0)
+        return res
+
 
 class ThrottledClientSession(ClientSession):
     """
     Rate-throttled client session class inherited from aiohttp.ClientSession)
 
     Inherits from aiohttp.ClientSession that may cause a warning.
-    """
 
-    _LOG_FILLER: int = 20
+    Connection pool options ('limit', 'limit_per_host', 'keepalive_timeout',
+    'ttl_dns_cache', 'async_dns') configure the TCPConnector and are ignored
+    if a 'connector' is given. Hosts are resolved with aiohttp's default
+    ThreadedResolver unless 'async_dns' is set.
+    """
 
     def __init__(
         self,
@@ -60,25 +183,131 @@ class ThrottledClientSession(ClientSession):
         filters: list[UrlFilter | Tuple[Optional[str], UrlFilter]] = list(),
         limit_filtered: bool = False,  # whether 'filters' allow/whitelists URLs
         re_filter: bool = False,  # use regexp filters
+        cache: Optional[HTTPCache] = None,
+        coalesce: bool = False,  # share identical in-flight GET requests
+        max_inflight: int = 0,  # max concurrent requests, 0 = unlimited
+        max_inflight_per_host: int = 0,  # max concurrent requests per host
+        latency_stats: bool = False,  # collect per-host latency histograms
+        lane_reserve: dict[int, float] = dict(),  # priority: reserved share
+        retry_policy: Optional[RetryPolicy] = None,
+        compress: Optional[ContentEncoding] = None,  # compress request bodies
+        compress_threshold: int = COMPRESS_THRESHOLD,  # min body size to compress
+        archive: Optional[HTTPArchive] = None,  # record or replay traffic
+        hedge: bool = False,  # hedge slow GET requests
+        hedge_delay: float = 1,  # hedge delay until enough latency samples
+        hedge_quantile: float = 0.95,  # adaptive hedge delay quantile
+        hedge_budget: float = 0.05,  # max share of requests hedged
+        circuit_breaker: Optional[CircuitBreaker] = None,  # per-host breaker
+        bandwidth: float = 0,  # download limit, bytes/sec, 0 = unlimited
+        upload_bandwidth: float = 0,  # upload limit, bytes/sec, 0 = unlimited
+        # (filter, download, upload) bandwidth limits for matching URLs
+        bandwidth_filters: list[Tuple[UrlFilter, float, float]] = list(),
+        limit: int = 100,  # max connections, 0 = unlimited
+        limit_per_host: int = 0,  # max connections per host, 0 = unlimited
+        keepalive_timeout: float = 15,  # secs, idle keep-alive connections
+        ttl_dns_cache: Optional[int] = 10,  # secs, None = cache forever
+        async_dns: bool = False,  # resolve with aiodns (AsyncResolver)
+        warm_up: list[str] = list(),  # URLs whose hosts are resolved at start
+        connection_stats: bool = False,  # collect connection and DNS metrics
+        rate_limiter: Optional[RateLimiter] = None,  # shared rate limiter
+        clock: Clock = SYSTEM_CLOCK,  # time source for rate limits and stats
         *args,
         **kwargs,
     ) -> None:
         assert isinstance(rate_limit, (int, float)), "rate_limit has to be float"
         assert isinstance(filters, list), "filters has to be list"
         assert isinstance(limit_filtered, bool), "limit_filtered has to be bool"
+        assert max_inflight >= 0, "max_inflight cannot be negative"
+        assert max_inflight_per_host >= 0, "max_inflight_per_host cannot be negative"
+        assert compress is None or is_content_encoding(compress), (
+            "compress has to be 'br', 'gzip' or None"
+        )
+        assert compress_threshold >= 0, "compress_threshold cannot be negative"
+        assert hedge_delay >= 0, "hedge_delay cannot be negative"
+        assert 0 < hedge_quantile < 1, "hedge_quantile has to be 0 < quantile < 1"
+        assert hedge_budget >= 0, "hedge_budget cannot be negative"
+        assert bandwidth >= 0, "bandwidth cannot be negative"
+        assert upload_bandwidth >= 0, "upload_bandwidth cannot be negative"
+        assert limit >= 0, "limit cannot be negative"
+        assert limit_per_host >= 0, "limit_per_host cannot be negative"
+        assert keepalive_timeout >= 0, "keepalive_timeout cannot be negative"
         # assert isinstance(re_filter, bool), "re_filter has to be bool"
 
+        self._resolver: Optional[AbstractResolver] = None  # closed by close()
+        if kwargs.get("connector") is None:
+            self._resolver = AsyncResolver() if async_dns else ThreadedResolver()
+            kwargs["connector"] = TCPConnector(
+                limit=limit,
+                limit_per_host=limit_per_host,
+                keepalive_timeout=keepalive_timeout,
+                ttl_dns_cache=ttl_dns_cache,
+                resolver=self._resolver,
+            )
+        self._connection_stats: Optional[_ConnectionStats] = None
+        if connection_stats:
+            self._connection_stats = _ConnectionStats()
+            kwargs["trace_configs"] = list(kwargs.get("trace_configs") or []) + [
+                self._connection_stats.trace_config()
+            ]
+
         super().__init__(*args, **kwargs)
 
-        self._rate_limit: float = rate_limit
-        self._fillerTask: Optional[Task] = None
-        self._qlen: int = 1
-        if rate_limit > self._LOG_FILLER:
-            self._qlen = ceil(log(rate_limit))
-        self._queue: Queue = Queue(maxsize=self._qlen)
-        self._start_time: float = time.time()
+        self._clock: Clock = clock
+        self._own_limiter: bool = rate_limiter is None
+        if rate_limiter is None and rate_limit > 0:
+            rate_limiter = RateLimiter(
+                rate_limit, lane_reserve=lane_reserve, clock=clock
+            )
+        self._rate_limiter: Optional[RateLimiter] = rate_limiter
+        self._rate_limit: float = 0
+        if rate_limiter is not None:
+            self._rate_limit = rate_limiter.rate_limit
+        self._retry_policy: Optional[RetryPolicy] = retry_policy
+        self._retries: int = 0
+        self._start_time: float = self._clock.monotonic()
+        self._rates: RateCounter = RateCounter(window=max(RATE_WINDOWS), clock=clock)
         self._count: int = 0
         self._errors: int = 0
+        self._cache: Optional[HTTPCache] = cache
+        self._cache_hits: int = 0
+        self._cache_misses: int = 0
+        self._cache_revalidated: int = 0
+        self._coalesce: bool = coalesce
+        self._coalesced: int = 0
+        self._coalescing: dict[tuple, Future[CacheEntry]] = dict()
+        self._max_inflight: int = max_inflight
+        self._max_inflight_per_host: int = max_inflight_per_host
+        self._inflight_sem: Semaphore = Semaphore(max(max_inflight, 1))
+        self._host_sems: dict[str, Semaphore] = dict()
+        self._inflight: int = 0
+        self._waiting: int = 0
+        self._latency_stats: bool = latency_stats
+        self._latency: dict[str, _LatencyStats] = dict()
+        self._compress: Optional[ContentEncoding] = compress
+        self._compress_threshold: int = compress_threshold
+        self._compressed: int = 0
+        self._compress_saved: int = 0
+        self._archive: Optional[HTTPArchive] = archive
+        self._archived: int = 0
+        self._hedge: bool = hedge
+        self._hedge_delay: float = hedge_delay
+        self._hedge_quantile: float = hedge_quantile
+        self._hedge_budget: float = hedge_budget
+        self._hedge_latency: dict[str, Histogram] = dict()
+        self._hedged: int = 0
+        self._hedge_wins: int = 0
+        self._circuit_breaker: Optional[CircuitBreaker] = circuit_breaker
+        self._download_limiter: Optional[ByteLimiter] = (
+            ByteLimiter(bandwidth, clock=clock) if bandwidth > 0 else None
+        )
+        self._upload_limiter: Optional[ByteLimiter] = (
+            ByteLimiter(upload_bandwidth, clock=clock) if upload_bandwidth > 0 else None
+        )
+        self._bandwidth_filters: list[
+            Tuple[UrlFilter, Optional[ByteLimiter], Optional[ByteLimiter]]
+        ] = list()
+        self._bytes_in: int = 0
+        self._bytes_out: int = 0
         self._limit_filtered: bool = limit_filtered
         # self._re_filter: bool = re_filter
         self._filters: list[Tuple[Optional[HTTPmethod], UrlFilter]] = list()
@@ -91,8 +320,13 @@ class ThrottledClientSession(ClientSession):
             elif isinstance(filter, str) or isinstance(filter, re.Pattern):
                 url = filter
             self.add_filter(filter=url, method=method)
+        for url, download, upload in bandwidth_filters:
+            self.add_bandwidth_filter(url, download=download, upload=upload)
 
         self._set_limit()
+        self._warm_up_task: Optional[Task] = None
+        if len(warm_up) > 0:
+            self._warm_up_task = create_task(self.warm_up(warm_up))
 
     def add_filter(self, filter: UrlFilter, method: str | None = None):
         """Add a filter to filter list"""
@@ -103,11 +337,58 @@ class ThrottledClientSession(ClientSession):
         # else:
         self._filters.append((method, filter))
 
+    def add_bandwidth_filter(
+        self, filter: UrlFilter, download: float = 0, upload: float = 0
+    ) -> None:
+        """Add own bandwidth limits (bytes/sec, 0 = unlimited) for URLs matching
+        the filter. The first matching filter applies in addition to the
+        session's limits"""
+        assert download >= 0, "download cannot be negative"
+        assert upload >= 0, "upload cannot be negative"
+        self._bandwidth_filters.append(
+            (
+                filter,
+                ByteLimiter(download, clock=self._clock) if download > 0 else None,
+                ByteLimiter(upload, clock=self._clock) if upload > 0 else None,
+            )
+        )
+
+    async def warm_up(self, urls: Iterable[str]) -> int:
+        """Resolve hosts of URLs into the connector's DNS cache.
+        Returns the number of hosts resolved.
+
+        Uses TCPConnector._resolve_host() that fills the DNS cache. If it is
+        not available in the aiohttp version, hosts are resolved with the
+        session's resolver (the resolver's own cache only)"""
+        connector: Any = self.connector
+        if not isinstance(connector, TCPConnector):
+            return 0
+        resolve: Callable[[str, int], Awaitable[Any]] | None = getattr(
+            connector, "_resolve_host", None
+        )
+        if resolve is None:
+            if self._resolver is None:
+                return 0
+            resolve = self._resolver.resolve
+        hosts: set[tuple[str, int]] = set()
+        for url in urls:
+            u: URL = URL(url)
+            if u.host is not None and u.port is not None:
+                hosts.add((u.host, u.port))
+        res: list[Any] = await gather(
+            *[resolve(host, port) for host, port in hosts],
+            return_exceptions=True,
+        )
+        for (host, _), result in zip(hosts, res):
+            if isinstance(result, Exception):
+                message(f"could not resolve {host}: {result}")
+        return sum(1 for result in res if not isinstance(result, Exception))
+
     @deprecated(version="1.1.0", reason="Use 'rate' property instead")
     def get_rate(self) -> float:
         """Return rate of requests"""
         warn("Depreaciated: Use 'rate' property")
-        return self._count / (time.time() - self._start_time)
+        return self.rate
 
     @classmethod
     def _rate_str(cls, rate: float) -> str:
@@ -130,7 +411,13 @@ class ThrottledClientSession(ClientSession):
 
     @property
     def rate(self) -> float:
-        return self._count / (time.time() - self._start_time)
+        """Average rate of requests since the start or reset_counters()"""
+        elapsed: float = self._clock.monotonic() - self._start_time
+        return self._count / elapsed if elapsed > 0 else 0
+
+    def rate_window(self, seconds: int) -> float:
+        """Rate of requests during the last 'seconds' (max 60)"""
+        return self._rates.rate(seconds)
 
     @property
     def rate_str(self) -> str:
@@ -144,22 +431,133 @@ class ThrottledClientSession(ClientSession):
     def errors(self) -> int:
         return self._errors
 
+    @property
+    def rate_limiter(self) -> Optional[RateLimiter]:
+        return self._rate_limiter
+
+    @property
+    def tokens(self) -> int:
+        """Number of rate-limit tokens available"""
+        if self._rate_limiter is None:
+            return 0
+        return self._rate_limiter.tokens
+
+    @property
+    def token_waiters(self) -> int:
+        """Number of requests waiting for a rate-limit token"""
+        if self._rate_limiter is None:
+            return 0
+        return self._rate_limiter.waiters
+
+    @property
+    def inflight(self) -> int:
+        """Number of requests in-flight, i.e. started and not yet released"""
+        return self._inflight
+
+    @property
+    def waiting(self) -> int:
+        """Number of requests waiting for an in-flight slot"""
+        return self._waiting
+
+    @property
+    def retry_policy(self) -> Optional[RetryPolicy]:
+        return self._retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, policy: Optional[RetryPolicy]) -> None:
+        self._retry_policy = policy
+
+    @property
+    def retries(self) -> int:
+        return self._retries
+
+    @property
+    def cache(self) -> Optional[HTTPCache]:
+        return self._cache
+
+    @property
+    def archive(self) -> Optional[HTTPArchive]:
+        return self._archive
+
+    @property
+    def circuit_breaker(self) -> Optional[CircuitBreaker]:
+        return self._circuit_breaker
+
+    @property
+    def bytes_in(self) -> int:
+        """Bytes received. Counted only when bandwidth limits are set"""
+        return self._bytes_in
+
+    @property
+    def bytes_out(self) -> int:
+        """Bytes sent. Counted only when bandwidth limits are set"""
+        return self._bytes_out
+
+    @property
+    def bandwidth_limited(self) -> bool:
+        return (
+            self._download_limiter is not None
+            or self._upload_limiter is not None
+            or len(self._bandwidth_filters) > 0
+        )
+
     @property
     def stats(self) -> str:
         """Get session statistics as string"""
-        return f"rate limit: {self.rate_limit_str}, rate: {self.rate_str}, requests: {self.count}, errors: {self.errors}"
+        return (
+            f"rate limit: {self.rate_limit_str}, rate: {self.rate_str}, requests: {self.count}, errors: {self.errors}"
+            + self._print_stats_extra(self.stats_dict)
+        )
 
     @property
     def stats_dict(self) -> dict[str, float | int]:
         """Get session statistics as dict"""
-        res = {
+        res: dict[str, float | int] = {
             "rate": self.rate,
             "rate_limit": self.rate_limit,
             "count": self.count,
             "errors": self.errors,
         }
+        for window in RATE_WINDOWS:
+            res[f"rate_{window}s"] = self.rate_window(window)
+        if self._retry_policy is not None:
+            res["retries"] = self.retries
+        if self._cache is not None:
+            res["cache_hits"] = self._cache_hits
+            res["cache_misses"] = self._cache_misses
+            res["cache_revalidated"] = self._cache_revalidated
+        if self._coalesce:
+            res["coalesced"] = self._coalesced
+        if self._max_inflight > 0 or self._max_inflight_per_host > 0:
+            res["inflight"] = self.inflight
+            res["waiting"] = self.waiting
+        if self._compressed > 0 or self._compress is not None:
+            res["compressed"] = self._compressed
+            res["compress_saved"] = self._compress_saved
+        if self._hedge:
+            res["hedged"] = self._hedged
+            res["hedge_wins"] = self._hedge_wins
+        if (breaker := self._circuit_breaker) is not None:
+            res["circuit_rejected"] = breaker.rejected
+            for host, state in breaker.states().items():
+                res[f"circuit.{host}"] = CIRCUIT_STATES[state]
+        if self._archive is not None:
+            res[f"archive_{self._archive.mode}ed"] = self._archived
+        if self.bandwidth_limited:
+            res["bytes_in"] = self._bytes_in
+            res["bytes_out"] = self._bytes_out
+        if self._connection_stats is not None:
+            res.update(self._connection_stats.stats_dict())
+        for host, latency in self._latency.items():
+            res.update(latency.stats_dict(host))
+        if self._rate_limiter is not None:
+            res.update(self._rate_limiter.lane_stats)
         return res
 
+    def latency(self, host: str) -> Optional[_LatencyStats]:
+        """Get latency histograms of a host"""
+        return self._latency.get(host)
+
     @classmethod
     def print_stats(cls, stats: dict[str, float | int]) -> str:
         try:
@@ -174,89 +572,586 @@ class ThrottledClientSession(ClientSession):
             else:
                 rate_limit_str = f"{1/rate_limit:.1f} secs/request"
 
-            return f"rate limit: {rate_limit_str}, rate: {rate:.1f} request/sec, requests: {count:.0f}, errors: {errors:.0f}"
+            return (
+                f"rate limit: {rate_limit_str}, rate: {rate:.1f} request/sec, requests: {count:.0f}, errors: {errors:.0f}"
+                + cls._print_stats_extra(stats)
+            )
         except KeyError as err:
             return f"Incorrect stats format: {err}"
         except Exception as err:
             return f"Unexpected error: {err}"
 
+    @classmethod
+    def _print_stats_extra(cls, stats: dict[str, float | int]) -> str:
+        """Format optional statistics"""
+        res: str = ""
+        for window in RATE_WINDOWS:
+            if (rate := stats.get(f"rate_{window}s")) is not None:
+                res += f", rate {window}s: {rate:.1f} request/sec"
+        if "retries" in stats:
+            res += f", retries: {stats['retries']:.0f}"
+        if "cache_hits" in stats:
+            res += f", cache hits: {stats['cache_hits']:.0f}, misses: {stats['cache_misses']:.0f}, revalidated: {stats['cache_revalidated']:.0f}"
+        if "coalesced" in stats:
+            res += f", coalesced: {stats['coalesced']:.0f}"
+        if "inflight" in stats:
+            res += (
+                f", in-flight: {stats['inflight']:.0f}, waiting: {stats['waiting']:.0f}"
+            )
+        if "compressed" in stats:
+            res += f", compressed bodies: {stats['compressed']:.0f}, saved: {stats['compress_saved'] / 1024:.1f} KiB"
+        if "hedged" in stats:
+            res += f", hedged: {stats['hedged']:.0f}, hedge wins: {stats['hedge_wins']:.0f}"
+        if "circuit_rejected" in stats:
+            res += f", circuit rejected: {stats['circuit_rejected']:.0f}"
+            states: dict[int, str] = {n: state for state, n in CIRCUIT_STATES.items()}
+            for key, value in stats.items():
+                if key.startswith("circuit.") and value != CIRCUIT_STATES["closed"]:
+                    res += f", circuit {states[int(value)]}: {key[len('circuit.') :]}"
+        for mode in ["record", "replay"]:
+            if (archived := stats.get(f"archive_{mode}ed")) is not None:
+                res += f", archive {mode}ed: {archived:.0f}"
+        if "bytes_in" in stats:
+            res += f", received: {stats['bytes_in'] / 1024:.1f} KiB, sent: {stats['bytes_out'] / 1024:.1f} KiB"
+        if "connections_new" in stats:
+            res += f", connections new: {stats['connections_new']:.0f}, reused: {stats['connections_reused']:.0f}"
+            res += f", DNS lookups: {stats['dns_lookups']:.0f}, DNS cache hits: {stats['dns_cache_hits']:.0f}"
+        res += cls._print_latency(stats)
+        for key, value in stats.items():
+            if key.startswith("lane.") and key.endswith(".count"):
+                lane: str = key.split(".")[1]
+                waits: str = "/".join(
+                    f"{stats[f'lane.{lane}.wait.{label}'] * 1000:.0f}"
+                    for label, _ in LATENCY_QUANTILES
+                )
+                res += f", priority {lane}: requests {value:.0f}, token wait {waits} ms"
+        return res
+
+    @classmethod
+    def _print_latency(cls, stats: dict[str, float | int]) -> str:
+        """Format latency quantiles (ms) from stats dict"""
+        latency: dict[str, dict[str, list[str]]] = dict()
+        for key, value in stats.items():
+            if not key.startswith("latency."):
+                continue
+            host, kind, _ = key[len("latency.") :].rsplit(".", 2)
+            latency.setdefault(host, dict()).setdefault(kind, list()).append(
+                f"{value * 1000:.0f}"
+            )
+        res: str = ""
+        labels: str = "/".join(label for label, _ in LATENCY_QUANTILES)
+        for host, kinds in latency.items():
+            res += f", {host} latency {labels} (ms): " + ", ".join(
+                f"{kind} {'/'.join(values)}" for kind, values in kinds.items()
+            )
+        return res
+
     def reset_counters(self) -> dict[str, float | int]:
         """Reset rate counters and return current results"""
         res = self.stats_dict
-        self._start_time = time.time()
+        self._start_time = self._clock.monotonic()
         self._count = 0
         return res
 
     def _set_limit(self) -> float:
-        if self._fillerTask is not None:
-            self._fillerTask.cancel()
-            self._fillerTask = None
-
-        if self._rate_limit > self._LOG_FILLER:
-            self._fillerTask = create_task(self._filler())
-        elif self._rate_limit > 0:
-            self._fillerTask = create_task(self._filler_simple())
-
+        if self._rate_limiter is not None:
+            self._rate_limiter.start()
         return self._rate_limit
 
     async def close(self) -> None:
         """Close rate-limiter's "bucket filler" task"""
         debug(self.stats)
-        try:
-            if self._fillerTask is not None:
-                self._fillerTask.cancel()
-                await wait_for(self._fillerTask, timeout=0.5)
-        except TimeoutError as err:
-            debug(f"Timeout while cancelling bucket filler: {err}")
-        except CancelledError:
-            debug("Cancelled")
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+        if self._rate_limiter is not None and self._own_limiter:
+            await self._rate_limiter.close()
         await super().close()
-
-    async def _filler_simple(self) -> None:
-        """Filler task to fill the leaky bucket algo"""
-        assert self.rate_limit > 0, "_filler cannot be started without rate limit"
-        try:
-            wait: float = self._qlen / self.rate_limit
-            # debug(f'SLEEP: {1/self.rate_limit}')
-            while True:
-                await self._queue.put(None)
-                await sleep(wait)
-        except CancelledError:
-            debug("Cancelled")
-        except Exception as err:
-            error(f"{err}")
-        # finally:
-        # 	self._queue = None
-        return None
-
-    async def _filler(self) -> None:
-        """Filler task to fill the leaky bucket algo.
-        Uses longer queue for performance (maybe) :-)"""
-        assert self.rate_limit > 0, "_filler cannot be started without rate limit"
-        try:
-            wait: float = self._qlen / self.rate_limit
-            # debug(f'SLEEP: {wait}')
-            while True:
-                for _ in range(self._qlen):
-                    await self._queue.put(None)
-                await sleep(wait)
-        except CancelledError:
-            debug("Cancelled")
-        except Exception as err:
-            error(f"{err}")
-        return None
+        if self._resolver is not None:
+            await self._resolver.close()
 
     async def _request(self, *args, **kwargs) -> ClientResponse:
         """Throttled _request()"""
-        if self.is_limited(method=args[0], url=args[1]):
-            await self._queue.get()
-            self._queue.task_done()
-        resp: ClientResponse = await super()._request(*args, **kwargs)
+        if (priority := kwargs.pop("priority", None)) is not None:
+            ctx = request_priority.set(priority)
+            try:
+                return await self._request(*args, **kwargs)
+            finally:
+                request_priority.reset(ctx)
+        encoding: Optional[ContentEncoding] = kwargs.pop("compress_body", self._compress)
+        threshold: int = kwargs.pop("compress_threshold", self._compress_threshold)
+        if encoding is not None and args[0] not in ("GET", "HEAD"):
+            await self._compress_request(encoding, threshold, kwargs)
+        if self._archive is not None:
+            return await self._archived_request(*args, **kwargs)
+        if self._coalesce and args[0] == "GET":
+            return await self._coalesced_request(*args, **kwargs)
+        return await self._get_request(*args, **kwargs)
+
+    async def _compress_request(
+        self, encoding: ContentEncoding, threshold: int, kwargs: dict[str, Any]
+    ) -> None:
+        """Compress 'data' or 'json' request body in place if it is large enough.
+        Bodies with 'Content-Encoding' header set are not touched"""
+        headers: CIMultiDict[str] = CIMultiDict(kwargs.get("headers") or {})
+        if "Content-Encoding" in headers:
+            return
+        data: Any = kwargs.get("data")
+        if kwargs.get("json") is not None and data is None:
+            data = self._json_serialize(kwargs["json"])
+            headers.setdefault("Content-Type", "application/json")
+        elif not isinstance(data, (bytes, bytearray, str)):
+            return
+        if isinstance(data, str):
+            data = data.encode()
+            headers.setdefault("Content-Type", "text/plain; charset=utf-8")
+        if (
+            body := await compress_body(bytes(data), encoding, threshold)
+        ) is None:
+            return
+        headers["Content-Encoding"] = encoding
+        kwargs.pop("json", None)
+        kwargs["data"] = body
+        kwargs["headers"] = headers
+        self._compressed += 1
+        self._compress_saved += len(data) - len(body)
+
+    async def _archived_request(self, *args, **kwargs) -> ClientResponse:
+        """Record the request to the archive or replay it from the archive.
+        Replayed requests are not rate-limited"""
+        assert self._archive is not None, "archive is not set"
+        method: str = args[0]
+        url: str = self._request_url(args[1], kwargs.get("params"))
+        body: bytes | None = None
+        if isinstance(data := kwargs.get("data"), (bytes, bytearray, str)):
+            body = data.encode() if isinstance(data, str) else bytes(data)
+        elif kwargs.get("json") is not None:
+            body = self._json_serialize(kwargs["json"]).encode()
+
+        if self._archive.mode == "replay":
+            self._archived += 1
+            return self._archive.replay(self, method, url, body)
+
+        resp: ClientResponse
+        if self._coalesce and method == "GET":
+            resp = await self._coalesced_request(*args, **kwargs)
+        else:
+            resp = await self._get_request(*args, **kwargs)
+        await self._archive.record(
+            method,
+            url,
+            request_headers=kwargs.get("headers"),
+            request_body=body,
+            status=resp.status,
+            reason=resp.reason or "",
+            headers=resp.headers.items(),
+            body=await resp.read(),
+        )
+        self._archived += 1
+        return resp
+
+    async def _get_request(self, *args, **kwargs) -> ClientResponse:
+        if self._cache is not None and args[0] == "GET":
+            return await self._cached_request(*args, **kwargs)
+        return await self._throttled_request(*args, **kwargs)
+
+    async def _throttled_request(self, *args, **kwargs) -> ClientResponse:
+        """Make the request and retry it according to the retry policy.
+        Each retry waits for a rate-limit token"""
+        if (policy := self._retry_policy) is None:
+            return await self._send_request(*args, **kwargs)
+        method: str = args[0]
+        policy.add_request()
+        attempt: int = 0
+        wait: float
+        while True:
+            try:
+                resp: ClientResponse = await self._send_request(*args, **kwargs)
+                if not policy.retry_status(method, resp.status, attempt):
+                    return resp
+                wait = policy.delay(attempt, resp.headers.get("Retry-After"))
+                resp.release()
+                debug(f"{method} {args[1]}: HTTP {resp.status}, retry in {wait:.2f}s")
+            except (CancelledError, CircuitOpenError):
+                raise
+            except Exception as err:
+                if not policy.retry_exception(method, err, attempt):
+                    raise
+                wait = policy.delay(attempt)
+                debug(f"{method} {args[1]}: {type(err).__name__}, retry in {wait:.2f}s")
+            self._retries += 1
+            attempt += 1
+            await self._clock.sleep(wait)
+
+    async def _send_request(self, *args, **kwargs) -> ClientResponse:
+        """Wait for an in-flight slot and a rate-limit token and make the request"""
+        breaker: Optional[CircuitBreaker] = self._circuit_breaker
+        host: str = ""
+        if breaker is not None:
+            host = URL(args[1]).host or ""
+            if not breaker.allow(host):
+                raise CircuitOpenError(f"circuit open: {host}")
+        release: Callable[[], None] | None = None
+        io_done: Callable[[], None] | None = None
+        try:
+            if self._max_inflight > 0 or self._max_inflight_per_host > 0:
+                release = await self._acquire_slot(args[1])
+            start: float = self._clock.monotonic()
+            if self._rate_limiter is not None and self.is_limited(
+                method=args[0], url=args[1]
+            ):
+                await self._rate_limiter.acquire()
+            if self.bandwidth_limited:
+                kwargs = self._throttle_upload(args[1], kwargs)
+            sent: float = self._clock.monotonic()
+            io_done = self._clock.start_io()
+            resp: ClientResponse
+            if self._hedge and args[0] == "GET":
+                resp = await self._hedged_send(*args, **kwargs)
+            else:
+                resp = await super()._request(*args, **kwargs)
+        except BaseException as err:
+            if io_done is not None:
+                io_done()
+            if release is not None:
+                release()
+            if breaker is not None:
+                self._report_breaker(breaker, host, err=err)
+            raise
+        self._on_release(resp, io_done)
+        if release is not None:
+            self._on_release(resp, release)
+        if breaker is not None:
+            self._report_breaker(breaker, host, resp=resp)
+        if self.bandwidth_limited:
+            self._throttle_download(resp)
+        if self._latency_stats:
+            self._add_latency(resp, start, sent)
         self._count += 1
-        if not resp.ok:
+        self._rates.add()
+        if not resp.ok and resp.status != 304:
             self._errors += 1
         return resp
 
+    @classmethod
+    def _report_breaker(
+        cls,
+        breaker: CircuitBreaker,
+        host: str,
+        resp: ClientResponse | None = None,
+        err: BaseException | None = None,
+    ) -> None:
+        """Report the outcome of a request allowed by the circuit breaker"""
+        if resp is not None:
+            if breaker.is_failure(resp.status):
+                breaker.failure(host)
+            else:
+                breaker.success(host)
+        elif isinstance(err, breaker.exceptions):
+            breaker.failure(host)
+        else:
+            breaker.cancel(host)
+
+    def _bandwidth_limiters(self, url: str, upload: bool) -> list[ByteLimiter]:
+        """Get the session's and the first matching filter's byte limiters"""
+        limiter: Optional[ByteLimiter] = (
+            self._upload_limiter if upload else self._download_limiter
+        )
+        res: list[ByteLimiter] = [limiter] if limiter is not None else []
+        for url_filter, download, upload_limiter in self._bandwidth_filters:
+            if self._match_url(url_filter, url):
+                if (limiter := upload_limiter if upload else download) is not None:
+                    res.append(limiter)
+                break
+        return res
+
+    def _throttle_upload(
+        self, url: str | URL, kwargs: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Replace 'data' or 'json' request body with a throttled stream.
+        Returns new kwargs so that retries get a fresh stream"""
+        data: Any = kwargs.get("data")
+        headers: CIMultiDict[str] = CIMultiDict(kwargs.get("headers") or {})
+        if kwargs.get("json") is not None and data is None:
+            data = self._json_serialize(kwargs["json"])
+            headers.setdefault("Content-Type", "application/json")
+        elif not isinstance(data, (bytes, bytearray, str)):
+            return kwargs
+        if isinstance(data, str):
+            data = data.encode()
+            headers.setdefault("Content-Type", "text/plain; charset=utf-8")
+        limiters: list[ByteLimiter] = self._bandwidth_limiters(str(url), upload=True)
+        if len(limiters) == 0:
+            self._bytes_out += len(data)
+            return kwargs
+        headers["Content-Length"] = str(len(data))
+        kwargs = dict(kwargs)
+        kwargs.pop("json", None)
+        kwargs["data"] = throttled_upload(bytes(data), limiters, self._add_bytes_out)
+        kwargs["headers"] = headers
+        return kwargs
+
+    def _throttle_download(self, resp: ClientResponse) -> None:
+        """Throttle reading the response body and count the bytes received"""
+        content = resp.content
+
+        def count() -> None:
+            self._bytes_in += content.total_bytes
+
+        limiters: list[ByteLimiter] = self._bandwidth_limiters(
+            str(resp.url), upload=False
+        )
+        if len(limiters) > 0:
+            resp.content = ThrottledStreamReader(content, limiters)  # type: ignore[assignment]
+        self._on_release(resp, count)
+
+    def _add_bytes_out(self, n: int) -> None:
+        self._bytes_out += n
+
+    def hedge_delay(self, host: str) -> float:
+        """Current hedge delay of a host: 'hedge_quantile' of the observed
+        latencies or 'hedge_delay' until there are enough samples"""
+        if (latency := self._hedge_latency.get(host)) is None:
+            return self._hedge_delay
+        if latency.count < HEDGE_MIN_SAMPLES:
+            return self._hedge_delay
+        return latency.quantile(self._hedge_quantile)
+
+    async def _hedged_send(self, *args, **kwargs) -> ClientResponse:
+        """Send a hedge request if there is no response within the hedge delay.
+        The first response wins and the other request is cancelled.
+        The hedge request waits for its own in-flight slot and rate-limit
+        token and is not sent if the circuit breaker does not allow it"""
+        host: str = URL(args[1]).host or ""
+        if (latency := self._hedge_latency.get(host)) is None:
+            latency = Histogram()
+            self._hedge_latency[host] = latency
+        first: Task[ClientResponse] = create_task(
+            self._hedge_attempt(latency, False, *args, **kwargs)
+        )
+        tasks: set[Task[ClientResponse]] = {first}
+        try:
+            done, _ = await wait(tasks, timeout=self.hedge_delay(host))
+            if (
+                not done
+                and self._hedged < self._hedge_budget * self._count + 1
+                and (
+                    self._circuit_breaker is None
+                    or self._circuit_breaker.allow(host)
+                )
+            ):
+                self._hedged += 1
+                debug(f"hedging GET {args[1]}")
+                tasks.add(
+                    create_task(self._hedge_attempt(latency, True, *args, **kwargs))
+                )
+            resp: ClientResponse | None = None
+            err: BaseException | None = None
+            while tasks and resp is None:
+                done, tasks = await wait(tasks, return_when=FIRST_COMPLETED)
+                for task in done:
+                    if (exc := task.exception()) is not None:
+                        err = err or exc
+                    elif resp is None:
+                        resp = task.result()
+                        if task is not first:
+                            self._hedge_wins += 1
+                    else:
+                        task.result().release()
+            if resp is None:
+                assert err is not None
+                raise err
+            return resp
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _hedge_attempt(
+        self, latency: Histogram, hedge: bool, *args, **kwargs
+    ) -> ClientResponse:
+        """Make a request and record its latency to headers. The first
+        attempt runs within _send_request(). A hedge request acquires its own
+        in-flight slot and rate-limit token and reports its outcome to the
+        circuit breaker, which has allowed it in _hedged_send()"""
+        if not hedge:
+            start: float = self._clock.monotonic()
+            resp: ClientResponse = await super()._request(*args, **kwargs)
+            latency.add(self._clock.monotonic() - start)
+            return resp
+
+        breaker: Optional[CircuitBreaker] = self._circuit_breaker
+        host: str = URL(args[1]).host or ""
+        release: Callable[[], None] | None = None
+        try:
+            if self._max_inflight > 0 or self._max_inflight_per_host > 0:
+                release = await self._acquire_slot(args[1])
+            if self._rate_limiter is not None and self.is_limited(
+                method=args[0], url=args[1]
+            ):
+                await self._rate_limiter.acquire()
+            start = self._clock.monotonic()
+            resp = await super()._request(*args, **kwargs)
+        except BaseException as err:
+            if release is not None:
+                release()
+            if breaker is not None:
+                self._report_breaker(breaker, host, err=err)
+            raise
+        latency.add(self._clock.monotonic() - start)
+        if release is not None:
+            self._on_release(resp, release)
+        if breaker is not None:
+            self._report_breaker(breaker, host, resp=resp)
+        return resp
+
+    async def _acquire_slot(self, url: str | URL) -> Callable[[], None]:
+        """Acquire global and per-host in-flight slots.
+        Returns a function to release the slots"""
+        sems: list[Semaphore] = list()
+        if self._max_inflight > 0:
+            sems.append(self._inflight_sem)
+        if self._max_inflight_per_host > 0:
+            host: str = URL(url).host or ""
+            if (sem := self._host_sems.get(host)) is None:
+                sem = Semaphore(self._max_inflight_per_host)
+                self._host_sems[host] = sem
+            sems.append(sem)
+        acquired: list[Semaphore] = list()
+        released: bool = False
+
+        def release() -> None:
+            nonlocal released
+            if released:
+                return None
+            released = True
+            for sem in acquired:
+                sem.release()
+            self._inflight -= 1
+
+        self._waiting += 1
+        try:
+            for sem in sems:
+                await sem.acquire()
+                acquired.append(sem)
+        except BaseException:
+            for sem in acquired:
+                sem.release()
+            raise
+        finally:
+            self._waiting -= 1
+        self._inflight += 1
+        return release
+
+    def _add_latency(self, resp: ClientResponse, start: float, sent: float) -> None:
+        """Record request latencies"""
+        host: str = resp.url.host or ""
+        if (latency := self._latency.get(host)) is None:
+            latency = _LatencyStats()
+            self._latency[host] = latency
+        latency.wait.add(sent - start)
+        latency.headers.add(self._clock.monotonic() - sent)
+        total: Histogram = latency.total
+        self._on_release(resp, lambda: total.add(self._clock.monotonic() - sent))
+
+    @classmethod
+    def _on_release(cls, resp: ClientResponse, callback: Callable[[], None]) -> None:
+        """Call callback once the response has been read or released"""
+        if resp.connection is not None:
+            resp.connection.add_callback(callback)
+        else:
+            callback()
+
+    @classmethod
+    def _request_url(cls, url: str | URL, params: Any = None) -> str:
+        """Full URL of a request including query params"""
+        if params:
+            return str(URL(url).extend_query(params))
+        return str(url)
+
+    async def _cached_request(self, *args, **kwargs) -> ClientResponse:
+        """GET request served from the cache when fresh, revalidated if stale.
+        Fresh cache hits do not consume a rate-limit token"""
+        assert self._cache is not None, "cache is not set"
+        key: str = self._request_url(args[1], kwargs.get("params"))
+        entry: CacheEntry | None = await self._cache.get(key)
+        if entry is not None:
+            if entry.is_fresh():
+                self._cache_hits += 1
+                return entry.response(self)
+            if entry.can_revalidate():
+                headers: CIMultiDict[str] = CIMultiDict(kwargs.get("headers") or {})
+                headers.update(entry.conditional_headers())
+                kwargs["headers"] = headers
+
+        resp: ClientResponse = await self._throttled_request(*args, **kwargs)
+        if resp.status == 304 and entry is not None:
+            resp.release()
+            self._cache_revalidated += 1
+            entry = await self._cache.refresh(entry, resp.headers)
+            return entry.response(self)
+
+        self._cache_misses += 1
+        if self._cache.is_cacheable(resp.status, resp.headers):
+            body: bytes = await resp.read()
+            await self._cache.put(
+                key,
+                status=resp.status,
+                reason=resp.reason or "",
+                headers=resp.headers,
+                body=body,
+            )
+        return resp
+
+    async def _coalesced_request(self, *args, **kwargs) -> ClientResponse:
+        """Identical concurrent GET requests share a single in-flight request.
+        The first caller gets the actual response, others get a copy of it"""
+        url: str = self._request_url(args[1], kwargs.get("params"))
+        headers: tuple[tuple[str, str], ...] = tuple(
+            sorted(
+                (k.lower(), v)
+                for k, v in CIMultiDict(kwargs.get("headers") or {}).items()
+            )
+        )
+        key: tuple = (args[0], url, headers)
+        if (inflight := self._coalescing.get(key)) is not None:
+            try:
+                shared: CacheEntry = await shield(inflight)
+                self._coalesced += 1
+                return shared.response(self, method=args[0])
+            except CancelledError:
+                task: Task | None = current_task()
+                if not inflight.cancelled() or (
+                    task is not None and task.cancelling() > 0
+                ):
+                    raise
+                # the original request was cancelled, make the request instead
+
+        inflight = get_running_loop().create_future()
+        self._coalescing[key] = inflight
+        try:
+            resp: ClientResponse = await self._get_request(*args, **kwargs)
+            body: bytes = await resp.read()
+            inflight.set_result(
+                CacheEntry(
+                    url=str(resp.url),
+                    status=resp.status,
+                    reason=resp.reason or "",
+                    headers=body_headers(resp.headers),
+                    body=body,
+                )
+            )
+            return resp
+        except CancelledError:
+            inflight.cancel()
+            raise
+        except Exception as err:
+            inflight.set_exception(err)
+            raise
+        finally:
+            if self._coalescing.get(key) is inflight:
+                del self._coalescing[key]
+            if inflight.done() and not inflight.cancelled():
+                inflight.exception()  # mark retrieved when nobody was waiting
+
     def is_limited(self, method: str, url: str) -> bool:
         """Check whether the rate limit should be applied"""
         try:
@@ -266,15 +1161,17 @@ class ThrottledClientSession(ClientSession):
                 raise ValueError(f"'method' is not a valid HTTP method: {method}")
             for method_filter, url_filter in self._filters:
                 if method_filter is None or method == method_filter:
-                    if (
-                        isinstance(url_filter, re.Pattern)
-                        and url_filter.match(url) is not None
-                    ):
-                        return self._limit_filtered
-                    elif isinstance(url_filter, str) and url.startswith(url_filter):
+                    if self._match_url(url_filter, url):
                         return self._limit_filtered
 
             return not self._limit_filtered
         except Exception as err:
             error(f"{err}")
         return True
+
+    @classmethod
+    def _match_url(cls, url_filter: UrlFilter, url: str) -> bool:
+        """Check whether URL matches a filter: regexp match or string prefix"""
+        if isinstance(url_filter, re.Pattern):
+            return url_filter.match(url) is not None
+        return url.startswith(url_filter)
@@ -1,24 +1,64 @@
 import logging
 from datetime import datetime
-from typing import Optional, Any, Sequence, TypeVar, Iterator
+from typing import (
+    Optional,
+    Literal,
+    Protocol,
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    Iterable,
+    Awaitable,
+    Callable,
+    Generic,
+    Hashable,
+    ParamSpec,
+    Sequence,
+    TypeVar,
+    Iterator,
+)
 from abc import ABC, abstractmethod
 from re import compile
 from itertools import islice
 from alive_progress import alive_bar  # type: ignore
 from inspect import getmembers, currentframe
-from types import FrameType
+from types import FrameType, MethodType
 import json
+import pickle
+import sys
+import atexit
+from collections import OrderedDict
 from time import time
 from pathlib import Path
-from aiohttp import ClientSession, ClientError, ClientResponseError, FormData
+from aiohttp import (
+    ClientSession,
+    ClientError,
+    ClientPayloadError,
+    ClientResponse,
+    ClientResponseError,
+    FormData,
+)
+import aiofiles
+import aiofiles.os
 import asyncio
 import string
 from tempfile import gettempdir
 from random import choices
 from configparser import ConfigParser
-from functools import wraps
+from functools import partial, update_wrapper, wraps
+from concurrent.futures import Executor
 from deprecated import deprecated
 
+from .throttledclientsession import ThrottledClientSession
+from .sessionpool import SessionPool
+from .circuitbreaker import CircuitOpenError
+from .compression import (
+    ACCEPT_ENCODING,
+    COMPRESS_THRESHOLD,
+    ContentEncoding,
+    compress_body,
+)
+
 from typer import Typer
 from typer.testing import CliRunner as TyperRunner
 
@@ -36,9 +76,24 @@ debug = logger.debug
 # Constants
 MAX_RETRIES: int = 3
 SLEEP: float = 1
+JSON_EXECUTOR_THRESHOLD: int = 1024 * 1024  # bytes
 
 
 T = TypeVar("T")
+P = ParamSpec("P")
+
+JSONLoads = Callable[[bytes | bytearray], Any]
+
+# Default JSON decoder. orjson parses bytes directly, json.loads() decodes
+# the bytes to a str first (~2x the body size in memory)
+JSON_LOADS: JSONLoads = json.loads
+try:
+    import orjson
+
+    JSON_LOADS = orjson.loads
+except ImportError:
+    pass
+HTTPSession = ClientSession | SessionPool
 
 
 class Countable(ABC):
@@ -285,17 +340,48 @@ async def alive_bar_monitor(
     return None
 
 
+def _session_retries(session: HTTPSession, retries: int) -> int:
+    """Do not retry on top of session's retry policy"""
+    if isinstance(session, ThrottledClientSession) and session.retry_policy is not None:
+        return 1
+    if isinstance(session, SessionPool) and all(
+        member.retry_policy is not None for member in session.sessions
+    ):
+        return 1
+    return retries
+
+
 async def post_url(
-    session: ClientSession,
+    session: HTTPSession,
     url: str,
     headers: dict | None = None,
-    data: FormData | dict[str, Any] | None = None,
+    data: FormData | dict[str, Any] | bytes | str | None = None,
     retries: int = MAX_RETRIES,
+    compress: ContentEncoding | None = None,
+    compress_threshold: int = COMPRESS_THRESHOLD,
     **kwargs,
 ) -> str | None:
-    """Do HTTP POST and return content as text"""
+    """Do HTTP POST and return content as text.
+
+    If 'compress' is set, bytes/str body larger than 'compress_threshold' bytes
+    is compressed with brotli ('br') or gzip. ThrottledClientSession compresses
+    the body itself and reports the bytes saved in its stats."""
     assert session is not None, "Session must be initialized first"
     assert url is not None, "url cannot be None"
+    retries = _session_retries(session, retries)
+    headers = dict(headers or {})
+    headers.setdefault("Accept-Encoding", ACCEPT_ENCODING)
+    if compress is not None and isinstance(data, (bytes, str)):
+        if isinstance(session, (ThrottledClientSession, SessionPool)):
+            kwargs["compress_body"] = compress
+            kwargs["compress_threshold"] = compress_threshold
+        elif (
+            body := await compress_body(data, compress, threshold=compress_threshold)
+        ) is not None:
+            if isinstance(data, str):
+                headers.setdefault("Content-Type", "text/plain; charset=utf-8")
+            headers["Content-Encoding"] = compress
+            data = body
     for retry in range(1, retries + 1):
         debug(f"POST {url}: try {retry} / {retries}")
         try:
@@ -308,6 +394,9 @@ async def post_url(
                 debug(f"POST {url} HTTP response status {resp.status}/{resp.reason}")
                 if resp.ok:
                     return await resp.text()
+        except CircuitOpenError as err:
+            verbose(f"POST {url} FAILED: {err}")
+            return None
         except ClientError as err:
             debug(f"POST {url} Unexpected exception {err}")
         except asyncio.CancelledError as err:
@@ -318,12 +407,16 @@ async def post_url(
     return None
 
 
-async def get_url(
-    session: ClientSession, url: str, retries: int = MAX_RETRIES
-) -> str | None:
-    """Retrieve (GET) an URL and return content as text"""
+async def _get_url(
+    session: HTTPSession,
+    url: str,
+    read: Callable[[ClientResponse], Awaitable[T]],
+    retries: int = MAX_RETRIES,
+) -> T | None:
+    """Retrieve (GET) an URL and return content read with 'read'"""
     assert session is not None, "Session must be initialized first"
     assert url is not None, "url cannot be None"
+    retries = _session_retries(session, retries)
 
     # if not is_url(url):
     #     raise ValueError(f"URL is malformed: {url}")
@@ -334,7 +427,10 @@ async def get_url(
             async with session.get(url) as resp:
                 debug(f"GET {url} HTTP response status {resp.status}/{resp.reason}")
                 if resp.ok:
-                    return await resp.text()
+                    return await read(resp)
+        except CircuitOpenError as err:
+            verbose(f"Could not retrieve URL: {url} : {err}")
+            return None
         except ClientError as err:
             debug(f"Could not retrieve URL: {url} : {err}")
         except asyncio.CancelledError as err:
@@ -347,24 +443,290 @@ async def get_url(
     return None
 
 
+async def get_url(
+    session: HTTPSession, url: str, retries: int = MAX_RETRIES
+) -> str | None:
+    """Retrieve (GET) an URL and return content as text"""
+    return await _get_url(session, url, read=ClientResponse.text, retries=retries)
+
+
+async def get_url_bytes(
+    session: HTTPSession, url: str, retries: int = MAX_RETRIES
+) -> bytes | None:
+    """Retrieve (GET) an URL and return content as bytes"""
+    return await _get_url(session, url, read=ClientResponse.read, retries=retries)
+
+
+def _decode_JSON(
+    content: bytes, loads: JSONLoads, validate: Callable[[Any], Any] | None
+) -> Any:
+    """Decode and optionally validate JSON. Top-level to be usable with ProcessPoolExecutor"""
+    obj: Any = loads(content)
+    if validate is not None:
+        return validate(obj)
+    return obj
+
+
 async def get_url_JSON(
-    session: ClientSession, url: str, retries: int = MAX_RETRIES
+    session: HTTPSession,
+    url: str,
+    retries: int = MAX_RETRIES,
+    loads: JSONLoads = JSON_LOADS,
+    validate: Callable[[Any], Any] | None = None,
+    executor: Executor | None = None,
+    executor_threshold: int | None = JSON_EXECUTOR_THRESHOLD,
 ) -> Any | None:
-    """Get JSON from URL and return object."""
+    """Get JSON from URL and return object.
+
+    The body is read as bytes and decoded with orjson if it is installed
+    ('pip install pyutils[orjson]'). orjson parses the bytes directly, so
+    the peak memory stays about 1x the body size. Without orjson, the stdlib
+    json.loads() decodes the bytes to a str internally (about 2x the body
+    size). Use 'loads' to set another decoder and 'validate' to convert the
+    object, e.g. a pydantic model's model_validate().
+
+    If 'executor' is given, bodies larger than 'executor_threshold' bytes
+    are decoded (and validated) in it not to block the event loop. Use a
+    ProcessPoolExecutor: json.loads() and orjson.loads() hold the GIL, so
+    decoding in a thread pool blocks the event loop nearly as long as
+    decoding inline. 'loads' and 'validate' have to be picklable for a
+    ProcessPoolExecutor. Without 'executor' the body is decoded inline"""
 
     assert session is not None, "session cannot be None"
     assert url is not None, "url cannot be None"
 
     try:
-        if (content := await get_url(session, url, retries)) is not None:
-            return json.loads(content)
+        if (content := await get_url_bytes(session, url, retries)) is not None:
+            if (
+                executor is not None
+                and executor_threshold is not None
+                and len(content) > executor_threshold
+            ):
+                return await asyncio.get_running_loop().run_in_executor(
+                    executor, partial(_decode_JSON, content, loads, validate)
+                )
+            return _decode_JSON(content, loads, validate)
     except ClientResponseError as err:
         debug(f"Client response error: {url}: {err}")
+    except ValueError as err:
+        debug(f"Could not decode JSON: {url}: {err}")
     # except Exception as err:
     #     debug(f"Unexpected error: {err}")
     return None
 
 
+async def get_url_NDJSON(
+    session: HTTPSession,
+    url: str,
+    loads: JSONLoads = JSON_LOADS,
+    chunk_size: int = 64 * 1024,
+) -> AsyncGenerator[Any, None]:
+    """Stream newline-delimited JSON (NDJSON) from URL and yield objects.
+
+    The response is read in chunks, so only the current chunk and
+    the line being decoded are kept in memory. Not retried"""
+
+    assert session is not None, "session cannot be None"
+    assert url is not None, "url cannot be None"
+
+    try:
+        async with session.get(url) as resp:
+            debug(f"GET {url} HTTP response status {resp.status}/{resp.reason}")
+            if not resp.ok:
+                verbose(f"Could not retrieve URL: {url}")
+                return
+            buffer = bytearray()
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                buffer.extend(chunk)
+                start: int = 0
+                while (end := buffer.find(b"\n", start)) >= 0:
+                    if (line := buffer[start:end]).strip():
+                        yield loads(line)
+                    start = end + 1
+                del buffer[:start]
+            if buffer.strip():
+                yield loads(buffer)
+    except ClientError as err:
+        debug(f"Could not retrieve URL: {url} : {err}")
+
+
+async def fetch_many(
+    session: HTTPSession,
+    urls: Iterable[str] | AsyncIterable[str],
+    concurrency: int = 10,
+    ordered: bool = False,
+    fetch: Callable[[HTTPSession, str], Awaitable[Any]] = get_url_JSON,
+    prefetch: int | None = None,
+) -> AsyncGenerator[tuple[str, Any | Exception], None]:
+    """Fetch URLs concurrently and yield (url, result | error) tuples.
+
+    - A fixed pool of 'concurrency' workers calls 'fetch(session, url)'
+      (default get_url_JSON())
+    - URLs are read lazily from 'urls' (Iterable or AsyncIterable). At most
+      'prefetch' (default 2 * concurrency) results are read ahead/buffered
+    - Results are yielded in completion order or in the order of 'urls'
+      if 'ordered=True'
+    - Closing the generator with aclose() (e.g. using contextlib.aclosing())
+      cancels the workers"""
+    assert concurrency > 0, "concurrency has to be positive"
+    if prefetch is None:
+        prefetch = 2 * concurrency
+    assert prefetch >= 0, "prefetch cannot be negative"
+
+    todo: asyncio.Queue[tuple[int, str] | None] = asyncio.Queue(maxsize=prefetch + 1)
+    done: asyncio.Queue[tuple[int, str, Any | Exception] | None] = asyncio.Queue()
+    # limit URLs read but not yielded yet
+    window = asyncio.Semaphore(concurrency + prefetch)
+    feed_error: BaseException | None = None
+
+    async def feeder() -> None:
+        nonlocal feed_error
+        try:
+            idx: int = 0
+            if isinstance(urls, AsyncIterable):
+                async for url in urls:
+                    await window.acquire()
+                    await todo.put((idx, url))
+                    idx += 1
+            else:
+                for url in urls:
+                    await window.acquire()
+                    await todo.put((idx, url))
+                    idx += 1
+        except Exception as err:
+            feed_error = err
+        for _ in range(concurrency):
+            await todo.put(None)
+
+    async def worker() -> None:
+        while (item := await todo.get()) is not None:
+            idx, url = item
+            res: Any | Exception
+            try:
+                res = await fetch(session, url)
+            except Exception as err:
+                res = err
+            await done.put((idx, url, res))
+        await done.put(None)
+
+    tasks: list[asyncio.Task] = [asyncio.create_task(feeder())]
+    tasks.extend(asyncio.create_task(worker()) for _ in range(concurrency))
+    try:
+        workers: int = concurrency
+        next_idx: int = 0
+        pending: dict[int, tuple[str, Any | Exception]] = dict()
+        while workers > 0:
+            if (result := await done.get()) is None:
+                workers -= 1
+                continue
+            idx, url, res = result
+            if not ordered:
+                window.release()
+                yield url, res
+                continue
+            pending[idx] = (url, res)
+            while next_idx in pending:
+                window.release()
+                yield pending.pop(next_idx)
+                next_idx += 1
+        if feed_error is not None:
+            raise feed_error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class HashObject(Protocol):
+    """hashlib hash object interface"""
+
+    def update(self, data: bytes, /) -> None: ...
+
+    def hexdigest(self) -> str: ...
+
+
+async def download_url(
+    session: HTTPSession,
+    url: str,
+    path: Path | str,
+    digest: HashObject | None = None,
+    resume: bool = True,
+    chunk_size: int = 64 * 1024,
+    retries: int = MAX_RETRIES,
+) -> Path | None:
+    """Download (GET) an URL to a file streaming it in chunks.
+
+    - The file is written to 'path'.part and renamed to 'path' once complete
+    - An existing .part file is resumed with a 'Range' request if 'resume=True'
+      and the server supports it. Failed downloads are resumed on retry
+    - The file is requested without content encoding ('Accept-Encoding: identity')
+      so ranges and Content-Length refer to the bytes written to the file
+    - 'digest' (e.g. hashlib.sha256()) is updated with the content of the
+      complete file before it is renamed
+
+    Returns 'path' or None if the download failed"""
+    assert session is not None, "Session must be initialized first"
+    assert url is not None, "url cannot be None"
+    assert chunk_size > 0, "chunk_size has to be positive"
+    if isinstance(path, str):
+        path = Path(path)
+    part: Path = path.with_name(path.name + ".part")
+    retries = _session_retries(session, retries)
+
+    for retry in range(1, retries + 1):
+        debug(f"GET {url} try {retry} / {retries}")
+        offset: int = 0
+        headers: dict[str, str] = {"Accept-Encoding": "identity"}
+        if resume and part.is_file():
+            offset = part.stat().st_size
+            headers["Range"] = f"bytes={offset}-"
+        try:
+            async with session.get(url, headers=headers) as resp:
+                debug(f"GET {url} HTTP response status {resp.status}/{resp.reason}")
+                if resp.status == 416:  # Range Not Satisfiable
+                    await aiofiles.os.remove(part)
+                    continue
+                if resp.ok:
+                    mode: Literal["wb", "ab"] = "wb"
+                    if resp.status == 206 and offset > 0:
+                        mode = "ab"
+                    else:
+                        offset = 0
+                    async with aiofiles.open(part, mode=mode) as file:
+                        async for chunk in resp.content.iter_chunked(chunk_size):
+                            await file.write(chunk)
+                    # Content-Length is the size of the encoded body if the
+                    # server ignored 'Accept-Encoding: identity'
+                    if (
+                        resp.content_length is not None
+                        and "Content-Encoding" not in resp.headers
+                        and part.stat().st_size != offset + resp.content_length
+                    ):
+                        raise ClientPayloadError(f"incomplete download: {url}")
+                    if digest is not None:
+                        await _hash_file(part, digest, chunk_size)
+                    await aiofiles.os.replace(part, path)
+                    return path
+        except CircuitOpenError as err:
+            verbose(f"Could not retrieve URL: {url} : {err}")
+            return None
+        except ClientError as err:
+            debug(f"Could not retrieve URL: {url} : {err}")
+        except asyncio.CancelledError as err:
+            debug(f"Cancelled while still working: {err}")
+            raise
+        await asyncio.sleep(SLEEP)
+    verbose(f"Could not retrieve URL: {url}")
+    return None
+
+
+async def _hash_file(path: Path, digest: HashObject, chunk_size: int) -> None:
+    """Update digest with the content of a file"""
+    async with aiofiles.open(path, mode="rb") as file:
+        while chunk := await file.read(chunk_size):
+            digest.update(chunk)
+
+
 def set_config(
     config: ConfigParser,
     fallback: T,
@@ -403,3 +765,248 @@ def add_suffix(path: Path, suffix: str) -> Path:
         return path
     else:
         return path.parent / (path.name + suffix)
+
+
+def sizeof(obj: Any) -> int:
+    """Estimate memory size of an object and the containers in it (bytes)"""
+    size: int = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item) for item in obj)
+    return size
+
+
+class AsyncCache(Generic[P, T]):
+    """
+    Cache results of a coroutine function. See async_cache()
+    """
+
+    def __init__(
+        self,
+        func: Callable[P, Awaitable[T]],
+        maxsize: int = 128,
+        ttl: float = 0,
+        maxbytes: int = 0,
+        path: Path | str | None = None,
+        key: Callable[..., Hashable] | None = None,
+        cache_none: bool = False,
+    ) -> None:
+        assert maxsize >= 0, "maxsize cannot be negative"
+        assert ttl >= 0, "ttl cannot be negative"
+        assert maxbytes >= 0, "maxbytes cannot be negative"
+        update_wrapper(self, func)
+        self._func: Callable[P, Awaitable[T]] = func
+        self._maxsize: int = maxsize
+        self._ttl: float = ttl
+        self._maxbytes: int = maxbytes
+        self._path: Path | None = None if path is None else Path(path)
+        self._key: Callable[..., Hashable] | None = key
+        self._cache_none: bool = cache_none
+        # key: (expires, size, value)
+        self._cache: OrderedDict[Hashable, tuple[float, int, T]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future[T]] = dict()
+        self._bytes: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        self._deduped: int = 0
+        self._evictions: int = 0
+        if self._path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    def __get__(self, instance: Any, owner: type | None = None) -> Any:
+        """Bind to the instance when used on a method. The instances share
+        the cache and 'self' is part of the key"""
+        if instance is None:
+            return self
+        return MethodType(self, instance)
+
+    def _make_key(self, *args: Any, **kwargs: Any) -> Hashable:
+        if self._key is not None:
+            return self._key(*args, **kwargs)
+        if kwargs:
+            return (args, tuple(sorted(kwargs.items())))
+        return args
+
+    async def __call__(self, *args: P.args, **kwargs: P.kwargs) -> T:
+        key: Hashable = self._make_key(*args, **kwargs)
+        if (entry := self._cache.get(key)) is not None:
+            if entry[0] > time():
+                self._cache.move_to_end(key)
+                self._hits += 1
+                return entry[2]
+            self._remove(key)
+        if (inflight := self._inflight.get(key)) is not None:
+            self._deduped += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                task: asyncio.Task | None = asyncio.current_task()
+                if not inflight.cancelled() or (
+                    task is not None and task.cancelling() > 0
+                ):
+                    raise
+                # the first caller was cancelled, make the call instead
+                return await self(*args, **kwargs)
+        self._misses += 1
+        fut: asyncio.Future[T] = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            res: T = await self._func(*args, **kwargs)
+            fut.set_result(res)
+            if res is not None or self._cache_none:
+                self._add(key, res)
+            return res
+        except BaseException as err:
+            if isinstance(err, Exception):
+                fut.set_exception(err)
+                fut.exception()  # mark retrieved when nobody was waiting
+            else:
+                fut.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _add(self, key: Hashable, value: T, expires: float | None = None) -> None:
+        if expires is None:
+            expires = time() + self._ttl if self._ttl > 0 else float("inf")
+        size: int = sizeof(value) if self._maxbytes > 0 else 0
+        if self._maxbytes > 0 and size > self._maxbytes:
+            return None
+        if key in self._cache:
+            self._remove(key)
+        self._cache[key] = (expires, size, value)
+        self._bytes += size
+        while (self._maxsize > 0 and len(self._cache) > self._maxsize) or (
+            self._maxbytes > 0 and self._bytes > self._maxbytes
+        ):
+            self._remove(next(iter(self._cache)))
+            self._evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._cache.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        """Empty the cache"""
+        self._cache.clear()
+        self._bytes = 0
+
+    def load(self) -> int:
+        """Load unexpired entries from the cache file. Returns the number of
+        entries loaded"""
+        if self._path is None or not self._path.is_file():
+            return 0
+        now: float = time()
+        count: int = 0
+        try:
+            with open(self._path, "rb") as file:
+                while True:
+                    try:
+                        key, expires, value = pickle.load(file)
+                    except EOFError:
+                        break
+                    if expires > now:
+                        self._add(key, value, expires)
+                        count += 1
+        except Exception as err:
+            error(f"could not load cache file {self._path}: {err}")
+        debug(f"loaded {count} entries from {self._path}")
+        return count
+
+    def save(self) -> int:
+        """Save unexpired entries to the cache file. Entries that cannot be
+        pickled are skipped. Returns the number of entries saved"""
+        if self._path is None:
+            return 0
+        now: float = time()
+        count: int = 0
+        try:
+            with open(self._path, "wb") as file:
+                for key, (expires, _, value) in self._cache.items():
+                    if expires <= now:
+                        continue
+                    try:
+                        entry: bytes = pickle.dumps((key, expires, value))
+                    except Exception as err:
+                        debug(f"could not pickle cache entry {key}: {err}")
+                        continue
+                    file.write(entry)
+                    count += 1
+        except Exception as err:
+            error(f"could not save cache file {self._path}: {err}")
+        return count
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def stats_dict(self) -> dict[str, float | int]:
+        calls: int = self._hits + self._misses + self._deduped
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "deduped": self._deduped,
+            "evictions": self._evictions,
+            "hit_ratio": (self._hits + self._deduped) / calls if calls > 0 else 0,
+            "size": len(self._cache),
+            "bytes": self._bytes,
+        }
+
+    @property
+    def stats(self) -> str:
+        stats: dict[str, float | int] = self.stats_dict
+        return (
+            f"hits: {stats['hits']:.0f}, misses: {stats['misses']:.0f}, deduped: {stats['deduped']:.0f}, "
+            + f"hit ratio: {stats['hit_ratio']:.2f}, size: {stats['size']:.0f}, evictions: {stats['evictions']:.0f}"
+        )
+
+
+def async_cache(
+    maxsize: int = 128,
+    ttl: float = 0,
+    maxbytes: int = 0,
+    path: Path | str | None = None,
+    key: Callable[..., Hashable] | None = None,
+    cache_none: bool = False,
+) -> Callable[[Callable[P, Awaitable[T]]], AsyncCache[P, T]]:
+    """Decorator to cache results of a coroutine function.
+
+    Least recently used entries are evicted when the cache has more than
+    'maxsize' entries or more than 'maxbytes' estimated bytes (0 = no limit).
+    Entries expire after 'ttl' seconds (0 = never). Concurrent calls with
+    the same arguments share a single call. If the caller making the call
+    is cancelled, one of the waiting callers makes it again. Exceptions and
+    None results (unless 'cache_none') are not cached.
+
+    The cache key is made of the arguments, or by 'key(*args, **kwargs)'.
+    On methods 'self' is the first argument and the instances share the cache.
+    With 'path' the cache is loaded from the file and saved at exit.
+
+    Usage:
+        @async_cache(maxsize=1000, ttl=3600, key=lambda session, url: url)
+        async def get_player(session: ClientSession, url: str) -> Any:
+            return await get_url_JSON(session, url)
+    """
+
+    def decorator(func: Callable[P, Awaitable[T]]) -> AsyncCache[P, T]:
+        return AsyncCache(
+            func,
+            maxsize=maxsize,
+            ttl=ttl,
+            maxbytes=maxbytes,
+            path=path,
+            key=key,
+            cache_none=cache_none,
+        )
+
+    return decorator
@@ -0,0 +1,98 @@
+import pytest  # type: ignore
+from asyncio import CancelledError, create_task, gather, sleep
+from typing import Mapping
+
+from pyutils import BatchLoader
+
+########################################################
+#
+# Test Plan: BatchLoader()
+#
+########################################################
+
+# 1) loads are batched by max_batch and linger
+# 2) duplicate keys share a fetch, missing keys load as None
+# 3) errors fail all loads of the batch
+# 4) close() cancels pending loads
+
+
+class _Backend:
+    def __init__(self, delay: float = 0) -> None:
+        self.calls: list[list[int]] = list()
+        self.delay: float = delay
+
+    async def fetch(self, keys: list[int]) -> Mapping[int, str]:
+        self.calls.append(keys)
+        await sleep(self.delay)
+        if -1 in keys:
+            raise ValueError("invalid key")
+        return {key: f"value-{key}" for key in keys if key % 10 != 9}
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("N,max_batch", [(250, 100), (50, 100), (7, 1)])
+async def test_1_batching(N: int, max_batch: int) -> None:
+    """Test BatchLoader batching"""
+    backend = _Backend()
+    loader: BatchLoader[int, str] = BatchLoader(
+        backend.fetch, max_batch=max_batch, linger=0.05
+    )
+    keys: list[int] = list(range(N))
+    res: list[str | None] = await loader.load_many(keys)
+    for key, value in zip(keys, res):
+        if key % 10 == 9:
+            assert value is None, "missing key should load as None"
+        else:
+            assert value == f"value-{key}", "incorrect value"
+    batches: int = -(-N // max_batch)
+    assert len(backend.calls) == batches, "incorrect number of batches"
+    assert all(len(batch) <= max_batch for batch in backend.calls), "batch too big"
+    assert loader.stats_dict["batches"] == batches, "incorrect stats"
+    assert loader.keys == N, "incorrect number of keys"
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+async def test_2_dedupe() -> None:
+    """Test BatchLoader with duplicate keys"""
+    backend = _Backend(delay=0.1)
+    loader: BatchLoader[int, str] = BatchLoader(backend.fetch, linger=0.01)
+    first = create_task(loader.load_many([1, 2, 2, 3]))
+    await sleep(0.05)  # first batch is in-flight
+    res: list[str | None] = await loader.load_many([1, 4])
+    assert await first == ["value-1", "value-2", "value-2", "value-3"]
+    assert res == ["value-1", "value-4"], "incorrect values"
+    assert backend.calls == [[1, 2, 3], [4]], "duplicate keys were fetched"
+    assert loader.loads == 6, "incorrect number of loads"
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+async def test_3_error() -> None:
+    """Test BatchLoader error handling"""
+    backend = _Backend()
+    loader: BatchLoader[int, str] = BatchLoader(backend.fetch, linger=0.01)
+    res = await gather(loader.load(1), loader.load(-1), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in res), "error was not raised"
+    assert await loader.load(1) == "value-1", "failed key should be fetched again"
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+async def test_4_close() -> None:
+    """Test BatchLoader.close()"""
+    backend = _Backend()
+    loader: BatchLoader[int, str] = BatchLoader(backend.fetch, linger=10)
+    task = create_task(loader.load(1))
+    await sleep(0.01)
+    await loader.close()
+    with pytest.raises(CancelledError):
+        await task
+    assert len(backend.calls) == 0, "closed loader should not fetch"
+
+    loader = BatchLoader(backend.fetch, linger=10)
+    task = create_task(loader.load(2))
+    await sleep(0.01)
+    await loader.flush()
+    assert await task == "value-2", "flush() did not fetch pending keys"
@@ -0,0 +1,80 @@
+import pytest  # type: ignore
+from asyncio import gather
+import time
+
+from aiohttp import StreamReader
+from aiohttp.base_protocol import BaseProtocol
+
+from pyutils import ByteLimiter
+from pyutils.bytelimiter import ThrottledStreamReader, throttled_upload
+
+########################################################
+#
+# Test Plan: ByteLimiter()
+#
+########################################################
+
+# 1) acquire() limits bytes/sec, burst passes without waiting
+# 2) ThrottledStreamReader limits reading a stream
+# 3) throttled_upload() limits and counts request body chunks
+
+RATE: float = 100_000  # bytes/sec
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+async def test_1_acquire() -> None:
+    """Test ByteLimiter.acquire()"""
+    limiter = ByteLimiter(RATE)
+    start: float = time.monotonic()
+    await limiter.acquire(int(RATE))
+    assert time.monotonic() - start < 0.1, "burst should not wait"
+
+    start = time.monotonic()
+    await gather(*[limiter.acquire(10_000) for _ in range(10)])
+    duration: float = time.monotonic() - start
+    assert duration == pytest.approx(1, abs=0.15), "incorrect rate"
+    assert limiter.bytes == 2 * RATE, "incorrect byte count"
+
+    with pytest.raises(AssertionError):
+        ByteLimiter(0)
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+async def test_2_stream_reader() -> None:
+    """Test ThrottledStreamReader"""
+    data: bytes = bytes(range(256)) * 1000
+    stream = StreamReader(BaseProtocol(None), 2**20)  # type: ignore[arg-type]
+    stream.feed_data(data)
+    stream.feed_eof()
+    counted: list[int] = list()
+    reader = ThrottledStreamReader(
+        stream, [ByteLimiter(RATE, burst=1)], on_read=counted.append
+    )
+    start: float = time.monotonic()
+    chunks: list[bytes] = [chunk async for chunk in reader.iter_chunked(10_000)]
+    duration: float = time.monotonic() - start
+    assert b"".join(chunks) == data, "incorrect data"
+    assert sum(counted) == len(data), "incorrect byte count"
+    assert duration >= (len(data) - 10_000) / RATE * 0.9, "rate limit exceeded"
+    assert reader.at_eof(), "attributes should be delegated to the stream"
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+async def test_3_upload() -> None:
+    """Test throttled_upload()"""
+    data: bytes = b"x" * 150_000
+    counted: list[int] = list()
+    start: float = time.monotonic()
+    chunks: list[bytes] = [
+        chunk
+        async for chunk in throttled_upload(
+            data, [ByteLimiter(RATE)], on_write=counted.append, chunk_size=25_000
+        )
+    ]
+    duration: float = time.monotonic() - start
+    assert b"".join(chunks) == data, "incorrect data"
+    assert counted == [25_000] * 6, "incorrect chunks"
+    assert duration >= 0.45, "rate limit exceeded"
@@ -0,0 +1,73 @@
+import pytest  # type: ignore
+from time import sleep
+
+from aiohttp import ClientConnectionError
+
+from pyutils import CircuitBreaker
+
+########################################################
+#
+# Test Plan: CircuitBreaker()
+#
+########################################################
+
+# 1) consecutive failures open the circuit, probe closes it
+# 2) error rate opens the circuit
+# 3) failed probe re-opens the circuit, cancelled probe frees the probe slot
+
+HOST: str = "example.com"
+
+
+def test_1_consecutive_failures() -> None:
+    """Test CircuitBreaker with consecutive failures"""
+    cb = CircuitBreaker(failures=3, open_time=0.1)
+    for _ in range(2):
+        assert cb.allow(HOST), "closed circuit should allow requests"
+        cb.failure(HOST)
+    cb.success(HOST)
+    for _ in range(2):
+        cb.failure(HOST)
+    assert cb.state(HOST) == "closed", "success should reset consecutive failures"
+    cb.failure(HOST)
+    assert cb.state(HOST) == "open", "circuit should be open"
+    assert not cb.allow(HOST), "open circuit should reject requests"
+    assert cb.rejected == 1, "incorrect rejected count"
+    assert cb.allow("other.com"), "circuits should be per host"
+
+    sleep(0.1)
+    assert cb.state(HOST) == "half-open", "circuit should be half-open"
+    assert cb.allow(HOST), "half-open circuit should allow a probe"
+    assert not cb.allow(HOST), "half-open circuit should allow only 1 probe"
+    cb.success(HOST)
+    assert cb.state(HOST) == "closed", "successful probe should close the circuit"
+    assert cb.states() == {HOST: "closed", "other.com": "closed"}
+
+
+def test_2_error_rate() -> None:
+    """Test CircuitBreaker error rate"""
+    cb = CircuitBreaker(failures=100, error_rate=0.5, min_requests=10)
+    for _ in range(5):
+        cb.success(HOST)
+    for _ in range(4):
+        cb.failure(HOST)
+    assert cb.state(HOST) == "closed", "too few requests to open the circuit"
+    cb.failure(HOST)
+    assert cb.state(HOST) == "open", "error rate should open the circuit"
+    assert cb.is_failure(503), "503 should be a failure"
+    assert not cb.is_failure(404), "404 should not be a failure"
+
+
+@pytest.mark.parametrize("probes", [1, 2])
+def test_3_probes(probes: int) -> None:
+    """Test half-open probes"""
+    cb = CircuitBreaker(failures=1, open_time=0.05, probes=probes)
+    cb.failure(HOST)
+    sleep(0.05)
+    for _ in range(probes):
+        assert cb.allow(HOST), "half-open circuit should allow probes"
+    assert not cb.allow(HOST), "too many probes allowed"
+    cb.cancel(HOST)
+    assert cb.allow(HOST), "cancelled probe should free the probe slot"
+    cb.failure(HOST)
+    assert cb.state(HOST) == "open", "failed probe should open the circuit"
+    assert isinstance(ClientConnectionError(), cb.exceptions)
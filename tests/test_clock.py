@@ -0,0 +1,113 @@
+import pytest  # type: ignore
+from asyncio import gather, get_running_loop, sleep, wait_for
+import time
+
+from pyutils import CircuitBreaker, RateCounter, RateLimiter, ThrottledClientSession
+from pyutils.clock import LoopClock, SYSTEM_CLOCK, run_virtual
+
+########################################################
+#
+# Test Plan: Clock(), VirtualTimeEventLoop()
+#
+########################################################
+
+# 1) virtual time: sleeps and timeouts take no wall-clock time
+# 2) simulate an hour of rate limiting
+# 3) rate counter and circuit breaker follow the injected clock
+# 4) session stats when no virtual time has passed
+
+
+@pytest.mark.timeout(10)
+def test_1_virtual_time() -> None:
+    """Test run_virtual() and LoopClock"""
+    clock = LoopClock()
+
+    async def main() -> tuple[float, float, float]:
+        start: float = clock.monotonic()
+        epoch: float = clock.time()
+        await sleep(3600)
+        await wait_for(sleep(10), timeout=20)
+        await gather(*[sleep(i) for i in range(100)])
+        return (
+            clock.monotonic() - start,
+            clock.time() - epoch,
+            get_running_loop().time(),
+        )
+
+    wall: float = time.monotonic()
+    elapsed, elapsed_epoch, loop_time = run_virtual(main())
+    assert time.monotonic() - wall < 1, "virtual time took wall-clock time"
+    assert elapsed == pytest.approx(3709), "incorrect virtual time"
+    assert elapsed_epoch == pytest.approx(3709), "incorrect virtual wall-clock time"
+    assert loop_time == pytest.approx(3709), "virtual time should start from 0"
+    assert abs(SYSTEM_CLOCK.time() - time.time()) < 1, "incorrect system clock"
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.parametrize("rate_limit", [10, 100])
+def test_2_simulate_rate_limiter(rate_limit: float) -> None:
+    """Simulate an hour of rate limiting in virtual time"""
+    duration: float = 3600
+    workers: int = 20
+    clock = LoopClock()
+
+    async def main() -> tuple[int, float]:
+        limiter = RateLimiter(rate_limit=rate_limit, clock=clock)
+        count: int = 0
+
+        async def worker(priority: int) -> None:
+            nonlocal count
+            while True:
+                await limiter.acquire(priority=priority)
+                if clock.monotonic() > duration:
+                    return None
+                count += 1
+
+        await gather(*[worker(i % 2) for i in range(workers)])
+        stats = limiter.stats_dict
+        await limiter.close()
+        return count, stats["lane.0.wait.p50"]
+
+    count, wait = run_virtual(main())
+    assert count == pytest.approx(rate_limit * duration, rel=0.001), "incorrect rate"
+    assert wait > 0, "low priority requests should wait"
+
+
+@pytest.mark.timeout(10)
+def test_3_instrumentation() -> None:
+    """Test RateCounter and CircuitBreaker with a virtual clock"""
+    clock = LoopClock()
+    host: str = "example.com"
+
+    async def main() -> None:
+        rc = RateCounter(window=60, clock=clock)
+        for _ in range(600):
+            rc.add()
+            await sleep(0.1)
+        assert rc.rate(60) == pytest.approx(10, rel=0.05), "incorrect rate"
+        await sleep(30)
+        assert rc.rate(10) == 0, "old events should drop out of the window"
+
+        cb = CircuitBreaker(failures=1, open_time=30, clock=clock)
+        cb.failure(host)
+        assert cb.state(host) == "open", "circuit should be open"
+        await sleep(29)
+        assert cb.state(host) == "open", "circuit should stay open"
+        await sleep(1)
+        assert cb.state(host) == "half-open", "circuit should be half-open"
+
+    run_virtual(main())
+
+
+@pytest.mark.timeout(10)
+def test_4_session_stats() -> None:
+    """Test ThrottledClientSession stats without elapsed virtual time"""
+
+    async def main() -> float:
+        async with ThrottledClientSession(rate_limit=10, clock=LoopClock()) as session:
+            assert session.rate == 0, "incorrect rate"
+            session.reset_counters()
+            assert "rate" in session.stats, "incorrect stats"
+            return session.stats_dict["rate"]
+
+    assert run_virtual(main()) == 0, "incorrect rate"
@@ -0,0 +1,148 @@
+import pytest  # type: ignore
+from asyncio import create_task, sleep
+from typing import AsyncIterator
+
+from pyutils import ConcurrencyController, IterableQueue
+from pyutils.clock import LoopClock, run_virtual
+
+########################################################
+#
+# Test Plan: ConcurrencyController()
+#
+########################################################
+
+# 1) concurrency converges to the capacity of a simulated service
+# 2) errors are returned as results, error rate shrinks concurrency
+# 3) consume an IterableQueue and an async iterable
+
+
+class _Service:
+    """Simulated service: latency grows once there are more than
+    'capacity' concurrent calls"""
+
+    def __init__(self, capacity: int = 20, latency: float = 0.1) -> None:
+        self.capacity: int = capacity
+        self.latency: float = latency
+        self.active: int = 0
+        self.max_active: int = 0
+
+    async def call(self, item: int) -> int:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await sleep(self.latency * max(1, self.active / self.capacity))
+            return item * 2
+        finally:
+            self.active -= 1
+
+
+@pytest.mark.timeout(20)
+def test_1_converge() -> None:
+    """Test ConcurrencyController() adjusts concurrency to the capacity"""
+    N: int = 20000
+    service = _Service(capacity=20, latency=0.1)
+    controller: ConcurrencyController[int, int] = ConcurrencyController(
+        concurrency=2, max_concurrency=200, clock=LoopClock()
+    )
+
+    async def main() -> dict[int, int | Exception]:
+        res: dict[int, int | Exception] = dict()
+        async for item, r in controller.run(range(N), service.call):
+            res[item] = r
+        return res
+
+    res = run_virtual(main())
+    assert len(res) == N, "incorrect number of results"
+    assert all(res[i] == 2 * i for i in range(N)), "incorrect results"
+    assert controller.count == N, "incorrect count"
+    assert controller.active == 0, "workers left running"
+
+    history = controller.history
+    assert len(history) > 10, "concurrency was not adjusted"
+    assert max(s.concurrency for s in history) >= 20, "concurrency did not grow"
+    assert service.max_active < 80, "concurrency was not limited by latency"
+    steady = history[len(history) // 2 : -2]
+    assert all(10 <= s.concurrency <= 45 for s in steady), (
+        f"concurrency did not converge: {[s.concurrency for s in steady]}"
+    )
+    assert sum(s.throughput for s in steady) / len(steady) > 150, "low throughput"
+
+    stats = controller.stats_dict
+    assert stats["count"] == N
+    assert stats["errors"] == 0
+    assert stats["adjustments"] == len(history)
+    assert "throughput" in controller.stats
+
+
+@pytest.mark.timeout(20)
+def test_2_errors() -> None:
+    """Test ConcurrencyController() error results"""
+    N: int = 1000
+    controller: ConcurrencyController[int, int] = ConcurrencyController(
+        concurrency=16, clock=LoopClock()
+    )
+
+    async def fail(item: int) -> int:
+        await sleep(0.1)
+        if item % 2 == 0:
+            raise ValueError(f"item {item}")
+        return item
+
+    async def main() -> list[tuple[int, int | Exception]]:
+        return [r async for r in controller.run(range(N), fail)]
+
+    res = run_virtual(main())
+    assert len(res) == N, "incorrect number of results"
+    errors = [r for _, r in res if isinstance(r, Exception)]
+    assert len(errors) == N // 2, "errors not returned as results"
+    assert all(isinstance(err, ValueError) for err in errors)
+    assert controller.stats_dict["errors"] == N // 2, "incorrect error count"
+    assert controller.concurrency == 1, "error rate did not shrink concurrency"
+
+
+@pytest.mark.timeout(20)
+def test_3_sources() -> None:
+    """Test ConcurrencyController() with IterableQueue and async iterable"""
+    N: int = 500
+    service = _Service(capacity=10, latency=0.05)
+
+    async def produce(Q: IterableQueue[int]) -> None:
+        await Q.add_producer()
+        for i in range(N):
+            await Q.put(i)
+        await Q.finish()
+
+    async def items() -> AsyncIterator[int]:
+        for i in range(N):
+            yield i
+
+    async def main() -> tuple[list[int], list[int]]:
+        Q: IterableQueue[int] = IterableQueue(maxsize=10)
+        controller: ConcurrencyController[int, int] = ConcurrencyController(
+            clock=LoopClock()
+        )
+        res_q: list[int] = list()
+        task = create_task(produce(Q))
+        async for item, _ in controller.run(Q, service.call):
+            res_q.append(item)
+        await task
+        assert Q.is_done, "queue not done"
+        assert Q.count == N, "incorrect queue count"
+
+        controller = ConcurrencyController(clock=LoopClock())
+        res_a: list[int] = [
+            item async for item, _ in controller.run(items(), service.call)
+        ]
+
+        # closing the generator early stops the workers
+        controller = ConcurrencyController(concurrency=8, clock=LoopClock())
+        gen = controller.run(range(N), service.call)
+        async for _ in gen:
+            break
+        await gen.aclose()
+        assert controller.active == 0, "workers left running"
+        return res_q, res_a
+
+    res_q, res_a = run_virtual(main())
+    assert sorted(res_q) == list(range(N)), "IterableQueue: missing items"
+    assert sorted(res_a) == list(range(N)), "async iterable: missing items"
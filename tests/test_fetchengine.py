@@ -0,0 +1,156 @@
+import sys
+import pytest  # type: ignore
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Generator
+import json
+import time
+
+from pyutils import FetchEngine
+from pyutils.utils import get_url_JSON
+
+########################################################
+#
+# Test Plan: FetchEngine()
+#
+########################################################
+
+# 1) fetch URLs with worker processes, global rate limit
+# 2) errors are returned as results
+# 3) the global rate limit applies to every request, not every URL
+# 4) a fetch() closed early does not leak URLs or results to the next one
+
+HOST: str = "localhost"
+PORT: int = 8891
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requests: list[float] = list()  # time.monotonic() of requests
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        _Handler.requests.append(time.monotonic())
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps({"path": self.path}).encode())
+
+    def log_request(self, code=None, size=None):
+        """Don't log anything"""
+        pass
+
+
+@pytest.fixture(scope="module")
+def server_url() -> Generator[str, None, None]:
+    server = ThreadingHTTPServer((HOST, PORT), _Handler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://{HOST}:{PORT}"
+    server.shutdown()
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("rate_limit,workers", [(20, 2), (0, 3)])
+async def test_1_fetch(server_url: str, rate_limit: float, workers: int) -> None:
+    """Test FetchEngine.fetch()"""
+    N: int = 40
+    urls: list[str] = [f"{server_url}/item/{i}" for i in range(N)]
+    async with FetchEngine(
+        rate_limit=rate_limit, workers=workers, batch_size=7, fetch=get_url_JSON
+    ) as engine:
+        start: float = time.monotonic()
+        res: dict[str, dict] = dict()
+        async for url, item in engine.fetch(urls):
+            res[url] = item
+        duration: float = time.monotonic() - start
+        assert engine.count == N, "incorrect number of results"
+        assert engine.stats_dict["errors"] == 0, "errors reported"
+    assert sorted(res) == sorted(urls), "missing results"
+    assert all(res[url]["path"] == url[len(server_url) :] for url in urls)
+    if rate_limit > 0:
+        assert duration >= (N - 1) / rate_limit * 0.95, "global rate limit exceeded"
+        assert duration <= N / rate_limit + 2, "global rate limit not used fully"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_2_errors(server_url: str) -> None:
+    """Test FetchEngine error results"""
+    urls: list[str] = [f"{server_url}/missing/{i}" for i in range(3)]
+    async with FetchEngine(workers=1, fetch=_get_once) as engine:
+        async for url, res in engine.fetch(urls):
+            assert res is None, f"missing URL returned a result: {url}"
+        assert engine.stats_dict["errors"] == 3, "incorrect error count"
+
+
+async def _get_once(session, url: str):
+    return await get_url_JSON(session, url, retries=1)
+
+
+async def _get_twice(session, url: str):
+    """Fetch URL with two HTTP requests"""
+    await get_url_JSON(session, url, retries=1)
+    return await get_url_JSON(session, url, retries=1)
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_3_rate_per_request(server_url: str) -> None:
+    """Test FetchEngine global rate limit counts every HTTP request"""
+    N: int = 10
+    rate_limit: float = 10
+    urls: list[str] = [f"{server_url}/item/{i}" for i in range(N)]
+    _Handler.requests.clear()
+    async with FetchEngine(
+        rate_limit=rate_limit, workers=2, fetch=_get_twice
+    ) as engine:
+        res = [r async for _, r in engine.fetch(urls)]
+    assert len(res) == N and all(r is not None for r in res), "fetch failed"
+    requests: list[float] = sorted(_Handler.requests)
+    assert len(requests) == 2 * N, "incorrect number of requests"
+    assert requests[-1] - requests[0] >= (2 * N - 1) / rate_limit * 0.9, (
+        "global rate limit exceeded"
+    )
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_4_close_early(server_url: str) -> None:
+    """Test FetchEngine.fetch() closed early does not affect the next call"""
+    N: int = 100
+    first: list[str] = [f"{server_url}/first/{i}" for i in range(N)]
+    second: list[str] = [f"{server_url}/second/{i}" for i in range(N)]
+    async with FetchEngine(
+        rate_limit=200, workers=2, batch_size=5, fetch=_get_once
+    ) as engine:
+        gen = engine.fetch(first)
+        async for url, _ in gen:
+            assert url in first
+            break
+        await gen.aclose()
+
+        res: dict[str, dict] = dict()
+        async for url, item in engine.fetch(second):
+            res[url] = item
+    assert sorted(res) == sorted(second), "results of an earlier fetch() returned"
+    assert all(res[url]["path"] == url[len(server_url) :] for url in second)
@@ -0,0 +1,59 @@
+import pytest  # type: ignore
+from random import random
+
+from pyutils import Histogram
+
+########################################################
+#
+# Test Plan: Histogram()
+#
+########################################################
+
+# 1) add() and quantile()
+# 2) under/overflow
+# 3) merge()
+
+N: int = 10000
+RELATIVE_ERROR: float = 10 ** (1 / 20) - 1
+
+
+def test_1_quantiles() -> None:
+    """Test Histogram.quantile() accuracy"""
+    hist = Histogram()
+    values: list[float] = sorted(0.001 + random() for _ in range(N))
+    for value in values:
+        hist.add(value)
+    assert hist.count == N, f"incorrect count: {hist.count} != {N}"
+    for q in [0.5, 0.95, 0.99]:
+        exact: float = values[int(q * N) - 1]
+        estimate: float = hist.quantile(q)
+        assert (
+            abs(estimate - exact) / exact <= RELATIVE_ERROR
+        ), f"quantile {q} is inaccurate: {estimate:.4f} != {exact:.4f}"
+    assert hist.quantile(1) == values[-1], "quantile(1) is not max value"
+    assert hist.mean == pytest.approx(sum(values) / N), "incorrect mean"
+
+
+def test_2_under_overflow() -> None:
+    """Test values outside the bucket range"""
+    hist = Histogram(min_value=0.01, max_value=1)
+    for value in [0, 0.001, 5, 10]:
+        hist.add(value)
+    assert hist.quantile(0.25) == 0.01, "underflow bucket is not bound by min_value"
+    assert hist.quantile(1) == 10, "overflow bucket is not bound by max value seen"
+    assert Histogram().quantile(0.5) == 0, "empty histogram returned non-zero"
+
+
+def test_3_merge() -> None:
+    """Test Histogram.merge()"""
+    h1, h2 = Histogram(), Histogram()
+    for i in range(1, 101):
+        h1.add(i / 100)
+        h2.add(i / 10)
+    h1.merge(h2)
+    assert h1.count == 200, "incorrect count after merge()"
+    assert h1.max == 10, "incorrect max after merge()"
+    with pytest.raises(ValueError):
+        h1.merge(Histogram(buckets_per_decade=10))
+    h1.reset()
+    assert h1.count == 0 and h1.quantile(0.5) == 0, "reset() failed"
@@ -0,0 +1,51 @@
+import pytest  # type: ignore
+
+from pyutils import RateCounter
+
+########################################################
+#
+# Test Plan: RateCounter()
+#
+########################################################
+
+# 1) rate() over a window
+# 2) old events drop out of the window
+# 3) gaps longer than the window
+
+
+def test_1_rate() -> None:
+    """Test RateCounter.rate()"""
+    rc = RateCounter(window=60)
+    start: float = rc._start
+    for i in range(600):
+        rc.add(now=start + i / 10)  # 10/sec for 60 secs
+    now: float = start + 60
+    assert rc.rate(10, now=now) == pytest.approx(10, rel=0.1), "incorrect 10s rate"
+    assert rc.rate(60, now=now) == pytest.approx(10, rel=0.1), "incorrect 60s rate"
+    assert rc.count(60, now=now) <= 600, "counted more events than added"
+
+
+def test_2_window() -> None:
+    """Test that a slowdown shows in the short window"""
+    rc = RateCounter(window=60)
+    start: float = rc._start
+    for i in range(500):
+        rc.add(now=start + i / 10)  # 10/sec for 50 secs
+    for i in range(10):
+        rc.add(now=start + 50 + i)  # 1/sec for 10 secs
+    now: float = start + 60
+    assert rc.rate(10, now=now) == pytest.approx(1, rel=0.2), "slowdown not seen"
+    assert rc.rate(60, now=now) > 5, "incorrect 60s rate"
+
+
+def test_3_gap() -> None:
+    """Test gaps longer than the window"""
+    rc = RateCounter(window=10)
+    start: float = rc._start
+    rc.add(n=100, now=start + 1)
+    assert rc.count(10, now=start + 5) == 100, "incorrect count"
+    assert rc.count(10, now=start + 100) == 0, "old events still counted"
+    rc.add(now=start + 100.5)
+    assert rc.count(1, now=start + 100.5) == 1, "incorrect count after gap"
+    with pytest.raises(AssertionError):
+        rc.rate(11)
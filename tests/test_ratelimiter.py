@@ -0,0 +1,92 @@
+import pytest  # type: ignore
+from asyncio import CancelledError, create_task, gather, sleep
+import time
+
+from pyutils import RateLimiter
+
+########################################################
+#
+# Test Plan: RateLimiter()
+#
+########################################################
+
+# 1) acquire() rate, context manager and decorator
+# 2) acquire(n) for batches
+# 3) priorities, cancelled waiters pass tokens on
+
+RATE: float = 50
+
+
+@pytest.mark.timeout(20)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("rate", [RATE, 200])
+async def test_1_rate(rate: float) -> None:
+    """Test RateLimiter rate"""
+    N: int = int(rate)
+    limiter = RateLimiter(rate_limit=rate)
+    calls: int = 0
+
+    @limiter
+    async def call() -> None:
+        nonlocal calls
+        calls += 1
+
+    start: float = time.monotonic()
+    await gather(*[call() for _ in range(N)])
+    for _ in range(N):
+        async with limiter:
+            pass
+    duration: float = time.monotonic() - start
+    await limiter.close()
+    assert calls == N, "decorated function was not called"
+    assert limiter.acquired == 2 * N, "incorrect acquired count"
+    assert duration == pytest.approx(2 * N / rate, rel=0.15), "incorrect rate"
+    assert "acquired: " in limiter.stats, "incorrect stats"
+
+
+@pytest.mark.timeout(20)
+@pytest.mark.asyncio
+async def test_2_batch() -> None:
+    """Test RateLimiter.acquire(n)"""
+    limiter = RateLimiter(rate_limit=RATE, burst=10)
+    await limiter.acquire()
+    await sleep(0.5)
+    assert limiter.tokens == 10, "tokens should be capped at burst"
+    start: float = time.monotonic()
+    await limiter.acquire(10)
+    assert time.monotonic() - start < 0.05, "burst should not wait"
+    start = time.monotonic()
+    await limiter.acquire(int(RATE))
+    duration: float = time.monotonic() - start
+    await limiter.close()
+    assert duration == pytest.approx(1, rel=0.1), "incorrect batch rate"
+
+    with pytest.raises(AssertionError):
+        await limiter.acquire(0)
+
+
+@pytest.mark.timeout(20)
+@pytest.mark.asyncio
+async def test_3_priority() -> None:
+    """Test RateLimiter priorities and cancellation"""
+    limiter = RateLimiter(rate_limit=10)
+    order: list[int] = list()
+
+    async def task(priority: int) -> None:
+        await limiter.acquire(priority=priority)
+        order.append(priority)
+
+    await limiter.acquire()  # start the filler
+    tasks = [create_task(task(p)) for p in [0, 0, 0, 1, 1, 1]]
+    await sleep(0)
+    cancelled = create_task(limiter.acquire(5, priority=2))
+    await sleep(0.15)
+    cancelled.cancel()
+    with pytest.raises(CancelledError):
+        await cancelled
+    await gather(*tasks)
+    stats = limiter.stats_dict
+    await limiter.close()
+    assert order == [1, 1, 1, 0, 0, 0], f"incorrect order: {order}"
+    assert limiter.acquired == 7, "cancelled acquire should not count"
+    assert stats["lane.1.count"] == 3, "incorrect lane stats"
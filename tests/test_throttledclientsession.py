@@ -3,23 +3,73 @@ import pytest  # type: ignore
 from datetime import datetime
 from itertools import pairwise, accumulate, product
 from functools import cached_property
-from typing import Generator, List, Dict, Optional, Tuple
+from typing import Any, Generator, List, Dict, Optional, Tuple
 from multiprocessing import Process
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
+from pathlib import Path
 from socketserver import ThreadingMixIn
-from asyncio import sleep
+from asyncio import sleep, gather, create_task
+import time
+import socket
+from threading import get_ident
 import logging
 import json
 import re
+from hashlib import sha256
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import gzip
+import os
 
-from pyutils import ThrottledClientSession, UrlFilter
-from pyutils.utils import epoch_now, get_url_JSON
+import brotli  # type: ignore
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+from aiohttp.test_utils import TestServer
+
+from pyutils import (
+    BatchLoader,
+    CircuitBreaker,
+    CircuitOpenError,
+    ThrottledClientSession,
+    UrlFilter,
+    HTTPArchive,
+    HTTPArchiveMiss,
+    HTTPCache,
+    RateLimiter,
+    RetryPolicy,
+    SessionPool,
+)
+from pyutils.clock import Clock, LoopClock, SYSTEM_CLOCK, run_virtual
+from pyutils.throttledclientsession import request_priority, HEDGE_MIN_SAMPLES
+from pyutils.utils import (
+    download_url,
+    epoch_now,
+    get_url,
+    get_url_bytes,
+    get_url_JSON,
+    get_url_NDJSON,
+    post_url,
+)
 
 
 HOST: str = "localhost"
 PORT: int = 8889
 JSON_PATH: str = "/json"
+CACHE_PATH: str = "/cache"
+ETAG_PATH: str = "/etag"
+ETAG: str = '"v1"'
+SLOW_PATH: str = "/slow"
+SLOW_WAIT: float = 0.5
+NDJSON_PATH: str = "/ndjson"
+FLAKY_PATH: str = "/flaky"
+DOWNLOAD_PATH: str = "/download"
+DOWNLOAD_DATA: bytes = bytes(range(256)) * 1000
+GZIP_PATH: str = "/gzip"
+FLAKY_FAILS: int = 2
+ECHO_PATH: str = "/echo"
+STRAGGLER_PATH: str = "/straggler"
+STRAGGLER_WAIT: float = 3
+IDS_PATH: str = "/ids"
+THROTTLE_PATH: str = "/throttle"
 RATE_FAST: float = 100
 RATE_SLOW: float = 0.6
 
@@ -234,6 +284,7 @@ class _HttpRequestHandler(BaseHTTPRequestHandler):
     """HTTPServer mock request handler"""
 
     _res_json: list[Dict[str, str | int | float | None]] = json_data()
+    _flaky: Dict[str, int] = dict()
 
     @cached_property
     def url(self):
@@ -241,6 +292,114 @@ class _HttpRequestHandler(BaseHTTPRequestHandler):
 
     def do_GET(self) -> None:  # pylint: disable=invalid-name
         """Handle GET requests"""
+        if self.url.path == CACHE_PATH:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/txt")
+            self.send_header("Cache-Control", "max-age=60")
+            self.end_headers()
+            self.wfile.write(datetime.utcnow().isoformat().encode())
+            return
+        elif self.url.path == THROTTLE_PATH:
+            # API key 'throttled' is over its quota
+            if parse_qs(self.url.query).get("key") == ["throttled"]:
+                self.send_response(429)
+                self.send_header("Retry-After", "60")
+                self.end_headers()
+                return
+        elif self.url.path == IDS_PATH:
+            # ID-list API: /ids?account_id=1,2,3
+            ids: list[str] = parse_qs(self.url.query)["account_id"][0].split(",")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(
+                json.dumps({"data": {id: {"id": int(id)} for id in ids}}).encode()
+            )
+            return
+        elif self.url.path == ETAG_PATH:
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.send_header("ETag", ETAG)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/txt")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            self.wfile.write(datetime.utcnow().isoformat().encode())
+            return
+        elif self.url.path == SLOW_PATH:
+            time.sleep(SLOW_WAIT)
+        elif self.url.path == NDJSON_PATH:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for item in self._res_json:
+                self.wfile.write(json.dumps(item).encode() + b"\n")
+            return
+        elif self.url.path == DOWNLOAD_PATH:
+            start: int = 0
+            if (range_hdr := self.headers.get("Range")) is not None:
+                start = int(range_hdr.removeprefix("bytes=").split("-")[0])
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range",
+                    f"bytes {start}-{len(DOWNLOAD_DATA) - 1}/{len(DOWNLOAD_DATA)}",
+                )
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(DOWNLOAD_DATA) - start))
+            self.end_headers()
+            # '?fail=key': the first request for 'key' fails mid-stream
+            if (key := parse_qs(self.url.query).get("fail")) is not None:
+                if key[0] not in self._flaky:
+                    self._flaky[key[0]] = 1
+                    self.wfile.write(DOWNLOAD_DATA[start:][: len(DOWNLOAD_DATA) // 3])
+                    time.sleep(0.2)  # let the client read the data before failing
+                    self.close_connection = True
+                    return
+            self.wfile.write(DOWNLOAD_DATA[start:])
+            return
+        elif self.url.path == GZIP_PATH:
+            # gzip-encoded DOWNLOAD_DATA: Content-Length of the encoded body.
+            # '?force' ignores 'Accept-Encoding: identity'
+            body: bytes = DOWNLOAD_DATA
+            if (
+                self.headers.get("Accept-Encoding") == "identity"
+                and self.url.query != "force"
+            ):
+                self.send_response(200)
+            else:
+                body = gzip.compress(DOWNLOAD_DATA)
+                self.send_response(200)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "max-age=60")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        elif self.url.path == STRAGGLER_PATH:
+            # the first request for each query is slow
+            if self.url.query not in self._flaky:
+                self._flaky[self.url.query] = 1
+                time.sleep(STRAGGLER_WAIT)
+            elif "fail" in parse_qs(self.url.query):
+                # '?fail=1': requests after the first one fail
+                self.send_response(503)
+                self.end_headers()
+                return
+        elif self.url.path == FLAKY_PATH:
+            # fail FLAKY_FAILS first requests for each query
+            fails: int = self._flaky.get(self.url.query, 0)
+            if fails < FLAKY_FAILS:
+                self._flaky[self.url.query] = fails + 1
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
         self.send_response(200)
         if self.url.path == JSON_PATH:
             self.send_header("Content-Type", "application/json")
@@ -277,6 +436,30 @@ class _HttpRequestHandler(BaseHTTPRequestHandler):
     #             self.wfile.write("ERROR".encode())
     #     # assert False, "do_POST()"
 
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Handle POST requests"""
+        body: bytes = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.url.path == ECHO_PATH:
+            encoding: str | None = self.headers.get("Content-Encoding")
+            if encoding == "br":
+                body = brotli.decompress(body)
+            elif encoding == "gzip":
+                body = gzip.decompress(body)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/txt")
+            self.send_header("X-Content-Encoding", str(encoding))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.url.path == FLAKY_PATH:
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/txt")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
     def log_request(self, code=None, size=None):
         """Don't log anything"""
         pass
@@ -307,7 +490,7 @@ def max_rate(timings: list[float], rate: float) -> float:
     min_time: float = min(
         [cums[i + window] - cums[i] for i in range(len(cums) - window)]
     )
-    return (window) / min_time
+    return (window) / min_time if min_time > 0 else float("inf")
 
 
 def avg_rate(timings: list[float]) -> float:
@@ -316,16 +499,23 @@ def avg_rate(timings: list[float]) -> float:
     return n / total
 
 
-async def _get(url: str, rate: float, N: int, **kwargs) -> list[float]:
-    """Test timings of N/sec get"""
+async def _get(
+    url: str, rate: float, N: int, clock: Optional[Clock] = None, **kwargs
+) -> list[float]:
+    """Test timings of N/sec get. Timings are read from the server or,
+    if 'clock' is given, from the clock when the responses arrive"""
     timings: list[float] = list()
     async with ThrottledClientSession(
-        rate_limit=rate, trust_env=True, **kwargs
+        rate_limit=rate, trust_env=True, clock=clock or SYSTEM_CLOCK, **kwargs
     ) as session:
         for _ in range(N):
             async with session.get(url, ssl=False) as resp:
                 assert resp.status == 200, f"request failed, HTTP STATUS={resp.status}"
-                timings.append(datetime.fromisoformat(await resp.text()).timestamp())
+                served: str = await resp.text()
+                if clock is None:
+                    timings.append(datetime.fromisoformat(served).timestamp())
+                else:
+                    timings.append(clock.time())
     return timings
 
 
@@ -346,6 +536,12 @@ def server_url(server_host: str, server_port: int) -> Generator[str, None, None]
     port: int = server_port
     server: _HttpServer = _HttpServer(host=host, port=server_port)
     server.start()
+    for _ in range(50):  # wait the server to start
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
     yield f"http://{host}:{port}/"
     # clean up
     server.terminate()
@@ -387,13 +583,13 @@ async def test_1_fast_get(server_url: str) -> None:
     reason="not supported on windows: asyncio.loop.create_unix_connection",
 )
 @pytest.mark.timeout(60)
-@pytest.mark.asyncio
-async def test_2_slow_get(server_url: str) -> None:
-    """Test timings of N/sec get"""
+def test_2_slow_get(server_url: str) -> None:
+    """Test timings of N/sec get in virtual time"""
     rate_limit: float = RATE_SLOW
     N: int = N_SLOW
-    # await sleep(1)  # wait the server to start
-    timings: list[float] = await _get(server_url, rate=rate_limit, N=N)
+    timings: list[float] = run_virtual(
+        _get(server_url, rate=rate_limit, N=N, clock=LoopClock())
+    )
     rate_max: float = max_rate(timings, rate_limit)
     rate_avg: float = avg_rate(timings)
     message(
@@ -425,6 +621,10 @@ async def test_3_get_json(server_url: str, json_path: str) -> None:
             if (_ := await get_url_JSON(session=session, url=url, retries=2)) is None:
                 assert False, "get_url_JSON() returned None"
         ThrottledClientSession.print_stats(session.stats_dict)  # type: ignore
+        assert session.rate_window(10) == pytest.approx(
+            session.stats_dict["rate_10s"], rel=0.1
+        ), "incorrect windowed rate"
+        assert session.rate_window(10) > 0, "windowed rate is zero"
 
 
 @pytest.mark.skipif(
@@ -432,23 +632,24 @@ async def test_3_get_json(server_url: str, json_path: str) -> None:
     reason="not supported on windows: asyncio.loop.create_unix_connection",
 )
 @pytest.mark.timeout(60)
-@pytest.mark.asyncio
 @pytest.mark.parametrize("limit_filtered,filter", product([True, False], FILTERS))
-async def test_4_filters(
+def test_4_filters(
     server_url: str,
     limit_filtered: bool,
     filter: UrlFilter | Tuple[Optional[str], UrlFilter],
 ) -> None:
-    """Test timings of N/sec get"""
+    """Test timings of N/sec get in virtual time"""
     rate_limit: float = RATE_SLOW
     N: int = N_SLOW
-    await sleep(2)  # wait the server to start
-    timings: list[float] = await _get(
-        server_url,
-        rate=rate_limit,
-        N=N,
-        limit_filtered=limit_filtered,
-        filters=[filter],
+    timings: list[float] = run_virtual(
+        _get(
+            server_url,
+            rate=rate_limit,
+            N=N,
+            clock=LoopClock(),
+            limit_filtered=limit_filtered,
+            filters=[filter],
+        )
     )
     rate_max: float = max_rate(timings, rate_limit)
     rate_avg: float = avg_rate(timings)
@@ -525,23 +726,24 @@ async def test_4_filters(
     reason="not supported on windows: asyncio.loop.create_unix_connection",
 )
 @pytest.mark.timeout(60)
-@pytest.mark.asyncio
 @pytest.mark.parametrize("limit_filtered,filter", product([True, False], FILTERS_FAIL))
-async def test_5_filters_no_match(
+def test_5_filters_no_match(
     server_url: str,
     limit_filtered: bool,
     filter: UrlFilter | Tuple[Optional[str], UrlFilter],
 ) -> None:
-    """Test timings of N/sec get"""
+    """Test timings of N/sec get in virtual time"""
     rate_limit: float = RATE_SLOW
     N: int = N_SLOW
-    await sleep(2)  # wait the server to start
-    timings: list[float] = await _get(
-        server_url,
-        rate=rate_limit,
-        N=N,
-        limit_filtered=limit_filtered,
-        filters=[filter],
+    timings: list[float] = run_virtual(
+        _get(
+            server_url,
+            rate=rate_limit,
+            N=N,
+            clock=LoopClock(),
+            limit_filtered=limit_filtered,
+            filters=[filter],
+        )
     )
     rate_max: float = max_rate(timings, rate_limit)
     rate_avg: float = avg_rate(timings)
@@ -567,6 +769,866 @@ async def test_5_filters_no_match(
                                             {', '.join([str(t) for t in timings])}"""
 
 
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_6_cache(server_url: str, tmp_path: Path) -> None:
+    """Test HTTPCache: fresh hits and ETag revalidation"""
+    N: int = 5
+    cache = HTTPCache(tmp_path)
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST, cache=cache, trust_env=True
+    ) as session:
+        url: str = server_url + CACHE_PATH[1:]
+        content: str | None = await get_url(session, url)
+        assert content is not None, "get_url() returned None"
+        for _ in range(N):
+            assert (
+                await get_url(session, url) == content
+            ), "fresh cache hit returned different content"
+        stats = session.stats_dict
+        assert stats["count"] == 1, f"fresh cache hits made requests: {stats}"
+        assert stats["cache_hits"] == N, f"incorrect cache hit count: {stats}"
+
+        url = server_url + ETAG_PATH[1:]
+        content = await get_url(session, url)
+        for _ in range(N):
+            assert (
+                await get_url(session, url) == content
+            ), "revalidated cache entry returned different content"
+        stats = session.stats_dict
+        assert stats["count"] == N + 2, f"incorrect request count: {stats}"
+        assert stats["cache_revalidated"] == N, f"incorrect revalidated count: {stats}"
+        assert stats["cache_misses"] == 2, f"incorrect cache miss count: {stats}"
+        assert stats["errors"] == 0, f"304 responses counted as errors: {stats}"
+
+        # the decoded body is stored without the transfer headers
+        url = server_url + GZIP_PATH[1:]
+        for _ in range(2):
+            async with session.get(url) as resp:
+                assert await resp.read() == DOWNLOAD_DATA, "incorrect content"
+        assert "Content-Encoding" not in resp.headers, "cached Content-Encoding"
+        assert "Content-Length" not in resp.headers, "cached Content-Length"
+        assert session.stats_dict["cache_hits"] == N + 1, "not a cache hit"
+
+    # concurrent writers of a key do not corrupt the entry
+    cache = HTTPCache(tmp_path / "concurrent")
+    bodies: list[bytes] = [bytes([i]) * (1000 * (i + 1)) for i in range(8)]
+    headers: dict[str, str] = {"Cache-Control": "max-age=60"}
+    for _ in range(20):
+        await gather(*[cache.put("k", 200, "OK", headers, body) for body in bodies])
+        assert (entry := await cache.get("k")) is not None, "entry lost"
+        assert entry.body in bodies, "corrupted cache entry"
+    assert len(list(cache.path.iterdir())) == 1, "temp files left"
+
+    url = server_url + CACHE_PATH[1:]
+    async with ThrottledClientSession(
+        cache=HTTPCache(tmp_path / "concurrent_get"), trust_env=True
+    ) as session:
+        res = await gather(*[get_url(session, url) for _ in range(N)])
+        assert all(r is not None for r in res), "concurrent misses failed"
+        assert await get_url(session, url) in res, "incorrect cached content"
+        assert session.stats_dict["cache_hits"] == 1, "not a cache hit"
+
+    # truncated entries are misses
+    filename: Path = next(f for f in cache.path.iterdir())
+    filename.write_bytes(filename.read_bytes()[:-1])
+    assert await cache.get("k") is None, "truncated entry returned"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_7_coalesce(server_url: str) -> None:
+    """Test coalescing of identical in-flight GET requests"""
+    N: int = 10
+    url: str = server_url + SLOW_PATH[1:]
+    async with ThrottledClientSession(
+        rate_limit=RATE_SLOW, coalesce=True, trust_env=True
+    ) as session:
+        res: list[str | None] = await gather(*[get_url(session, url) for _ in range(N)])
+        assert res[0] is not None, "get_url() returned None"
+        assert all(r == res[0] for r in res), "coalesced requests got different results"
+        stats = session.stats_dict
+        assert stats["count"] == 1, f"coalesced requests made requests: {stats}"
+        assert stats["coalesced"] == N - 1, f"incorrect coalesced count: {stats}"
+
+        async def get_gzip() -> tuple[bytes, str | None]:
+            async with session.get(server_url + GZIP_PATH[1:]) as resp:
+                return await resp.read(), resp.headers.get("Content-Encoding")
+
+        shared = await gather(*[get_gzip() for _ in range(N)])
+        assert session.stats_dict["coalesced"] == 2 * (N - 1), "not coalesced"
+        assert all(
+            body == DOWNLOAD_DATA and encoding is None for body, encoding in shared[1:]
+        ), "coalesced copies describe the body wrongly"
+
+        # a waiter makes the request if only the original request is cancelled
+        leader = create_task(get_url(session, url))
+        await sleep(0.1)
+        waiter = create_task(get_url(session, url))
+        await sleep(0.1)
+        leader.cancel()
+        assert await waiter is not None, "waiter did not make the request"
+        assert leader.cancelled(), "original request was not cancelled"
+
+        # cancelling both cancels the waiter too
+        count: int = session.stats_dict["count"]
+        leader = create_task(get_url(session, url))
+        await sleep(0.1)
+        waiter = create_task(get_url(session, url))
+        await sleep(0.1)
+        leader.cancel()
+        waiter.cancel()
+        await gather(leader, waiter, return_exceptions=True)
+        assert waiter.cancelled(), "waiter swallowed its cancellation"
+        await sleep(SLOW_WAIT)
+        assert session.stats_dict["count"] == count, "cancelled waiter made a request"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "max_inflight,max_inflight_per_host", [(2, 0), (0, 2), (3, 2)]
+)
+async def test_8_max_inflight(
+    server_url: str, max_inflight: int, max_inflight_per_host: int
+) -> None:
+    """Test max in-flight request limits"""
+    N: int = 6
+    limit: int = 2
+    url: str = server_url + SLOW_PATH[1:]
+    max_seen: int = 0
+    max_waiting: int = 0
+
+    async with ThrottledClientSession(
+        max_inflight=max_inflight,
+        max_inflight_per_host=max_inflight_per_host,
+        trust_env=True,
+    ) as session:
+
+        async def _monitor() -> None:
+            nonlocal max_seen, max_waiting
+            while True:
+                max_seen = max(max_seen, session.inflight)
+                max_waiting = max(max_waiting, session.waiting)
+                await sleep(0.05)
+
+        monitor = create_task(_monitor())
+        start: float = time.time()
+        res = await gather(*[get_url(session, url) for _ in range(N)])
+        elapsed: float = time.time() - start
+        monitor.cancel()
+        assert all(r is not None for r in res), "get_url() returned None"
+        assert max_seen <= limit, f"in-flight limit exceeded: {max_seen} > {limit}"
+        assert max_waiting > 0, "no requests were waiting for in-flight slots"
+        assert (
+            elapsed >= SLOW_WAIT * N / limit
+        ), f"requests completed too fast: {elapsed:.2f} secs"
+        stats = session.stats_dict
+        assert stats["inflight"] == 0, f"in-flight slots were not released: {stats}"
+        assert stats["waiting"] == 0, f"incorrect waiting count: {stats}"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_9_latency_stats(server_url: str) -> None:
+    """Test per-host latency histograms"""
+    N: int = 3
+    url: str = server_url + SLOW_PATH[1:]
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST, latency_stats=True, trust_env=True
+    ) as session:
+        for _ in range(N):
+            assert await get_url(session, url) is not None, "get_url() returned None"
+        stats = session.stats_dict
+        for kind in ["headers", "total"]:
+            for q in ["p50", "p95", "p99"]:
+                latency: float = stats[f"latency.{HOST}.{kind}.{q}"]
+                assert (
+                    SLOW_WAIT * 0.8 < latency < SLOW_WAIT * 2
+                ), f"incorrect {kind} latency {q}: {latency:.3f}"
+        assert (
+            stats[f"latency.{HOST}.wait.p99"] < 1 / RATE_FAST * 2
+        ), f"incorrect wait latency: {stats}"
+        assert (
+            f"{HOST} latency" in ThrottledClientSession.print_stats(stats)
+        ), "print_stats() does not print latencies"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_10_priority(server_url: str) -> None:
+    """Test priority lanes for rate-limit tokens"""
+    rate_limit: float = 20
+    N_LOW: int = 20
+    N_HIGH: int = 5
+    done: list[int] = list()
+
+    async def _get(session: ThrottledClientSession, priority: int) -> None:
+        if priority > 0:
+            async with session.get(server_url, priority=priority) as resp:
+                assert resp.status == 200, f"request failed: {resp.status}"
+        else:
+            async with session.get(server_url) as resp:
+                assert resp.status == 200, f"request failed: {resp.status}"
+        done.append(priority)
+
+    async with ThrottledClientSession(rate_limit=rate_limit, trust_env=True) as session:
+        low = [create_task(_get(session, 0)) for _ in range(N_LOW)]
+        await sleep(0.1)
+        await gather(*[_get(session, 10) for _ in range(N_HIGH)], *low)
+        last_high: int = max(i for i, p in enumerate(done) if p == 10)
+        assert (
+            last_high < N_HIGH + 4
+        ), f"high priority requests did not get tokens first: {done}"
+        stats = session.stats_dict
+        assert stats["lane.10.count"] == N_HIGH, f"incorrect lane stats: {stats}"
+        assert (
+            stats["lane.10.wait.p99"] < stats["lane.0.wait.p99"]
+        ), f"high priority lane waited longer: {stats}"
+
+    # reserved capacity for the low priority lane
+    done.clear()
+    async with ThrottledClientSession(
+        rate_limit=rate_limit, lane_reserve={0: 0.5}, trust_env=True
+    ) as session:
+        token = request_priority.set(10)
+        high = [create_task(_get(session, 10)) for _ in range(N_LOW)]
+        request_priority.reset(token)
+        await sleep(0.1)
+        await gather(*[_get(session, 0) for _ in range(N_HIGH)], *high)
+        last_low: int = max(i for i, p in enumerate(done) if p == 0)
+        assert (
+            last_low < 3 * N_HIGH
+        ), f"low priority lane did not get its reserved share: {done}"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_11_retry_policy(server_url: str) -> None:
+    """Test RetryPolicy"""
+    N: int = 3
+    url: str = server_url + FLAKY_PATH[1:]
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST, retry_policy=RetryPolicy(backoff=0.01), trust_env=True
+    ) as session:
+        for i in range(N):
+            async with session.get(f"{url}?retry={i}") as resp:
+                assert resp.status == 200, f"request was not retried: {resp.status}"
+        stats = session.stats_dict
+        assert stats["retries"] == N * FLAKY_FAILS, f"incorrect retry count: {stats}"
+        assert stats["count"] == N * (FLAKY_FAILS + 1), f"incorrect count: {stats}"
+
+        # no retries for non-idempotent methods
+        async with session.post(f"{url}?post=1") as resp:
+            assert resp.status == 503, "POST request was retried"
+
+    # retry budget is exhausted
+    async with ThrottledClientSession(
+        retry_policy=RetryPolicy(backoff=0.01, budget_floor=1, budget=0),
+        trust_env=True,
+    ) as session:
+        async with session.get(f"{url}?budget=1") as resp:
+            assert resp.status == 503, "retried more than the retry budget allows"
+        assert session.retries == 1, f"incorrect retry count: {session.retries}"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_12_json_bytes(server_url: str) -> None:
+    """Test get_url_bytes(), get_url_JSON(loads=) and get_url_NDJSON()"""
+    decoded: list[bytes | bytearray] = list()
+
+    def _loads(content: bytes | bytearray) -> Any:
+        decoded.append(content)
+        return json.loads(content)
+
+    async with ThrottledClientSession(rate_limit=RATE_FAST, trust_env=True) as session:
+        url: str = server_url + JSON_PATH[1:]
+        content: bytes | None = await get_url_bytes(session, url)
+        assert isinstance(content, bytes), "get_url_bytes() did not return bytes"
+        assert isinstance(
+            await get_url_JSON(session, url, loads=_loads), dict
+        ), "get_url_JSON() failed"
+        assert isinstance(decoded[0], bytes), "JSON was not decoded from bytes"
+
+        url = server_url + NDJSON_PATH[1:]
+        items: list[Any] = [item async for item in get_url_NDJSON(session, url)]
+        assert items == _HttpRequestHandler._res_json, "get_url_NDJSON() failed"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "executor,threshold",
+    [("process", 0), ("thread", 0), ("process", None), (None, 0)],
+)
+async def test_13_json_executor(
+    server_url: str, executor: str | None, threshold: int | None
+) -> None:
+    """Test get_url_JSON() decoding in an executor"""
+    pool: Executor | None = None
+    if executor == "process":
+        pool = ProcessPoolExecutor(max_workers=1)
+    elif executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=1)
+    url: str = server_url + JSON_PATH[1:]
+    try:
+        async with ThrottledClientSession(
+            rate_limit=RATE_FAST, trust_env=True
+        ) as session:
+            res = await get_url_JSON(
+                session,
+                url,
+                validate=_decoded_by,
+                executor=pool,
+                executor_threshold=threshold,
+            )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    assert res is not None, "get_url_JSON() failed"
+    pid, thread, obj = res
+    assert isinstance(obj, dict), "get_url_JSON() failed"
+    offloaded: str | None = None
+    if pid != os.getpid():
+        offloaded = "process"
+    elif thread != get_ident():
+        offloaded = "thread"
+    expected: str | None = executor if threshold is not None else None
+    assert offloaded == expected, f"JSON decoded in {offloaded}, expected {expected}"
+
+
+def _decoded_by(obj: Any) -> tuple[int, int, Any]:
+    """Return the process and thread that decoded JSON. Top-level to be
+    picklable for ProcessPoolExecutor"""
+    return os.getpid(), get_ident(), obj
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "url_path,resume_from",
+    [
+        (DOWNLOAD_PATH, 0),
+        (DOWNLOAD_PATH, len(DOWNLOAD_DATA) // 3),
+        (DOWNLOAD_PATH + "?fail=start", 0),  # retry resumes the failed download
+        (DOWNLOAD_PATH + "?fail=resume", len(DOWNLOAD_DATA) // 4),
+        (GZIP_PATH, 0),
+        (GZIP_PATH + "?force", 0),  # Content-Encoding despite 'identity'
+    ],
+)
+async def test_14_download_url(
+    server_url: str, tmp_path: Path, url_path: str, resume_from: int
+) -> None:
+    """Test download_url()"""
+    url: str = server_url + url_path[1:]
+    path: Path = tmp_path / "download.bin"
+    part: Path = tmp_path / "download.bin.part"
+    if resume_from > 0:
+        part.write_bytes(DOWNLOAD_DATA[:resume_from])
+    digest = sha256()
+    async with ThrottledClientSession(rate_limit=RATE_FAST, trust_env=True) as session:
+        assert (
+            await download_url(session, url, path, digest=digest, chunk_size=4096)
+            == path
+        ), "download_url() failed"
+    assert path.read_bytes() == DOWNLOAD_DATA, "downloaded file differs"
+    assert not part.exists(), "partial file was not renamed"
+    assert (
+        digest.hexdigest() == sha256(DOWNLOAD_DATA).hexdigest()
+    ), "incorrect checksum"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "encoding,throttled", product(["br", "gzip"], [True, False])
+)
+async def test_15_compress(server_url: str, encoding: str, throttled: bool) -> None:
+    """Test compressed request bodies in post_url()"""
+    url: str = server_url + ECHO_PATH[1:]
+    data: str = json.dumps(json_data() * 50)
+    session: ClientSession
+    if throttled:
+        session = ThrottledClientSession(rate_limit=RATE_FAST, trust_env=True)
+    else:
+        session = ClientSession(trust_env=True)
+    async with session:
+        assert (
+            await post_url(session, url, data=data, compress=encoding) == data
+        ), "compressed body was not decoded correctly"
+        assert (
+            await post_url(session, url, data="small", compress=encoding) == "small"
+        ), "small body was not sent correctly"
+        if isinstance(session, ThrottledClientSession):
+            stats: dict[str, float | int] = session.stats_dict
+            assert stats["compressed"] == 1, "small body should not be compressed"
+            assert 0 < stats["compress_saved"] < len(data), "incorrect bytes saved"
+            assert "compressed bodies: 1" in session.stats, "stats missing compression"
+
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST, compress=encoding, trust_env=True
+    ) as session:
+        async with session.post(url, json=json_data() * 50) as resp:
+            assert resp.headers["X-Content-Encoding"] == encoding, (
+                "session did not compress JSON body"
+            )
+            assert await resp.json(content_type=None) == json_data() * 50, (
+                "incorrect JSON body"
+            )
+        assert session.stats_dict["compressed"] == 1, "incorrect compressed count"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("write_index", [True, False])
+async def test_16_archive(server_url: str, tmp_path: Path, write_index: bool) -> None:
+    """Test recording and replaying traffic with HTTPArchive"""
+    path: Path = tmp_path / "traffic.archive"
+    N: int = 5
+    urls: list[str] = [f"{server_url}{JSON_PATH[1:]}?id={i}" for i in range(N)]
+    post: str = server_url + ECHO_PATH[1:]
+    payload: str = json.dumps(json_data())
+    recorded: list[Any] = list()
+
+    archive = HTTPArchive(path, mode="record")
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST, archive=archive, trust_env=True
+    ) as session:
+        for url in urls:
+            recorded.append(await get_url_JSON(session, url))
+        assert await post_url(session, post, data=payload) == payload, "POST failed"
+        assert session.stats_dict["archive_recorded"] == N + 1, "incorrect count"
+    if write_index:
+        await archive.close()
+        assert archive.index_path.exists(), "index was not written"
+    assert len(archive) == N + 1, "incorrect number of archived requests"
+
+    # replay ignores the rate limit
+    async with HTTPArchive(path, mode="replay") as archive:
+        assert len(archive) == N + 1, "archive index was not loaded"
+        async with ThrottledClientSession(
+            rate_limit=RATE_SLOW, archive=archive
+        ) as session:
+            start: float = time.time()
+            for _ in range(2):
+                for url, res in zip(urls, recorded):
+                    assert await get_url_JSON(session, url) == res, "incorrect replay"
+            assert await post_url(session, post, data=payload) == payload, (
+                "incorrect POST replay"
+            )
+            assert time.time() - start < 1 / RATE_SLOW, "replay was rate-limited"
+            assert session.stats_dict["archive_replayed"] == 2 * N + 1
+
+            with pytest.raises(HTTPArchiveMiss):
+                await session.get(server_url + "not-recorded")
+            assert (
+                await post_url(session, post, data="not recorded", retries=1) is None
+            ), "missing POST body should not be replayed"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("budget", [1.0, 0.0])
+async def test_17_hedge(server_url: str, budget: float) -> None:
+    """Test hedged requests"""
+    N: int = 3
+    url: str = server_url + STRAGGLER_PATH[1:]
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST,
+        hedge=True,
+        hedge_delay=0.2,
+        hedge_budget=budget,
+        trust_env=True,
+    ) as session:
+        start: float = time.time()
+        for i in range(N):
+            assert (
+                await get_url(session, f"{url}?budget={budget}&id={i}") is not None
+            ), "get_url() failed"
+        duration: float = time.time() - start
+        stats = session.stats_dict
+        hedged: int = int(stats["hedged"])
+        # the budget allows always one hedge
+        expected: int = N if budget > 0 else 1
+        assert hedged == expected, f"incorrect number of hedges: {hedged}"
+        assert stats["hedge_wins"] == hedged, "hedges should win stragglers"
+        assert duration < (N - hedged + 1) * STRAGGLER_WAIT, "hedging did not help"
+        assert stats["count"] == N, "hedges should not be counted as requests"
+        assert session.hedge_delay("localhost") == 0.2, "incorrect hedge delay"
+        assert "hedged: " in session.stats, "hedges missing from stats"
+
+        if budget > 0:
+            # stragglers were cancelled, the delay adapts to the fast responses
+            for _ in range(HEDGE_MIN_SAMPLES):
+                assert await get_url(session, server_url) is not None, "GET failed"
+            assert session.hedge_delay("localhost") < 0.2, "hedge delay did not adapt"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_17_hedge_limits(server_url: str) -> None:
+    """Test hedge requests respect in-flight limits and the circuit breaker"""
+    url: str = server_url + STRAGGLER_PATH[1:]
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST,
+        hedge=True,
+        hedge_delay=0.2,
+        max_inflight=1,
+        trust_env=True,
+    ) as session:
+        start: float = time.time()
+        assert await get_url(session, f"{url}?inflight=1") is not None, "GET failed"
+        # the hedge waits for the in-flight slot held by the straggler
+        assert time.time() - start >= STRAGGLER_WAIT * 0.9, "hedge exceeded max_inflight"
+        assert session.stats_dict["hedge_wins"] == 0, "hedge exceeded max_inflight"
+        assert session.inflight == 0, "in-flight slots not released"
+
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST,
+        hedge=True,
+        hedge_delay=0.2,
+        circuit_breaker=CircuitBreaker(failures=2),
+        trust_env=True,
+    ) as session:
+        # the hedge fails fast with 503 and is reported to the breaker
+        async with session.get(f"{url}?fail=1") as resp:
+            assert resp.status == 503, "hedge response did not win"
+        assert session.stats_dict["hedged"] == 1, "request was not hedged"
+        assert session.stats_dict["circuit.localhost"] == 2, "hedge failure not reported"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_18_circuit_breaker(server_url: str) -> None:
+    """Test per-host circuit breaker"""
+    url: str = server_url + FLAKY_PATH[1:]
+    open_time: float = 0.5
+    async with ThrottledClientSession(
+        rate_limit=RATE_FAST,
+        circuit_breaker=CircuitBreaker(failures=FLAKY_FAILS, open_time=open_time),
+        retry_policy=RetryPolicy(backoff=0.01),
+        trust_env=True,
+    ) as session:
+        # the URL fails FLAKY_FAILS times, the retry after that is rejected
+        with pytest.raises(CircuitOpenError):
+            async with session.get(f"{url}?circuit=1"):
+                pass
+        assert session.retries == FLAKY_FAILS, "open circuit should not be retried"
+        stats = session.stats_dict
+        assert stats["circuit.localhost"] == 2, "circuit should be open"
+
+        start: float = time.time()
+        assert await get_url(session, server_url) is None, "open circuit passed"
+        assert time.time() - start < 0.1, "get_url() should fail fast"
+        assert session.count == FLAKY_FAILS, "rejected requests should not be sent"
+        assert session.stats_dict["circuit_rejected"] == 2, "incorrect rejected count"
+        assert "circuit open: localhost" in session.stats, "open circuit not in stats"
+
+        await sleep(open_time)
+        assert await get_url(session, server_url) is not None, "probe failed"
+        assert session.stats_dict["circuit.localhost"] == 0, "circuit should close"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_19_batch_loader(server_url: str) -> None:
+    """Test BatchLoader.from_url() with ThrottledClientSession"""
+    N: int = 250
+    url: str = server_url + IDS_PATH[1:]
+    async with ThrottledClientSession(rate_limit=RATE_SLOW, trust_env=True) as session:
+        loader: BatchLoader[int, dict] = BatchLoader.from_url(
+            session,
+            url,
+            param="account_id",
+            split=lambda res: {int(id): item for id, item in res["data"].items()},
+        )
+        start: float = time.time()
+        res: list[dict | None] = await loader.load_many(range(N))
+        assert res == [{"id": i} for i in range(N)], "incorrect results"
+        assert session.count == 3, "IDs were not batched"
+        assert time.time() - start < 3 / RATE_SLOW, "batching took too long"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_20_session_pool(server_url: str) -> None:
+    """Test SessionPool routing and ejection"""
+    N: int = 20
+    rate_limit: float = 10
+    url: str = server_url + THROTTLE_PATH[1:]
+    async with SessionPool() as pool:
+        for key in ["key1", "key2"]:
+            pool.add(
+                ThrottledClientSession(rate_limit=rate_limit, trust_env=True),
+                params={"key": key},
+            )
+        start: float = time.time()
+        res = await gather(*[get_url(pool, url) for _ in range(N)])
+        duration: float = time.time() - start
+        assert all(r is not None for r in res), "requests failed"
+        counts: list[int] = [session.count for session in pool.sessions]
+        assert abs(counts[0] - counts[1]) <= 2, f"unbalanced routing: {counts}"
+        assert duration < N / rate_limit, "pool did not use both members"
+        stats = pool.stats_dict
+        assert stats["count"] == N, "incorrect aggregate count"
+        assert stats["rate_limit"] == 2 * rate_limit, "incorrect aggregate rate limit"
+
+        # the member does not retry 429 itself (Retry-After: 60)
+        shared = RetryPolicy()
+        pool.add(
+            ThrottledClientSession(
+                rate_limit=RATE_FAST, retry_policy=shared, trust_env=True
+            ),
+            params={"key": "throttled"},
+        )
+        policy = pool.sessions[2].retry_policy
+        assert policy is not None and 429 not in policy.statuses, "429 is retried"
+        assert 429 in shared.statuses, "the caller's RetryPolicy was modified"
+        start = time.time()
+        for _ in range(3):
+            assert await get_url(pool, url) is not None, "request was not rerouted"
+        assert time.time() - start < 5, "member retried the eject status"
+        assert pool.available == 2, "throttled member was not ejected"
+        assert pool.sessions[2].count == 1, "ejected member should not get requests"
+        assert pool.stats_dict["ejections"] == 1, "incorrect ejection count"
+        assert "ejections: 1" in pool.stats, "ejections missing from stats"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("filtered", [False, True])
+async def test_21_bandwidth(server_url: str, filtered: bool) -> None:
+    """Test download and upload bandwidth limits"""
+    bandwidth: float = 100_000  # bytes/sec
+    size: int = len(DOWNLOAD_DATA)
+    kwargs: dict[str, Any] = {"bandwidth": bandwidth, "upload_bandwidth": bandwidth}
+    if filtered:
+        kwargs = {"bandwidth_filters": [(server_url, bandwidth, bandwidth)]}
+    async with ThrottledClientSession(trust_env=True, **kwargs) as session:
+        start: float = time.time()
+        assert (
+            await get_url_bytes(session, server_url + DOWNLOAD_PATH[1:])
+            == DOWNLOAD_DATA
+        ), "incorrect download"
+        duration: float = time.time() - start
+        assert duration >= (size - bandwidth) / bandwidth * 0.9, (
+            "download bandwidth limit exceeded"
+        )
+
+        start = time.time()
+        async with session.post(
+            server_url + ECHO_PATH[1:], data=DOWNLOAD_DATA
+        ) as resp:
+            assert await resp.read() == DOWNLOAD_DATA, "incorrect upload"
+        duration = time.time() - start
+        assert duration >= 2 * (size - bandwidth) / bandwidth * 0.9, (
+            "upload bandwidth limit exceeded"
+        )
+
+        stats: dict[str, float | int] = session.stats_dict
+        assert stats["bytes_in"] == 2 * size, "incorrect bytes received"
+        assert stats["bytes_out"] == size, "incorrect bytes sent"
+        assert "received: " in session.stats, "byte counters missing from stats"
+
+    async with ThrottledClientSession(
+        bandwidth_filters=[("http://example.com", bandwidth, bandwidth)],
+        trust_env=True,
+    ) as session:
+        start = time.time()
+        assert (
+            await get_url_bytes(session, server_url + DOWNLOAD_PATH[1:])
+            == DOWNLOAD_DATA
+        ), "incorrect download"
+        assert time.time() - start < 1, "unfiltered download was throttled"
+        assert session.stats_dict["bytes_in"] == size, "incorrect bytes received"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("async_dns", [True, False])
+async def test_22_connection_stats(async_dns: bool) -> None:
+    """Test connector options, DNS warm-up and connection metrics"""
+    N: int = 10
+
+    async def handler(request: web.Request) -> web.Response:
+        return web.json_response({"path": request.path})
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    async with TestServer(app, host=HOST) as server:
+        url: str = f"http://{HOST}:{server.port}/"
+        async with ThrottledClientSession(
+            rate_limit=RATE_FAST,
+            limit_per_host=1,
+            keepalive_timeout=30,
+            async_dns=async_dns,
+            warm_up=[url],
+            connection_stats=True,
+            trust_env=True,
+        ) as session:
+            assert await session.warm_up([url, url + "other"]) == 1, (
+                "incorrect number of hosts resolved"
+            )
+            res = await gather(*[get_url_JSON(session, f"{url}{i}") for i in range(N)])
+            assert all(r is not None for r in res), "requests failed"
+            stats: dict[str, float | int] = session.stats_dict
+            assert stats["connections_new"] == 1, "connection was not reused"
+            assert stats["connections_reused"] == N - 1, "incorrect reused count"
+            assert stats[f"connections.{HOST}.reused"] == N - 1, (
+                "incorrect per-host reused count"
+            )
+            assert stats["dns_lookups"] == 0, "warm-up did not resolve the host"
+            assert stats["dns_cache_hits"] == 1, "incorrect DNS cache hits"
+            assert "connections new: 1" in session.stats, "metrics missing from stats"
+
+            # falls back to the resolver without TCPConnector._resolve_host()
+            with pytest.MonkeyPatch.context() as mp:
+                mp.delattr(TCPConnector, "_resolve_host")
+                assert await session.warm_up([url]) == 1, "fallback did not resolve"
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_23_shared_rate_limiter(server_url: str) -> None:
+    """Test sessions sharing a RateLimiter"""
+    N: int = 20
+    rate_limit: float = 10
+    url: str = server_url + JSON_PATH[1:]
+    limiter = RateLimiter(rate_limit=rate_limit)
+    async with (
+        ThrottledClientSession(rate_limiter=limiter, trust_env=True) as session1,
+        ThrottledClientSession(rate_limiter=limiter, trust_env=True) as session2,
+    ):
+        assert session1.rate_limit == rate_limit, "incorrect rate limit"
+        start: float = time.time()
+        res = await gather(
+            *[get_url_JSON(session, url) for session in [session1, session2] * (N // 2)]
+        )
+        duration: float = time.time() - start
+        assert all(r is not None for r in res), "requests failed"
+        assert duration >= (N - 1) / rate_limit * 0.95, "shared rate limit exceeded"
+        assert limiter.acquired == N, "incorrect acquired count"
+    async with limiter:  # limiter is not closed with the sessions
+        pass
+    await limiter.close()
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="not supported on windows: asyncio.loop.create_unix_connection",
+)
+@pytest.mark.timeout(60)
+@pytest.mark.parametrize("path,N,rate_limit", [(JSON_PATH, 30, 2), (SLOW_PATH, 5, 10)])
+def test_24_virtual_time(server_url: str, path: str, N: int, rate_limit: float) -> None:
+    """Test ThrottledClientSession with real I/O in virtual time"""
+    url: str = server_url + path[1:]
+    clock = LoopClock()
+
+    async def main() -> tuple[list[int], float, float]:
+        async with ThrottledClientSession(
+            rate_limit=rate_limit,
+            clock=clock,
+            timeout=ClientTimeout(total=5 * SLOW_WAIT),
+            trust_env=True,
+        ) as session:
+
+            async def get() -> int:
+                async with session.get(url) as resp:
+                    await resp.read()
+                    return resp.status
+
+            start: float = clock.monotonic()
+            res: list[int] = await gather(*[get() for _ in range(N)])
+            return res, clock.monotonic() - start, session.stats_dict["rate"]
+
+    wall: float = time.monotonic()
+    res, elapsed, rate = run_virtual(main())
+    wall = time.monotonic() - wall
+    assert res == [200] * N, "requests failed or timed out"
+    assert elapsed >= (N - 1) / rate_limit * 0.95, "rate limit exceeded"
+    assert elapsed <= N / rate_limit + SLOW_WAIT + 1, "virtual time jumped"
+    assert rate <= rate_limit * 1.1, f"incorrect rate in virtual time: {rate:.1f}"
+    if path == JSON_PATH:
+        assert wall < elapsed / 5, f"virtual time ran at wall-clock speed: {wall:.1f}"
+
+
 # @pytest.mark.skipif(
 #     sys.platform == "win32",
 #     reason="not supported on windows: asyncio.loop.create_unix_connection",
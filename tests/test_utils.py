@@ -5,6 +5,9 @@ from typing import Annotated, Optional, List, Sequence
 # from unittest import result
 import pytest  # type: ignore
 from pathlib import Path
+from random import random
+from asyncio import create_task, gather, sleep
+from contextlib import aclosing
 import click
 from typer import Typer, Context, Option
 import logging
@@ -19,6 +22,8 @@ from pyutils.utils import (
     get_type,
     get_subtype,
     add_suffix,
+    async_cache,
+    fetch_many,
 )
 from pyutils import awrap
 
@@ -344,3 +349,164 @@ def test_9_add_suffix(path: Path, suffix: str, res: Path) -> None:
     assert (
         add_suffix(path, suffix) == res
     ), f"incorrect result: {str(path)} != {str(res)}"
+
+
+async def _fetch(session: None, url: str) -> str:
+    """Fake fetch for fetch_many() tests"""
+    global _running, _max_running
+    _running += 1
+    _max_running = max(_running, _max_running)
+    try:
+        await sleep(random() / 100)
+        if url.endswith("error"):
+            raise ValueError(url)
+        return url.upper()
+    finally:
+        _running -= 1
+
+
+_running: int = 0
+_max_running: int = 0
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("ordered", [True, False])
+async def test_10_fetch_many(ordered: bool) -> None:
+    """Test fetch_many()"""
+    global _max_running
+    _max_running = 0
+    N: int = 100
+    concurrency: int = 5
+    urls: list[str] = [f"http://localhost/{i}" for i in range(N)] + ["/error"]
+    res: list[str] = list()
+    errors: int = 0
+    async for url, result in fetch_many(
+        None,  # type: ignore
+        awrap(urls),
+        concurrency=concurrency,
+        ordered=ordered,
+        fetch=_fetch,
+    ):
+        if isinstance(result, Exception):
+            errors += 1
+            continue
+        assert result == url.upper(), f"incorrect result for {url}: {result}"
+        res.append(url)
+    assert errors == 1, f"errors were not returned: {errors}"
+    assert len(res) == N, f"incorrect number of results: {len(res)} != {N}"
+    assert (res == urls[:N]) == ordered, f"incorrect result order, ordered={ordered}"
+    assert _max_running == concurrency, f"incorrect concurrency: {_max_running}"
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+async def test_11_fetch_many_cancel() -> None:
+    """Test closing fetch_many() early"""
+    urls: list[str] = [f"http://localhost/{i}" for i in range(1000)]
+    async with aclosing(
+        fetch_many(None, urls, concurrency=10, fetch=_fetch)  # type: ignore
+    ) as results:
+        async for _ in results:
+            break
+    await sleep(0.05)
+    assert _running == 0, f"workers are still running: {_running}"
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.asyncio
+async def test_12_async_cache(tmp_path: Path) -> None:
+    """Test async_cache() decorator"""
+    calls: list[int] = list()
+
+    @async_cache(maxsize=3, ttl=0.2)
+    async def square(n: int) -> int:
+        calls.append(n)
+        await sleep(0.01)
+        return n * n
+
+    assert await gather(*[square(2) for _ in range(5)]) == [4] * 5
+    assert calls == [2], "concurrent calls were not deduped"
+    assert await square(2) == 4 and calls == [2], "result was not cached"
+    for n in range(3, 6):
+        await square(n)
+    assert len(square) == 3, "maxsize exceeded"
+    await square(2)
+    assert calls.count(2) == 2, "LRU entry was not evicted"
+    await sleep(0.2)
+    await square(2)
+    assert calls.count(2) == 3, "entry did not expire"
+    stats = square.stats_dict
+    assert stats["hits"] == 1 and stats["deduped"] == 4, "incorrect stats"
+    assert stats["evictions"] == 2, "incorrect evictions"
+    assert "hit ratio" in square.stats, "incorrect stats str"
+    assert getattr(square, "__name__") == "square", "function was not wrapped"
+
+    @async_cache(maxsize=0, maxbytes=2000, cache_none=True)
+    async def data(n: int) -> list[int] | None:
+        return None if n < 0 else list(range(n))
+
+    await data(50)  # ~ 1.5 KiB
+    await data(20)
+    assert len(data) == 1 and data.stats_dict["bytes"] <= 2000, "maxbytes exceeded"
+    await data(-1)
+    assert len(data) == 2, "None was not cached"
+
+    path: Path = tmp_path / "cache.pickle"
+
+    @async_cache(path=path, key=lambda session, n: n)
+    async def fetch(session: object, n: int) -> str:
+        calls.append(n)
+        return str(n)
+
+    await fetch(object(), 10)
+    assert fetch.save() == 1, "incorrect number of entries saved"
+
+    @async_cache(path=path, key=lambda session, n: n)
+    async def fetch2(session: object, n: int) -> str:
+        calls.append(n)
+        return str(n)
+
+    assert await fetch2(object(), 10) == "10", "incorrect persisted result"
+    assert calls.count(10) == 1, "persisted entry was not loaded"
+
+    @async_cache()
+    async def fail() -> None:
+        raise ValueError("fail")
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            await fail()
+    assert fail.misses == 2, "exceptions should not be cached"
+
+    # a cancelled first caller does not cancel the deduped callers
+    @async_cache()
+    async def slow(n: int) -> int:
+        calls.append(n)
+        await sleep(0.05)
+        return n
+
+    first = create_task(slow(20))
+    await sleep(0)
+    others = gather(*[slow(20) for _ in range(3)])
+    await sleep(0.01)
+    first.cancel()
+    assert await others == [20] * 3, "deduped callers were cancelled"
+    assert first.cancelled(), "first caller was not cancelled"
+    assert calls.count(20) == 2, "call was not made again once"
+
+    # methods
+    class Lookup:
+        def __init__(self, offset: int) -> None:
+            self.offset: int = offset
+
+        @async_cache()
+        async def get(self, n: int) -> int:
+            calls.append(n)
+            return n + self.offset
+
+    one, two = Lookup(1), Lookup(2)
+    assert await one.get(30) == 31 and await one.get(30) == 31, "incorrect result"
+    assert await two.get(30) == 32, "instances share results"
+    assert calls.count(30) == 2, "method results were not cached"
+    assert one.get.stats_dict["hits"] == 1, "incorrect method cache stats"